@@ -3,11 +3,11 @@ import contextlib
 
 with contextlib.redirect_stdout(None):
     import pygame as pg
-from pygame import freetype
 from pygame.locals import (
-    QUIT,
     KEYDOWN,
     K_ESCAPE,
+    K_s,
+    KMOD_CTRL,
     MOUSEBUTTONDOWN,
     MOUSEMOTION,
     MOUSEBUTTONUP
@@ -15,53 +15,109 @@ from pygame.locals import (
 
 
 from app.rendering.chipeditor import ChipEditor
+from app.simthread import SimulationThread
 
 class Application:
 
+    TITLE = 'Digital Logic Simulation'
+
     WINDOW_WIDTH = 1024
     WINDOW_HEIGTH = 576
 
     FPS_MAX = 60
 
-    def __init__(self):
+    # block on input events instead of rendering at FPS_MAX when nothing happens
+    IDLE_WAIT = True
+    # while a simulation runs, wake up at this interval (ms) to show its progress
+    SIMULATION_POLL_MS = 1000 // FPS_MAX
+
+    # mouse buttons (as numbered by pygame) dragging the view, and the wheel zooming it
+    PAN_BUTTONS = (2, 3)
+    WHEEL_UP = 4
+    WHEEL_DOWN = 5
+
+    # where the circuit is saved to when no file was opened
+    DEFAULT_PATH = 'circuit.dlsb'
+
+    def __init__(self, path=None):
 
         pg.init()
+
+        # file the circuit was loaded from and is saved to
+        self.path = path
          
         self.running = False
         self.clock = None
         self.main_window = None
 
         self.chip_editor = None
+        self.simulation = None
+        # errors of the simulation already shown in the window title
+        self.shown_error_count = 0
 
     def start(self):
-        pg.display.set_caption('Digital Logic Simulation')
+        pg.display.set_caption(self.TITLE)
         self.main_window = pg.display.set_mode((self.WINDOW_WIDTH, self.WINDOW_HEIGTH))
         self.clock = pg.time.Clock()
 
-        self.chip_editor = ChipEditor(self.WINDOW_WIDTH, self.WINDOW_HEIGTH)
+        # signals propagate on a worker thread so the window stays responsive
+        self.simulation = SimulationThread()
+        self.chip_editor = ChipEditor(self.WINDOW_WIDTH, self.WINDOW_HEIGTH, self.simulation, self.path)
+        self.simulation.start()
+
+        # the editor covers the whole window, so it is only cleared once
+        self.clear()
+        self.update()
 
         self.running = True
         while self.running:
-            self.clear()
             self.poll_events()
             self.update()
 
+        self.simulation.stop()
         pg.quit()
 
     def clear(self):
         self.main_window.fill((255, 255, 255))
 
+    def next_events(self):
+        """
+            Returns the pending events. In idle wait mode, blocks until there is at least
+            one, or until it is time to show the progress of a running simulation
+        """
+        if not self.IDLE_WAIT:
+            return pg.event.get()
+
+        # a timeout of 0 waits forever
+        timeout = self.SIMULATION_POLL_MS if self.chip_editor.SimulationRunning else 0
+        event = pg.event.wait(timeout)
+        if event.type == pg.NOEVENT:
+            return []
+
+        return [event] + pg.event.get()
+
     def poll_events(self):
-        for event in pg.event.get():
+        for event in self.next_events():
             if event.type == pg.QUIT or (event.type == KEYDOWN and event.key == K_ESCAPE):
                 self.running = False
                 return
 
+            elif event.type == KEYDOWN and event.key == K_s and event.mod & KMOD_CTRL:
+                self.save()
+
             elif event.type == MOUSEMOTION:
+                # buttons are reported left, middle, right (1, 2, 3)
+                if any(event.buttons[button - 1] for button in self.PAN_BUTTONS):
+                    self.chip_editor.pan(*event.rel)
                 self.chip_editor.on_mouse_move(*pg.mouse.get_pos())
             
             elif event.type == MOUSEBUTTONDOWN:
-                self.chip_editor.on_mouse_down()
+                if event.button == self.WHEEL_UP:
+                    self.chip_editor.zoom(1, *pg.mouse.get_pos())
+                elif event.button == self.WHEEL_DOWN:
+                    self.chip_editor.zoom(-1, *pg.mouse.get_pos())
+                elif event.button == 1:
+                    self.chip_editor.on_mouse_down()
                 # if event.button == 3:
                 #     callback_event = MouseDownEvent(MouseButton.Right, mouse_pos[0], mouse_pos[1])
                 # elif event.button == 1:
@@ -72,19 +128,49 @@ class Application:
                 #     callback_event = MouseScrollEvent(MouseScrollDirection.Down)
 
             elif event.type == MOUSEBUTTONUP:
-                self.chip_editor.on_mouse_up()
+                if event.button == 1:
+                    self.chip_editor.on_mouse_up()
                 # if event.button == 3:
                     # callback_event = MouseReleaseEvent(MouseButton.Right, mouse_pos[0], mouse_pos[1])
                 # elif event.button == 1:
                     # callback_event = MouseReleaseEvent(MouseButton.Left, mouse_pos[0], mouse_pos[1])
 
+    def save(self):
+        """
+            Saves the circuit, showing why in the window title if that fails (e.g. a
+            read-only file or a wire the file format can't hold)
+        """
+        path = self.path or self.DEFAULT_PATH
+        try:
+            self.chip_editor.save(path)
+        except (OSError, ValueError) as error:
+            pg.display.set_caption(f'{self.TITLE} - could not save {path}: {error}')
+        else:
+            pg.display.set_caption(f'{self.TITLE} - saved {path}')
+
+    def show_errors(self):
+        """
+            Shows the last error of the simulation (e.g. an oscillating circuit) in the window title,
+            as the circuit stops updating past it
+        """
+        simulation = self.simulation
+        if simulation.error_count != self.shown_error_count:
+            self.shown_error_count = simulation.error_count
+            pg.display.set_caption(f'{self.TITLE} - error: {simulation.last_error}')
+
     def update(self):
         self.clock.tick(self.FPS_MAX)
+        self.show_errors()
     
-        self.chip_editor.update()
-        self.main_window.blit(self.chip_editor.RenderResult, (0, 0))
+        # only the regions the editor redrew are copied and pushed to the screen
+        dirty_rects = self.chip_editor.update()
+        if not dirty_rects:
+            return
+
+        for rect in dirty_rects:
+            self.main_window.blit(self.chip_editor.RenderResult, rect, rect)
 
-        pg.display.update()
+        pg.display.update(dirty_rects)
 
 
         
@@ -0,0 +1,422 @@
+"""
+    Reproducible benchmarks of the simulation, using reference circuits built
+    only from the builtin gates and custom chips. Runs without pygame.
+
+    Usage:
+
+        python -m app.benchmark [--scale N] [--changes N] [--json FILE] [--compare FILE]
+
+    Every circuit is measured twice: driving the object graph of app/pins.py
+    directly ("object") and through the compiled netlist engine ("netlist").
+    Reported per circuit and mode:
+
+        build_seconds          time to build the circuit (and compile it, for netlist)
+        peak_memory_bytes      peak python allocations while building
+        changes_per_sec        single input changes propagated per second
+        gate_evals_per_sec     gate evaluations per second
+        recv_signal_per_change recv_signal calls per input change (object mode only)
+
+    Custom chips of the reference circuits are built without their truth table
+    cache and generated code, so every change runs the gates of their netlist and
+    gate evaluations are counted for them too. In object mode, gate_evals_per_sec
+    comes from a separate pass with counting enabled, so it includes the cost of
+    counting, changes_per_sec is measured without it.
+
+    Inputs are toggled in a pseudo random but fixed order, so runs on the same
+    machine are comparable. --json writes the results to a file, --compare prints
+    the speed of this run relative to an earlier one.
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+import app.chip
+from app.pins import ChipPin, InputSignalPin, OutputSignalPin
+from app.chip import custom_chip_factory
+from app.builtinchips import AndGate, OrGate, NotGate
+from app.netlist import compile_circuit
+from app.engine import NetlistSimulator
+
+
+# Reference circuits
+#
+# Builders return the input and output signals of a circuit. Operands are
+# emitters (input signals or output pins of chips), None stands for a
+# constant 0 and is simply left unconnected.
+
+def _connect(source, target):
+    if source is not None:
+        source.connect_to(target)
+
+
+def _gate(gate_cls, *operands):
+    gate = gate_cls()
+    for operand, pin in zip(operands, gate.input_pins):
+        _connect(operand, pin)
+    return gate.output_pins[0]
+
+
+def _package(name, input_count, build):
+    """
+        Builds a custom chip factory from a function mapping input signals to output pins.
+        Caching and code generation are left out, see the module docstring
+    """
+    inputs = [InputSignalPin() for _ in range(input_count)]
+    outputs = []
+    for pin in build(inputs):
+        signal = OutputSignalPin()
+        pin.connect_to(signal)
+        outputs.append(signal)
+    return custom_chip_factory(name, inputs, outputs, cache_size=0, codegen=False)
+
+
+def _xor(a, b):
+    # (a OR b) AND NOT (a AND b)
+    return _gate(AndGate, _gate(OrGate, a, b), _gate(NotGate, _gate(AndGate, a, b)))
+
+
+def _full_adder_factory():
+    def build(inputs):
+        a, b, cin = inputs
+        half = _xor(a, b)
+        carry = _gate(OrGate, _gate(AndGate, a, b), _gate(AndGate, half, cin))
+        return [_xor(half, cin), carry]
+
+    return _package("FULL ADDER", 3, build)
+
+
+def _chip(factory, *operands):
+    chip = factory()
+    for operand, pin in zip(operands, chip.input_pins):
+        _connect(operand, pin)
+    return chip.output_pins
+
+
+def _ripple_add(full_adder, a, b, carry=None):
+    sums = []
+    for x, y in zip(a, b):
+        s, carry = _chip(full_adder, x, y, carry)
+        sums.append(s)
+    return sums, carry
+
+
+def ripple_carry_adder(bits):
+    full_adder = _full_adder_factory()
+    a = [InputSignalPin() for _ in range(bits)]
+    b = [InputSignalPin() for _ in range(bits)]
+    sums, carry = _ripple_add(full_adder, a, b)
+    return a + b, sums + [carry]
+
+
+def array_multiplier(bits):
+    full_adder = _full_adder_factory()
+    a = [InputSignalPin() for _ in range(bits)]
+    b = [InputSignalPin() for _ in range(bits)]
+
+    products = [[_gate(AndGate, x, y) for x in a] for y in b]
+
+    result = [products[0][0]]
+    acc = products[0][1:] + [None]
+    for row in products[1:]:
+        sums, carry = _ripple_add(full_adder, acc, row)
+        result.append(sums[0])
+        acc = sums[1:] + [carry]
+
+    return a + b, result + acc
+
+
+def inverter_chain(depth):
+    a = InputSignalPin()
+    pin = a
+    for _ in range(depth):
+        pin = _gate(NotGate, pin)
+    return [a], [pin]
+
+
+def fanout_tree(levels, fanout=4):
+    a = InputSignalPin()
+    layer = [_gate(NotGate, a)]
+    for _ in range(levels):
+        layer = [_gate(NotGate, pin) for pin in layer for _ in range(fanout)]
+    return [a], layer
+
+
+def decoder(bits):
+    inputs = [InputSignalPin() for _ in range(bits)]
+    inverted = [_gate(NotGate, pin) for pin in inputs]
+
+    outputs = []
+    for value in range(1 << bits):
+        literals = [inputs[i] if (value >> i) & 1 else inverted[i] for i in range(bits)]
+        pin = literals[0]
+        for literal in literals[1:]:
+            pin = _gate(AndGate, pin, literal)
+        outputs.append(pin)
+
+    return inputs, outputs
+
+
+def _d_latch_factory():
+    def build(inputs):
+        d, enable = inputs
+        s = _gate(AndGate, d, enable)
+        r = _gate(AndGate, _gate(NotGate, d), enable)
+
+        # cross coupled NOR gates
+        nor_r = OrGate()
+        nor_s = OrGate()
+        q = _gate(NotGate, nor_r.output_pins[0])
+        q_inv = _gate(NotGate, nor_s.output_pins[0])
+        _connect(r, nor_r.input_pins[0])
+        _connect(q_inv, nor_r.input_pins[1])
+        _connect(s, nor_s.input_pins[0])
+        _connect(q, nor_s.input_pins[1])
+        return [q]
+
+    return _package("D LATCH", 2, build)
+
+
+def latch_register(bits):
+    d_latch = _d_latch_factory()
+    enable = InputSignalPin()
+    data = [InputSignalPin() for _ in range(bits)]
+    outputs = [_chip(d_latch, d, enable)[0] for d in data]
+    return data + [enable], outputs
+
+
+def _signals(inputs, outputs):
+    """
+        Ends every output pin in an output signal, as a packaged chip would
+    """
+    signals = []
+    for pin in outputs:
+        signal = OutputSignalPin()
+        pin.connect_to(signal)
+        signals.append(signal)
+    return inputs, signals
+
+
+def reference_circuits(scale=1):
+    """
+        Returns (name, builder) pairs of the reference circuits, sized by `scale`
+    """
+    return [
+        (f"ripple_carry_adder_{16 * scale}", lambda: ripple_carry_adder(16 * scale)),
+        (f"array_multiplier_{8 * scale}", lambda: array_multiplier(8 * scale)),
+        (f"inverter_chain_{1000 * scale}", lambda: inverter_chain(1000 * scale)),
+        (f"fanout_tree_{4 + scale}", lambda: fanout_tree(4 + scale)),
+        (f"decoder_{6 + scale}", lambda: decoder(6 + scale)),
+        (f"latch_register_{32 * scale}", lambda: latch_register(32 * scale)),
+    ]
+
+
+# Measurement
+
+class _Counters:
+    recv_signal = 0
+    gate_evals = 0
+
+
+@contextlib.contextmanager
+def _counting():
+    """
+        Temporarily replaces the methods doing the work with counting versions
+    """
+    counters = _Counters()
+    patched = []
+
+    def patch(owner, attr, wrapper):
+        original = owner.__dict__[attr]
+        patched.append((owner, attr, original))
+        setattr(owner, attr, wrapper(original))
+
+    def count_recv(original):
+        def recv_signal(self, signal):
+            counters.recv_signal += 1
+            original(self, signal)
+        return recv_signal
+
+    def count_eval(original):
+        def process_output(self):
+            counters.gate_evals += 1
+            original(self)
+        return process_output
+
+    def count_propagate(original):
+        def propagate(*args):
+            evaluations = original(*args)
+            counters.gate_evals += evaluations
+            return evaluations
+        return propagate
+
+    patch(ChipPin, 'recv_signal', count_recv)
+    patch(InputSignalPin, 'recv_signal', count_recv)
+    for gate_cls in (AndGate, OrGate, NotGate):
+        patch(gate_cls, 'process_output', count_eval)
+    # gates inside custom chips are evaluated by the engine
+    patch(app.chip, 'propagate', count_propagate)
+
+    try:
+        yield counters
+    finally:
+        for owner, attr, original in patched:
+            setattr(owner, attr, original)
+
+
+def _stimulus(input_count, changes, seed):
+    rng = random.Random(seed)
+    return [rng.randrange(input_count) for _ in range(changes)]
+
+
+def _build(builder):
+    start = time.perf_counter()
+    inputs, outputs = _signals(*builder())
+    return inputs, outputs, time.perf_counter() - start
+
+
+def _peak_memory(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _toggle_all(inputs, toggles):
+    """
+        Applies the stimulus to the input signals, returns the time it took
+    """
+    start = time.perf_counter()
+    for i in toggles:
+        signal = inputs[i]
+        signal.recv_signal(signal.State ^ 1)
+    return time.perf_counter() - start
+
+
+def bench_object(builder, changes, seed):
+    inputs, outputs, build_seconds = _build(builder)
+    toggles = _stimulus(len(inputs), changes, seed)
+    seconds = _toggle_all(inputs, toggles)
+
+    # counted on a fresh copy of the circuit, so it runs exactly the same stimulus from the same state
+    inputs, outputs, _ = _build(builder)
+    with _counting() as counters:
+        counted_seconds = _toggle_all(inputs, toggles)
+
+    return {
+        'build_seconds': build_seconds,
+        'peak_memory_bytes': _peak_memory(lambda: _signals(*builder())),
+        'changes_per_sec': changes / seconds,
+        'gate_evals_per_sec': counters.gate_evals / counted_seconds,
+        'recv_signal_per_change': counters.recv_signal / changes,
+    }
+
+
+def bench_netlist(builder, changes, seed):
+    def build():
+        inputs, outputs = _signals(*builder())
+        return NetlistSimulator(compile_circuit("BENCH", inputs, outputs))
+
+    start = time.perf_counter()
+    sim = build()
+    build_seconds = time.perf_counter() - start
+
+    toggles = _stimulus(len(sim.netlist.input_nets), changes, seed)
+    state = sim.state
+    input_nets = sim.netlist.input_nets
+
+    evaluations = sim.evaluations
+    start = time.perf_counter()
+    for i in toggles:
+        sim.set_input(i, state[input_nets[i]] ^ 1)
+        sim.settle()
+    seconds = time.perf_counter() - start
+
+    return {
+        'build_seconds': build_seconds,
+        'peak_memory_bytes': _peak_memory(build),
+        'changes_per_sec': changes / seconds,
+        'gate_evals_per_sec': (sim.evaluations - evaluations) / seconds,
+        'gates': sim.netlist.GateCount,
+        'nets': sim.netlist.NetCount,
+    }
+
+
+def run_suite(scale=1, changes=2000, seed=0, circuits=None):
+    results = {}
+    for name, builder in reference_circuits(scale):
+        if circuits and not any(pattern in name for pattern in circuits):
+            continue
+        results[name] = {
+            'object': bench_object(builder, changes, seed),
+            'netlist': bench_netlist(builder, changes, seed),
+        }
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'changes': changes,
+        'seed': seed,
+        'results': results,
+    }
+
+
+def _print_report(report, baseline=None, out=sys.stdout):
+    header = f"{'circuit':<26} {'mode':<8} {'build s':>9} {'peak KiB':>10} {'changes/s':>11} {'evals/s':>11} {'recv/chg':>9}"
+    if baseline:
+        header += f" {'vs base':>8}"
+    print(header, file=out)
+
+    for name, modes in report['results'].items():
+        for mode, r in modes.items():
+            # recv_signal is only counted in object mode
+            recv = r.get('recv_signal_per_change')
+            recv = f"{recv:>9.1f}" if recv is not None else f"{'-':>9}"
+            line = (
+                f"{name:<26} {mode:<8} {r['build_seconds']:>9.4f} {r['peak_memory_bytes'] / 1024:>10.1f}"
+                f" {r['changes_per_sec']:>11.0f} {r['gate_evals_per_sec']:>11.0f} {recv}"
+            )
+            if baseline:
+                base = baseline['results'].get(name, {}).get(mode)
+                if base:
+                    line += f" {r['changes_per_sec'] / base['changes_per_sec']:>7.2f}x"
+            print(line, file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.benchmark', description='Benchmarks the simulation on reference circuits')
+    parser.add_argument('--scale', type=int, default=1, help="size multiplier of the reference circuits")
+    parser.add_argument('--changes', type=int, default=2000, help="number of input changes per circuit")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', action='append', help="only run circuits whose name contains this (repeatable)")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--compare', help="results of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.scale, args.changes, args.seed, args.only)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    _print_report(report, baseline)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
 from app.chip import Chip
-from app.pins import ChipPin
+from app.pins import ChipPin, scheduler
+from app.netlist import NetlistBuilder, GATE_AND, GATE_OR, GATE_NOT, GATE_LATCH, GATE_LATCH_N, GATE_CLOCK
 
 
 class AndGate(Chip):
     
     name = "AND"
+    gate_code = GATE_AND
 
     def __init__(self):
         super().__init__()
@@ -27,6 +29,7 @@ class AndGate(Chip):
 class OrGate(Chip):
 
     name = "OR"
+    gate_code = GATE_OR
 
     def __init__(self):
         super().__init__()
@@ -48,6 +51,7 @@ class OrGate(Chip):
 class NotGate(Chip):
 
     name = "NOT"
+    gate_code = GATE_NOT
 
     def __init__(self):
         super().__init__()
@@ -61,3 +65,231 @@ class NotGate(Chip):
         result_pin: ChipPin = self.output_pins[0]
         result_pin.recv_signal(1 if inp_1 == 0 else 0)
 
+
+class Clock(Chip):
+
+    """
+        Clock source, its output toggles every time `tick` is called
+
+        To run a clock in real time, add its `tick` to the tick callbacks of a
+        `SimulationThread`. Compiled circuits step their clocks with
+        `NetlistSimulator.run_cycles` instead
+    """
+
+    name = "CLK"
+    gate_code = GATE_CLOCK
+
+    def __init__(self):
+        super().__init__()
+        self.level = 0
+        self._add_pin(ChipPin.PinType.OUTPUT)
+
+        self.initialize_pins()
+
+    def tick(self):
+        self.level ^= 1
+        # every clocked chip has to see the edge before any of them reacts to it
+        with scheduler.scope():
+            self.process_output()
+
+    def process_output(self):
+        self.output_pins[0].recv_signal(self.level)
+
+
+class Register(Chip):
+
+    """
+        Rising edge triggered register of `bits` D flip-flops sharing a clock
+
+        Inputs are the data bits followed by the clock, outputs are the stored bits.
+        Each bit is a master-slave pair: the master follows its data input while the
+        clock is low and the slave copies the master while the clock is high. Data
+        changing as a result of the edge itself (e.g. in a counter) thus never races
+        through to the output, however the updates happen to be ordered
+    """
+
+    name = "REG"
+
+    def __init__(self, bits=1):
+        super().__init__()
+        self.bits = bits
+        # value captured by every master latch
+        self.master = [0] * bits
+
+        for _ in range(bits + 1):
+            self._add_pin(ChipPin.PinType.INPUT)
+        for _ in range(bits):
+            self._add_pin(ChipPin.PinType.OUTPUT)
+
+        self.initialize_pins()
+
+    def process_output(self):
+        inputs = self.input_pins
+        if inputs[self.bits].State:
+            for pin, value in zip(self.output_pins, self.master):
+                pin.recv_signal(value)
+        else:
+            for i in range(self.bits):
+                self.master[i] = inputs[i].State
+
+    def flatten_into(self, builder: NetlistBuilder, input_nets):
+        clock = input_nets[self.bits]
+        outputs = []
+        for i in range(self.bits):
+            master = builder.new_net(self.master[i])
+            builder.add_gate(GATE_LATCH_N, input_nets[i], clock, master)
+
+            out = builder.new_net(self.output_pins[i].State)
+            builder.add_gate(GATE_LATCH, master, clock, out)
+            outputs.append(out)
+        return outputs
+
+
+class DFlipFlop(Register):
+
+    """
+        Single bit register, inputs are D and the clock
+    """
+
+    name = "DFF"
+
+    def __init__(self):
+        super().__init__(1)
+
+
+class BusAndGate(Chip):
+
+    """
+        Bitwise AND of two `width` bit buses
+    """
+
+    name = "BAND"
+
+    def __init__(self, width=8):
+        super().__init__()
+        self.width = width
+        self._add_pin(ChipPin.PinType.INPUT, width)
+        self._add_pin(ChipPin.PinType.INPUT, width)
+
+        self._add_pin(ChipPin.PinType.OUTPUT, width)
+
+        self.initialize_pins()
+
+    def process_output(self):
+        self.output_pins[0].recv_signal(self.input_pins[0].State & self.input_pins[1].State)
+
+    def flatten_into(self, builder: NetlistBuilder, input_nets):
+        return _bitwise_gates(builder, GATE_AND, input_nets[:self.width], input_nets[self.width:], self.output_pins[0])
+
+
+class BusOrGate(Chip):
+
+    """
+        Bitwise OR of two `width` bit buses
+    """
+
+    name = "BOR"
+
+    def __init__(self, width=8):
+        super().__init__()
+        self.width = width
+        self._add_pin(ChipPin.PinType.INPUT, width)
+        self._add_pin(ChipPin.PinType.INPUT, width)
+
+        self._add_pin(ChipPin.PinType.OUTPUT, width)
+
+        self.initialize_pins()
+
+    def process_output(self):
+        self.output_pins[0].recv_signal(self.input_pins[0].State | self.input_pins[1].State)
+
+    def flatten_into(self, builder: NetlistBuilder, input_nets):
+        return _bitwise_gates(builder, GATE_OR, input_nets[:self.width], input_nets[self.width:], self.output_pins[0])
+
+
+class BusNotGate(Chip):
+
+    """
+        Inverts every bit of a `width` bit bus
+    """
+
+    name = "BNOT"
+
+    def __init__(self, width=8):
+        super().__init__()
+        self.width = width
+        self.mask = (1 << width) - 1
+        self._add_pin(ChipPin.PinType.INPUT, width)
+        self._add_pin(ChipPin.PinType.OUTPUT, width)
+
+        self.initialize_pins()
+
+    def process_output(self):
+        self.output_pins[0].recv_signal(self.input_pins[0].State ^ self.mask)
+
+    def flatten_into(self, builder: NetlistBuilder, input_nets):
+        return _bitwise_gates(builder, GATE_NOT, input_nets, [-1] * self.width, self.output_pins[0])
+
+
+class Splitter(Chip):
+
+    """
+        Splits a `width` bit bus into its bits, output i carries bit i
+    """
+
+    name = "SPLIT"
+
+    def __init__(self, width=8):
+        super().__init__()
+        self.width = width
+        self._add_pin(ChipPin.PinType.INPUT, width)
+        for _ in range(width):
+            self._add_pin(ChipPin.PinType.OUTPUT)
+
+        self.initialize_pins()
+
+    def process_output(self):
+        word = self.input_pins[0].State
+        for i, pin in enumerate(self.output_pins):
+            pin.recv_signal((word >> i) & 1)
+
+    def flatten_into(self, builder: NetlistBuilder, input_nets):
+        # buses are lowered to a net per bit already, so there is nothing to do but regroup
+        return list(input_nets)
+
+
+class Merger(Chip):
+
+    """
+        Joins `width` single bit inputs into a bus, input i becomes bit i
+    """
+
+    name = "MERGE"
+
+    def __init__(self, width=8):
+        super().__init__()
+        self.width = width
+        for _ in range(width):
+            self._add_pin(ChipPin.PinType.INPUT)
+        self._add_pin(ChipPin.PinType.OUTPUT, width)
+
+        self.initialize_pins()
+
+    def process_output(self):
+        word = 0
+        for i, pin in enumerate(self.input_pins):
+            word |= pin.State << i
+        self.output_pins[0].recv_signal(word)
+
+    def flatten_into(self, builder: NetlistBuilder, input_nets):
+        return list(input_nets)
+
+
+def _bitwise_gates(builder: NetlistBuilder, kind, a_nets, b_nets, output: ChipPin):
+    state = output.State
+    outputs = []
+    for i, (a, b) in enumerate(zip(a_nets, b_nets)):
+        out = builder.new_net((state >> i) & 1)
+        builder.add_gate(kind, a, b, out)
+        outputs.append(out)
+    return outputs
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
-import pathlib
-import sys
-root = pathlib.Path('.').parent.resolve().absolute()
-sys.path.append(str(root))
+from collections import OrderedDict
 
 # from typing import Callable
-from app.pins import ChipPin, InputSignalPin, OutputSignalPin
+from app.pins import ChipPin, BusPin, SignalEmitter, InputSignalPin, OutputSignalPin, OscillationError
+from app.netlist import Netlist, compile_circuit
+from app.engine import propagate, truth_table
+from app.optimize import optimize_netlist, OptimizationReport
+from app.codegen import compile_netlist
+from app.definition import CircuitDefinition, define_circuit
 
 class Chip:
 
@@ -14,6 +16,10 @@ class Chip:
 
     name = "Untitled"
 
+    # type code of the gate this chip compiles to (see app.netlist), None for
+    # chips that are not a single builtin gate
+    gate_code = None
+
     @property
     def InputPinCount(self):
         return self._len_input_pins
@@ -46,8 +52,8 @@ class Chip:
         self.process_output()
 
 
-    def _add_pin(self, pin_type):
-        pin = ChipPin()
+    def _add_pin(self, pin_type, width=1):
+        pin = BusPin(width) if width != 1 else ChipPin()
         pin.pin_type = pin_type
         if pin_type == ChipPin.PinType.INPUT:
             self.input_pins.append(pin)
@@ -66,15 +72,164 @@ class Chip:
         # meant to be implemented by child classes
 
 
+class TruthTableCache:
+
+    """
+        Maps the input bits of a custom chip to its output bits
+
+        One cache is shared by all instances of the same chip template, which
+        only creates it if the circuit has no feedback loop, since only then the
+        outputs depend on nothing but the inputs. Chips with few enough inputs
+        get their whole truth table precomputed, others fill the cache as they
+        are evaluated and evict the least recently used entries once `maxsize`
+        is reached.
+    """
+
+    DEFAULT_MAXSIZE = 4096
+    # chips with at most this many inputs get a full truth table upfront
+    PRECOMPUTE_MAX_INPUTS = 8
+
+    def __init__(self, netlist: Netlist, maxsize=DEFAULT_MAXSIZE):
+        self.name = netlist.name
+        self.maxsize = maxsize
+
+        self.hits = 0
+        self.misses = 0
+
+        # whether `_entries` holds the full truth table, in which case it is never evicted
+        self.complete = False
+
+        self._entries = OrderedDict()  # type: OrderedDict[tuple, tuple]
+
+        input_count = len(netlist.input_nets)
+        if input_count <= self.PRECOMPUTE_MAX_INPUTS and (1 << input_count) <= maxsize:
+            for vector, outputs in enumerate(truth_table(netlist)):
+                key = tuple((vector >> i) & 1 for i in range(input_count))
+                self._entries[key] = outputs
+
+            self.complete = True
+
+    def lookup(self, inputs):
+        """
+            Returns the cached outputs for the given inputs, or None
+        """
+        outputs = self._entries.get(inputs)
+        if outputs is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        if not self.complete:
+            self._entries.move_to_end(inputs)
+        return outputs
+
+    def store(self, inputs, outputs):
+        self._entries[inputs] = outputs
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return f"TruthTableCache < name={self.name}, size={len(self)}/{self.maxsize}, hits={self.hits}, misses={self.misses} >"
+
+
+class ChipTemplate:
+
+    """
+        Compiled definition of a custom chip, shared by all of its instances
+
+        The circuit is flattened once into a `Netlist`. A template never changes
+        after it is created, instances only own a state array with the value of
+        every net, so placing many copies of a chip is cheap.
+
+        With `optimize` set, the netlist is run through `optimize_netlist` first and
+        `optimization` reports the gates that were removed. `source` is always the
+        netlist as compiled from the circuit.
+
+        An instance gets its outputs from the first of these that applies (see
+        `CustomChip.process_output`): the shared `cache`, then, with `codegen` set,
+        a generated python function (see `compile_netlist`), and otherwise the event
+        driven engine on the instance's own state. Only circuits with feedback loops
+        lack the first two, so only their instances depend on their state. The
+        generated function is compiled once it is first needed, so chips whose truth
+        table is precomputed never pay for it.
+    """
+
+    def __init__(self, netlist: Netlist, cache_size=TruthTableCache.DEFAULT_MAXSIZE, optimize=False, codegen=True,
+                 definition: CircuitDefinition = None):
+        self.name = netlist.name
+        self.source = netlist
+
+        self.optimization = None  # type: OptimizationReport
+        if optimize:
+            netlist, self.optimization = optimize_netlist(netlist)
+
+        self.netlist = netlist
+
+        # settled state of the circuit, the starting point of every instance
+        self.initial_state = netlist.new_state()
+        try:
+            propagate(netlist, self.initial_state, range(netlist.GateCount))
+        except OscillationError:
+            # keep the (unsettled) snapshot, instances will report the oscillation once simulated
+            self.initial_state = netlist.new_state()
+
+        self.cache = None  # type: TruthTableCache
+        if cache_size > 0 and netlist.IsCombinational:
+            self.cache = TruthTableCache(netlist, cache_size)
+
+        # scratch space for `propagate`, shared by all instances as they never simulate concurrently
+        self.queued = bytearray(netlist.GateCount)
+
+        self.codegen = codegen and netlist.IsCombinational
+        self._evaluate = None
+
+        # whether any pin is wider than one bit
+        self.buses = netlist.HasBuses
+
+        # the hierarchical description the template was compiled from, used to save chips without flattening them
+        self.definition = definition
+        if definition is not None:
+            definition.template = self
+
+    @property
+    def Evaluate(self):
+        """
+            The generated function computing the outputs from the inputs, None without codegen
+        """
+        if self._evaluate is None and self.codegen:
+            self._evaluate = compile_netlist(self.netlist)
+        return self._evaluate
+
+    @property
+    def InputPinCount(self):
+        return len(self.netlist.input_widths)
+
+    @property
+    def OutputPinCount(self):
+        return len(self.netlist.output_widths)
+
+    @classmethod
+    def compile(cls, name, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin],
+                cache_size=TruthTableCache.DEFAULT_MAXSIZE, optimize=False, codegen=True, sources: list[Chip] = ()):
+        return cls(
+            compile_circuit(name, input_signals, output_signals, sources), cache_size, optimize, codegen,
+            define_circuit(name, input_signals, output_signals, sources),
+        )
+
+
 class CustomChip(Chip):
 
-    def __init__(self, name: str, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin]):
+    def __init__(self, template: ChipTemplate):
 
         """
         Class used to bundle a set of components connected together into a single chip
 
-        It takes a set (kinda Linked list) of input signals and output signals and wraps
-        them in a layer in Chip Input Pins and Output Pins
+        The components are taken from a `ChipTemplate`, compiled from a set (kinda Linked list)
+        of input signals and output signals. This chip wraps them in a layer in Chip Input Pins
+        and Output Pins
 
         Input (and output) signals are the SignalEmitters that carry input (and output)
         from the user taken from the chip editor
@@ -87,38 +242,151 @@ class CustomChip(Chip):
         then resulting chip will be like
 
             chip's input pins -> input signals -> ... components ... -> output signals -> chip's output pins  
+
+        The components themselves are not copied: the chip only owns the values of
+        the nets inside the template, and simulates them using the template's netlist
         """ 
         
         super().__init__()
-        self.name = name
+        self.name = template.name
+        self.template = template
 
-        self.input_signals = input_signals
-        self.output_signals = output_signals
+        # the value of every net inside this instance
+        self.state = bytearray(template.initial_state)
 
-        for _ in range(len(input_signals)):
-            self._add_pin(ChipPin.PinType.INPUT)
+        for width in template.netlist.input_widths:
+            self._add_pin(ChipPin.PinType.INPUT, width)
 
-        for _ in range(len(output_signals)):
-            self._add_pin(ChipPin.PinType.OUTPUT)
+        for width in template.netlist.output_widths:
+            self._add_pin(ChipPin.PinType.OUTPUT, width)
 
         self.initialize_pins()
 
 
     def process_output(self):
-        # forwars signals from input pins to the first layer of input signals
-        for i in range(self.InputPinCount):
-            self.input_signals[i].recv_signal(self.input_pins[i].State)
+        template = self.template
+        if template.buses:
+            inputs = self._split_inputs()
+        else:
+            inputs = tuple([pin.State for pin in self.input_pins])
+
+        cache = template.cache
+        outputs = cache.lookup(inputs) if cache is not None else None
+        if outputs is None:
+            evaluate = template.Evaluate
+            outputs = evaluate(inputs) if evaluate is not None else self._simulate(inputs)
+            if cache is not None:
+                cache.store(inputs, outputs)
+
+        if template.buses:
+            self._join_outputs(outputs)
+            return
 
         # forwars signals from output signal layer (2nd last layer) to output pins
         for i in range(self.OutputPinCount):
-            self.output_pins[i].recv_signal(self.output_signals[i].State)
+            self.output_pins[i].recv_signal(outputs[i])
+
+    # the netlist works on single bits, so the words on bus pins are split up
+    # into their bits on the way in and joined again on the way out
+
+    def _split_inputs(self):
+        inputs = []
+        for pin in self.input_pins:
+            state = pin.State
+            inputs.extend([(state >> i) & 1 for i in range(pin.width)])
+        return tuple(inputs)
+
+    def _join_outputs(self, outputs):
+        bit = 0
+        for pin in self.output_pins:
+            word = 0
+            for i in range(pin.width):
+                word |= outputs[bit + i] << i
+            bit += pin.width
+            pin.recv_signal(word)
+
+    def _simulate(self, inputs):
+        """
+            Forwards the inputs to the internal circuit, lets it settle and returns its outputs
+        """
+        template = self.template
+        netlist = template.netlist
+        state = self.state
 
-    
-def custom_chip_factory(name, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin]):
-    def _f():
-        return CustomChip(name, input_signals, output_signals)
+        dirty = []
+        for net, signal in zip(netlist.input_nets, inputs):
+            if state[net] != signal:
+                state[net] = signal
+                dirty.extend(netlist.fanout(net))
+
+        if dirty:
+            propagate(netlist, state, dirty, template.queued)
+
+        return tuple([state[net] for net in netlist.output_nets])
 
-    return _f
+
+class CustomChipFactory:
+
+    """
+        Creates instances of a circuit packaged as a chip
+
+        The circuit is compiled into a `ChipTemplate` once and every instance is
+        created from it. If any wire was changed since, the circuit is recompiled
+        on the next call and a new template is used if its structure is different.
+        Chips created earlier keep the template they were created from.
+    """
+
+    def __init__(self, name, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin],
+                 cache_size=TruthTableCache.DEFAULT_MAXSIZE, optimize=False, codegen=True, sources: list[Chip] = ()):
+        self.name = name
+        self.input_signals = input_signals
+        self.output_signals = output_signals
+        # chips no input leads to (e.g. clocks), see `compile_circuit`
+        self.sources = list(sources)
+        self.cache_size = cache_size
+        self.optimize = optimize
+        self.codegen = codegen
+
+        self._generation = SignalEmitter.connection_generation
+        self._template = ChipTemplate.compile(name, input_signals, output_signals, cache_size, optimize, codegen, self.sources)
+
+    @property
+    def Template(self):
+        if self._generation != SignalEmitter.connection_generation:
+            self._generation = SignalEmitter.connection_generation
+
+            netlist = compile_circuit(self.name, self.input_signals, self.output_signals, self.sources)
+            if netlist.signature() != self._template.source.signature():
+                self._template = ChipTemplate(
+                    netlist, self.cache_size, self.optimize, self.codegen,
+                    define_circuit(self.name, self.input_signals, self.output_signals, self.sources),
+                )
+
+        return self._template
+
+    @property
+    def cache(self):
+        return self.Template.cache
+
+    @property
+    def optimization(self):
+        return self.Template.optimization
+
+    def __call__(self):
+        return CustomChip(self.Template)
+
+    
+def custom_chip_factory(name, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin],
+                        cache_size=TruthTableCache.DEFAULT_MAXSIZE, optimize=False, codegen=True, sources: list[Chip] = ()):
+    """
+        Returns a function creating instances of the given circuit packaged as a chip.
+        All the instances created from the same template share one `TruthTableCache`,
+        pass `cache_size=0` to disable it. Pass `optimize=True` to simplify the circuit
+        before it is simulated (see `optimize_netlist`) and `codegen=False` to always
+        use the event driven engine. Chips inside the circuit that no input leads to,
+        such as clocks, have to be listed in `sources` or they are left out
+    """
+    return CustomChipFactory(name, input_signals, output_signals, cache_size, optimize, codegen, sources)
 
 
 # def test(s1: InputSignalPin, s2: InputSignalPin, s3: OutputSignalPin, p1, p2):
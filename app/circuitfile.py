@@ -0,0 +1,629 @@
+"""
+    Saving and loading circuits along with the library of chips they use
+
+    A circuit file holds a list of `CircuitDefinition`s. Every custom chip type
+    is defined once, before the first definition using it, and the last
+    definition is the top level circuit (e.g. what is shown in the editor).
+    Chips are referenced by the index of their definition, or by name for
+    builtin chips, so nothing is ever flattened.
+
+    There are two variants of the format, chosen by file extension:
+
+    Text (`.dls`): JSON lines. The first line is a header
+    `{"format": "dls-circuit", "version": 2}`, every further line one definition:
+
+        {"name": ..., "inputs": 2, "outputs": 1, "chips": ["AND", 0, ...],
+         "positions": [x0, y0, x1, y1, ...], "wires": [...]}
+
+    where a chip is either a builtin name or the index of an earlier definition.
+    Wires are flattened the same way as in `CircuitDefinition`. Definitions with
+    bus signals also have "input_widths" and "output_widths". Definitions can be
+    read one at a time as the file streams in (see `iter_text`).
+
+    Binary (`.dlsb`): little endian, made to be memory-mapped.
+
+        header          magic b'DLSC', u16 version, u16 flags (0),
+                        u32 builtin type count, u32 definition count
+        builtin types   u16 length + utf-8 name, for every builtin type
+        table           u64 offset + u32 length of every definition
+        definitions     u16 length + utf-8 name, u32 inputs, u32 outputs,
+                        u32 chip count, u32 wire count, then i32 arrays with the
+                        chip types, the positions, the wires, the input widths
+                        and the output widths (version 1 files have no widths)
+
+    A chip type t >= 0 is the index of a definition, t < 0 the builtin type ~t.
+    Definitions are only decoded once they are needed (see `BinaryLibrary`).
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+
+from app.pins import new_input_signal, new_output_signal, batch_edit
+from app.netlist import Netlist, NetlistBuilder
+from app.chip import Chip, ChipTemplate, CustomChip, TruthTableCache
+from app.builtinchips import (
+    AndGate, OrGate, NotGate, Clock, Register, DFlipFlop, BusAndGate, BusOrGate, BusNotGate, Splitter, Merger,
+)
+from app.definition import (
+    CircuitDefinition, END_CHIP_IN, END_CHIP_OUT, END_SIG_IN, END_SIG_OUT, WIRE_FIELDS,
+)
+
+
+FORMAT_NAME = "dls-circuit"
+FORMAT_VERSION = 2
+# versions that can still be read
+SUPPORTED_VERSIONS = (1, 2)
+
+TEXT_SUFFIX = '.dls'
+BINARY_SUFFIX = '.dlsb'
+
+BINARY_MAGIC = b'DLSC'
+_HEADER = struct.Struct('<4sHHII')
+_TABLE_ENTRY = struct.Struct('<QI')
+_COUNTS = struct.Struct('<IIII')
+_LENGTH = struct.Struct('<H')
+
+
+# builtin chips by the name they are stored under, see `chip_type_name`
+BUILTIN_CHIPS = {
+    AndGate.name: AndGate,
+    OrGate.name: OrGate,
+    NotGate.name: NotGate,
+    Clock.name: Clock,
+    DFlipFlop.name: DFlipFlop,
+}
+
+# builtin chips taking their width as the only argument, stored as name + width
+SIZED_CHIPS = {
+    Register.name: Register,
+    BusAndGate.name: BusAndGate,
+    BusOrGate.name: BusOrGate,
+    BusNotGate.name: BusNotGate,
+    Splitter.name: Splitter,
+    Merger.name: Merger,
+}
+
+
+def builtin_chip(name) -> Chip:
+    """
+        Creates a new builtin chip from the name it is stored under
+    """
+    chip_cls = BUILTIN_CHIPS.get(name)
+    if chip_cls is not None:
+        return chip_cls()
+
+    base = name.rstrip('0123456789')
+    chip_cls = SIZED_CHIPS.get(base)
+    if chip_cls is not None and base != name:
+        return chip_cls(int(name[len(base):]))
+
+    raise ValueError(f"Unknown builtin chip '{name}'")
+
+
+# one unconnected instance of every builtin type, to flatten from (see `compile_definition`)
+_prototypes = {}  # type: dict[str, Chip]
+
+
+def _prototype(name) -> Chip:
+    chip = _prototypes.get(name)
+    if chip is None:
+        chip = _prototypes[name] = builtin_chip(name)
+    return chip
+
+
+# Building
+
+def template_of(definition: CircuitDefinition, cache_size=TruthTableCache.DEFAULT_MAXSIZE,
+                optimize=False, codegen=True) -> ChipTemplate:
+    """
+        Returns the template of a custom chip definition, compiling it (and every
+        definition it uses) first if that has not been done yet
+    """
+    if definition.template is None:
+        for dependency in definition.dependencies():
+            if dependency.template is None:
+                netlist = compile_definition(dependency, cache_size, optimize, codegen)
+                ChipTemplate(netlist, cache_size, optimize, codegen, dependency)
+        ChipTemplate(compile_definition(definition, cache_size, optimize, codegen), cache_size, optimize, codegen, definition)
+
+    return definition.template
+
+
+def compile_definition(definition: CircuitDefinition, cache_size=TruthTableCache.DEFAULT_MAXSIZE,
+                       optimize=False, codegen=True) -> Netlist:
+    """
+        Flattens a definition into a `Netlist`. Custom chips inside it are inlined from
+        their templates, which are made with the given settings (see `template_of`) if
+        they don't exist yet
+    """
+    builder = NetlistBuilder()
+    new_net = builder.new_net
+    input_nets = [new_net() for _ in range(sum(definition.input_widths))]
+    output_nets = [new_net() for _ in range(sum(definition.output_widths))]
+
+    # nets of every pin: a net for one bit pins, the list of nets of its bits for bus pins
+    chip_inputs = []
+    chip_outputs = []
+    buses = definition.HasBuses
+    for chip_type in definition.chip_types:
+        if isinstance(chip_type, CircuitDefinition):
+            template = template_of(chip_type, cache_size, optimize, codegen)
+            netlist = template.netlist
+            inputs = [new_net() for _ in range(len(netlist.input_nets))]
+            outputs = builder.inline(netlist, template.initial_state, inputs)
+            if template.buses:
+                inputs = _group(inputs, netlist.input_widths)
+                outputs = _group(outputs, netlist.output_widths)
+                buses = True
+        else:
+            chip = _prototype(chip_type)
+            if chip.gate_code is not None:
+                # single gates are by far the most common chips, add them directly
+                inputs = [new_net() for _ in range(chip.InputPinCount)]
+                out = new_net(chip.output_pins[0].State)
+                builder.add_gate(chip.gate_code, inputs[0] if inputs else -1, inputs[1] if len(inputs) > 1 else -1, out)
+                outputs = (out,)
+            else:
+                input_widths = [pin.width for pin in chip.input_pins]
+                output_widths = [pin.width for pin in chip.output_pins]
+                inputs = [new_net() for _ in range(sum(input_widths))]
+                outputs = builder.add_chip(chip, inputs)
+                inputs = _group(inputs, input_widths)
+                outputs = _group(outputs, output_widths)
+                buses = True
+        chip_inputs.append(inputs)
+        chip_outputs.append(outputs)
+
+    nets = {
+        END_SIG_IN: (_group(input_nets, definition.input_widths),),
+        END_SIG_OUT: (_group(output_nets, definition.output_widths),),
+        END_CHIP_IN: chip_inputs,
+        END_CHIP_OUT: chip_outputs,
+    }
+
+    # signals use -1 as their chip index, which picks the only entry of their tuple
+    wires = definition.wires
+    union = builder.union
+    for i in range(0, len(wires), WIRE_FIELDS):
+        source_kind, source_chip, source_pin, target_kind, target_chip, target_pin = wires[i:i + WIRE_FIELDS]
+        source = nets[source_kind][source_chip][source_pin]
+        target = nets[target_kind][target_chip][target_pin]
+        if not buses:
+            union(source, target)
+        elif source.__class__ is int and target.__class__ is int:
+            union(source, target)
+        elif source.__class__ is list and target.__class__ is list and len(source) == len(target):
+            for source_net, target_net in zip(source, target):
+                union(source_net, target_net)
+        else:
+            raise ValueError(f"'{definition.name}' has a wire between pins of different widths")
+
+    return builder.build(definition.name, input_nets, output_nets, definition.input_widths, definition.output_widths)
+
+
+def _group(nets, widths):
+    """
+        Splits the nets of consecutive pins into one entry per pin, see `compile_definition`
+    """
+    grouped = []
+    i = 0
+    for width in widths:
+        grouped.append(nets[i] if width == 1 else list(nets[i:i + width]))
+        i += width
+    return grouped
+
+
+def instantiate(definition: CircuitDefinition):
+    """
+        Builds a definition out of chip objects, e.g. to edit it. Returns the chips,
+        the input signals and the output signals, all wired up and settled
+    """
+    chips, input_signals, output_signals = create_chips(definition)
+    connect_wires(definition, chips, input_signals, output_signals)
+    return chips, input_signals, output_signals
+
+
+def create_chips(definition: CircuitDefinition):
+    """
+        Creates the chips and signals of a definition, without connecting anything
+    """
+    chips = []  # type: list[Chip]
+    for chip_type in definition.chip_types:
+        if isinstance(chip_type, CircuitDefinition):
+            chips.append(CustomChip(template_of(chip_type)))
+        else:
+            chips.append(builtin_chip(chip_type))
+
+    input_signals = [new_input_signal(width) for width in definition.input_widths]
+    output_signals = [new_output_signal(width) for width in definition.output_widths]
+    return chips, input_signals, output_signals
+
+
+def connect_wires(definition: CircuitDefinition, chips, input_signals, output_signals) -> list[int]:
+    """
+        Connects the wires of a definition between the objects made by `create_chips`
+
+        A wire between pins of different widths (e.g. from a file written by hand)
+        is skipped instead of failing the whole circuit, the index of every skipped
+        wire is returned
+    """
+    pins = {
+        END_SIG_IN: (input_signals,),
+        END_SIG_OUT: (output_signals,),
+        END_CHIP_IN: [chip.input_pins for chip in chips],
+        END_CHIP_OUT: [chip.output_pins for chip in chips],
+    }
+
+    # the circuit settles once, after every wire is in place
+    wires = definition.wires
+    skipped = []
+    with batch_edit():
+        for i in range(0, len(wires), WIRE_FIELDS):
+            source_kind, source_chip, source_pin, target_kind, target_chip, target_pin = wires[i:i + WIRE_FIELDS]
+            source = pins[source_kind][source_chip][source_pin]
+            target = pins[target_kind][target_chip][target_pin]
+            if source.width != target.width:
+                skipped.append(i // WIRE_FIELDS)
+                continue
+            source.connect_to(target)
+    return skipped
+
+
+# Libraries
+
+class Library:
+
+    """
+        The definitions of a circuit file, in file order. The last one is the top level circuit
+    """
+
+    def __init__(self, definitions: list[CircuitDefinition] = None):
+        self._definitions = definitions if definitions is not None else []
+        self._by_name = None  # type: dict[str, int]
+
+    def __len__(self):
+        return len(self._definitions)
+
+    def definition(self, index) -> CircuitDefinition:
+        return self._definitions[index]
+
+    def names(self):
+        return [self.definition(i).name for i in range(len(self))]
+
+    def __getitem__(self, name) -> CircuitDefinition:
+        """
+            Returns the definition with the given name (the last one, if several share it)
+        """
+        if self._by_name is None:
+            self._by_name = {name: i for i, name in enumerate(self.names())}
+        return self.definition(self._by_name[name])
+
+    @property
+    def Top(self) -> CircuitDefinition:
+        if len(self) == 0:
+            raise ValueError("The library is empty")
+        return self.definition(len(self) - 1)
+
+    def factory(self, name):
+        """
+            Returns a function creating instances of the named definition as a custom chip
+        """
+        template = template_of(self[name])
+        return lambda: CustomChip(template)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _file_order(top: CircuitDefinition) -> list[CircuitDefinition]:
+    definitions = top.dependencies()
+    definitions.append(top)
+    for definition in definitions:
+        for chip_type in definition.chip_types:
+            if chip_type is None:
+                raise ValueError(f"'{definition.name}' uses a chip without a definition")
+    return definitions
+
+
+# Text variant
+
+def write_text(stream, top: CircuitDefinition):
+    definitions = _file_order(top)
+    index = {id(definition): i for i, definition in enumerate(definitions)}
+
+    stream.write(json.dumps({"format": FORMAT_NAME, "version": FORMAT_VERSION}))
+    stream.write('\n')
+    for definition in definitions:
+        chips = [
+            chip_type if isinstance(chip_type, str) else index[id(chip_type)]
+            for chip_type in definition.chip_types
+        ]
+        data = {
+            "name": definition.name,
+            "inputs": definition.input_count,
+            "outputs": definition.output_count,
+            "chips": chips,
+            "positions": definition.positions.tolist(),
+            "wires": definition.wires.tolist(),
+        }
+        if definition.HasBuses:
+            data["input_widths"] = definition.input_widths.tolist()
+            data["output_widths"] = definition.output_widths.tolist()
+        stream.write(json.dumps(data, separators=(',', ':')))
+        stream.write('\n')
+
+
+def iter_text(stream):
+    """
+        Yields the definitions of a text circuit file one by one, as they are read
+    """
+    header = stream.readline()
+    try:
+        header = json.loads(header)
+    except ValueError:
+        header = None
+    if not isinstance(header, dict) or header.get("format") != FORMAT_NAME:
+        raise ValueError("Not a circuit file")
+    if header.get("version") not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported circuit file version {header.get('version')}")
+
+    definitions = []
+    for line in stream:
+        if not line.strip():
+            continue
+
+        data = json.loads(line)
+        chip_types = [
+            chip_type if isinstance(chip_type, str) else definitions[chip_type]
+            for chip_type in data["chips"]
+        ]
+        input_widths = data.get("input_widths")
+        output_widths = data.get("output_widths")
+        definition = CircuitDefinition(
+            data["name"], data["inputs"], data["outputs"], chip_types,
+            array('i', data["positions"]), array('i', data["wires"]),
+            array('i', input_widths) if input_widths is not None else None,
+            array('i', output_widths) if output_widths is not None else None,
+        )
+        definitions.append(definition)
+        yield definition
+
+
+def read_text(stream) -> Library:
+    return Library(list(iter_text(stream)))
+
+
+# Binary variant
+
+def _int_array(values) -> bytes:
+    data = array('i', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _encode_name(name) -> bytes:
+    encoded = name.encode('utf-8')
+    return _LENGTH.pack(len(encoded)) + encoded
+
+
+def write_binary(stream, top: CircuitDefinition):
+    definitions = _file_order(top)
+    index = {id(definition): i for i, definition in enumerate(definitions)}
+
+    builtins = {}  # type: dict[str, int]
+    bodies = []
+    for definition in definitions:
+        chip_types = []
+        for chip_type in definition.chip_types:
+            if isinstance(chip_type, str):
+                chip_types.append(~builtins.setdefault(chip_type, len(builtins)))
+            else:
+                chip_types.append(index[id(chip_type)])
+
+        bodies.append(b''.join((
+            _encode_name(definition.name),
+            _COUNTS.pack(definition.input_count, definition.output_count, definition.ChipCount, definition.WireCount),
+            _int_array(chip_types),
+            _int_array(definition.positions),
+            _int_array(definition.wires),
+            _int_array(definition.input_widths),
+            _int_array(definition.output_widths),
+        )))
+
+    head = [_HEADER.pack(BINARY_MAGIC, FORMAT_VERSION, 0, len(builtins), len(definitions))]
+    head.extend(_encode_name(name) for name in builtins)
+    offset = sum(map(len, head)) + _TABLE_ENTRY.size * len(bodies)
+    for body in bodies:
+        head.append(_TABLE_ENTRY.pack(offset, len(body)))
+        offset += len(body)
+
+    stream.write(b''.join(head))
+    for body in bodies:
+        stream.write(body)
+
+
+class BinaryLibrary(Library):
+
+    """
+        A binary circuit file, memory-mapped
+
+        Opening only reads the header and the definition table. A definition is
+        decoded the first time it is asked for, along with the definitions it uses,
+        and nothing is compiled until a template is needed.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        try:
+            self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty files can't be mapped
+            self._file.close()
+            raise ValueError("Not a circuit file")
+
+        try:
+            self._read_header()
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def _read_header(self):
+        data = self._data
+        if len(data) < _HEADER.size:
+            raise ValueError("Not a circuit file")
+
+        magic, version, _, builtin_count, definition_count = _HEADER.unpack_from(data, 0)
+        if magic != BINARY_MAGIC:
+            raise ValueError("Not a circuit file")
+        if version not in SUPPORTED_VERSIONS:
+            raise ValueError(f"Unsupported circuit file version {version}")
+        self._version = version
+
+        position = _HEADER.size
+        self._builtins = []
+        for _ in range(builtin_count):
+            name, position = self._read_name(position)
+            self._builtins.append(name)
+
+        self._table = []
+        for _ in range(definition_count):
+            self._table.append(_TABLE_ENTRY.unpack_from(data, position))
+            position += _TABLE_ENTRY.size
+
+        super().__init__([None] * definition_count)
+
+    def _read_name(self, position):
+        (length,) = _LENGTH.unpack_from(self._data, position)
+        position += _LENGTH.size
+        return bytes(self._data[position:position + length]).decode('utf-8'), position + length
+
+    def _read_array(self, position, count):
+        values = array('i')
+        values.frombytes(self._data[position:position + 4 * count])
+        if sys.byteorder != 'little':
+            values.byteswap()
+        return values, position + 4 * count
+
+    def names(self):
+        # names are read without decoding the rest of the definitions
+        return [self._read_name(offset)[0] for offset, _ in self._table]
+
+    def definition(self, index) -> CircuitDefinition:
+        definition = self._definitions[index]
+        if definition is not None:
+            return definition
+
+        # decode the definitions used by this one first, without recursion
+        pending = [index]
+        while pending:
+            current = pending[-1]
+            name, position = self._read_name(self._table[current][0])
+            counts = _COUNTS.unpack_from(self._data, position)
+            types, _ = self._read_array(position + _COUNTS.size, counts[2])
+
+            missing = [t for t in set(types) if t >= 0 and self._definitions[t] is None]
+            if missing:
+                if any(t >= current for t in missing):
+                    raise ValueError(f"Definition '{name}' uses a definition that is not before it")
+                pending.extend(missing)
+                continue
+
+            pending.pop()
+            self._definitions[current] = self._decode(current)
+
+        return self._definitions[index]
+
+    def _decode(self, index) -> CircuitDefinition:
+        name, position = self._read_name(self._table[index][0])
+        input_count, output_count, chip_count, wire_count = _COUNTS.unpack_from(self._data, position)
+        position += _COUNTS.size
+
+        types, position = self._read_array(position, chip_count)
+        positions, position = self._read_array(position, 2 * chip_count)
+        wires, position = self._read_array(position, WIRE_FIELDS * wire_count)
+
+        input_widths = output_widths = None
+        if self._version >= 2:
+            input_widths, position = self._read_array(position, input_count)
+            output_widths, position = self._read_array(position, output_count)
+
+        builtins = self._builtins
+        definitions = self._definitions
+        chip_types = [definitions[t] if t >= 0 else builtins[~t] for t in types]
+
+        return CircuitDefinition(
+            name, input_count, output_count, chip_types, positions, wires, input_widths, output_widths,
+        )
+
+    def close(self):
+        data = getattr(self, '_data', None)
+        if data is not None and not data.closed:
+            data.close()
+        self._file.close()
+
+
+# Files
+
+# the umask can only be read by setting it, which would race with other threads
+# creating files, so it is read once, on import
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def save_library(path, top: CircuitDefinition):
+    """
+        Saves a circuit along with every chip it uses, in the binary variant if the path ends in `.dlsb`
+
+        The file is written next to the target under a temporary name and only moved
+        over it once complete, so a save failing halfway leaves the previous file intact
+    """
+    fd, temp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    try:
+        if str(path).endswith(BINARY_SUFFIX):
+            with os.fdopen(fd, 'wb') as stream:
+                write_binary(stream, top)
+        else:
+            with os.fdopen(fd, 'w', encoding='utf-8') as stream:
+                write_text(stream, top)
+
+        # temporary files are only readable by their owner, the saved file gets the usual permissions
+        if os.path.exists(path):
+            shutil.copymode(path, temp)
+        else:
+            os.chmod(temp, 0o666 & ~_UMASK)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+
+
+def load_library(path) -> Library:
+    """
+        Opens a circuit file of either variant. Binary files stay mapped until the library is closed
+    """
+    with open(path, 'rb') as stream:
+        magic = stream.read(len(BINARY_MAGIC))
+
+    if magic == BINARY_MAGIC:
+        return BinaryLibrary(path)
+
+    with open(path, encoding='utf-8') as stream:
+        return read_text(stream)
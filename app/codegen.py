@@ -0,0 +1,356 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import tempfile
+
+from app.netlist import Netlist, GATE_AND, GATE_OR, GATE_NOT, GATE_LATCH, GATE_LATCH_N, GATE_CLOCK
+
+
+# bumped whenever the generated code changes, so stale files in the disk cache are not used
+CODEGEN_VERSION = 1
+
+# where generated sources are kept between runs. Setting DLS_CODEGEN_CACHE to an
+# empty string (DLS_CODEGEN_CACHE=) disables the disk cache
+DEFAULT_CACHE_DIR = os.environ.get(
+    'DLS_CODEGEN_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'digital-logic-simulator', 'codegen'),
+)
+
+FUNCTION_NAME = 'evaluate'
+CYCLES_FUNCTION_NAME = 'run_cycles'
+
+_OPERATORS = {
+    GATE_AND: '&',
+    GATE_OR: '|',
+}
+
+
+def structural_hash(netlist: Netlist) -> str:
+    """
+        Returns a hex digest that only depends on the structure of the netlist (see `Netlist.signature`)
+    """
+    digest = hashlib.sha256(f'codegen-{CODEGEN_VERSION}'.encode())
+    for part in netlist.signature():
+        # lengths keep the boundaries between the parts unambiguous
+        digest.update(len(part).to_bytes(8, 'little'))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def generate_source(netlist: Netlist) -> str:
+    """
+        Returns the source of a python function evaluating a combinational netlist
+
+        The function is called as `evaluate(inputs, mask=1)` and returns a tuple with the
+        value of every output. Every net is a local variable and every gate a single
+        bitwise expression, in topological order. With `mask` set to (1 << width) - 1,
+        every input can hold `width` vectors packed into an int, as in `evaluate_packed`
+    """
+    if not netlist.IsCombinational:
+        raise ValueError(f"'{netlist.name}' is not combinational, no code can be generated for it")
+
+    lines = [f'def {FUNCTION_NAME}(inputs, mask=1):']
+
+    if netlist.input_nets:
+        names = ', '.join(f'n{net}' for net in netlist.input_nets)
+        lines.append(f'    {names}, = inputs')
+
+    # nets that are not driven by anything hold their compile time value
+    driven = set(netlist.input_nets)
+    driven.update(netlist.gate_out)
+    for net, value in enumerate(netlist.initial_state):
+        if net not in driven:
+            lines.append(f'    n{net} = {"mask" if value else "0"}')
+
+    gate_types = netlist.gate_types
+    gate_in_a = netlist.gate_in_a
+    gate_in_b = netlist.gate_in_b
+    gate_out = netlist.gate_out
+    for gate in netlist.topological_order():
+        kind = gate_types[gate]
+        if kind == GATE_NOT:
+            lines.append(f'    n{gate_out[gate]} = n{gate_in_a[gate]} ^ mask')
+        else:
+            lines.append(f'    n{gate_out[gate]} = n{gate_in_a[gate]} {_OPERATORS[kind]} n{gate_in_b[gate]}')
+
+    outputs = ''.join(f'n{net}, ' for net in netlist.output_nets)
+    lines.append(f'    return ({outputs})')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+def cycles_key(netlist: Netlist, clock_nets, sampled) -> str:
+    """
+        Returns the cache key of the cycle function of a netlist, see `generate_cycles_source`
+    """
+    digest = hashlib.sha256(structural_hash(netlist).encode())
+    digest.update(f'cycles {list(clock_nets)} {list(sampled)}'.encode())
+    return digest.hexdigest()
+
+
+def generate_cycles_source(netlist: Netlist, clock_nets, sampled):
+    """
+        Returns the source of a python function stepping a synchronous netlist through
+        clock cycles, None if the netlist is not synchronous
+
+        The function is called as `run_cycles(state, count, samples)`, with the same
+        meaning as in `NetlistSimulator.run_cycles`: it steps `count` cycles of the
+        `clock_nets` starting from the settled `state`, stores the `sampled` nets
+        packed into `samples[cycle]` after every rising edge and writes the final
+        value of every net driven by a gate back to `state` (the clock nets are left
+        to the caller).
+
+        A netlist is synchronous when every latch is enabled by one of the clock nets
+        and, with the clock held at either level, no loop of gates remains (feedback
+        only goes through latches that hold at that level). Each level is then a
+        combinational circuit from the holding latches and the inputs, evaluated in
+        straight-line code. Inputs keep their value through all the cycles, so the
+        gates only depending on them are evaluated once, before the first cycle
+    """
+    clocks = set(clock_nets)
+    gate_types = netlist.gate_types
+    gate_in_a = netlist.gate_in_a
+    gate_in_b = netlist.gate_in_b
+    gate_out = netlist.gate_out
+
+    driver = {}
+    gates = []
+    for gate, kind in enumerate(gate_types):
+        out = gate_out[gate]
+        if out in driver:
+            return None
+        driver[out] = gate
+        if kind == GATE_CLOCK:
+            # clocks that are not stepped keep their level, like inputs
+            continue
+        if out in clocks:
+            return None
+        if kind in (GATE_LATCH, GATE_LATCH_N) and gate_in_b[gate] not in clocks:
+            return None
+        gates.append(gate)
+
+    def data_inputs(gate):
+        kind = gate_types[gate]
+        if kind in (GATE_AND, GATE_OR):
+            return (gate_in_a[gate], gate_in_b[gate])
+        return (gate_in_a[gate],)
+
+    def holds(gate, level):
+        kind = gate_types[gate]
+        return (kind == GATE_LATCH and not level) or (kind == GATE_LATCH_N and level)
+
+    def level_order(level):
+        # topological order of the gates evaluated at this clock level, holding
+        # latches are sources. None if a loop is left
+        evaluated = [gate for gate in gates if not holds(gate, level)]
+        members = set(evaluated)
+        waiting = {}
+        readers = {}
+        for gate in evaluated:
+            count = 0
+            for net in data_inputs(gate):
+                source = driver.get(net)
+                if source in members:
+                    readers.setdefault(source, []).append(gate)
+                    count += 1
+            waiting[gate] = count
+
+        ready = [gate for gate in evaluated if not waiting[gate]]
+        order = []
+        while ready:
+            gate = ready.pop()
+            order.append(gate)
+            for reader in readers.get(gate, ()):
+                waiting[reader] -= 1
+                if not waiting[reader]:
+                    ready.append(reader)
+
+        return order if len(order) == len(evaluated) else None
+
+    rising = level_order(1)
+    falling = level_order(0)
+    if rising is None or falling is None:
+        return None
+
+    # nets that keep their value through all the cycles: undriven nets, inputs
+    # and clocks that are not stepped, and gates only reading such nets
+    static = set()
+    for net in range(netlist.NetCount):
+        if net not in clocks and (net not in driver or gate_types[driver[net]] == GATE_CLOCK):
+            static.add(net)
+    static_gates = []
+    for gate in rising:
+        if gate_types[gate] not in (GATE_LATCH, GATE_LATCH_N) and all(net in static for net in data_inputs(gate)):
+            static.add(gate_out[gate])
+            static_gates.append(gate)
+    hoisted = set(static_gates)
+
+    def operand(net, level):
+        return str(level) if net in clocks else f'n{net}'
+
+    def gate_line(gate, level, indent):
+        kind = gate_types[gate]
+        out = gate_out[gate]
+        a = operand(gate_in_a[gate], level)
+        if kind == GATE_NOT:
+            return f'{indent}n{out} = {a} ^ 1'
+        if kind in (GATE_LATCH, GATE_LATCH_N):
+            # transparent at this level
+            return f'{indent}n{out} = {a}'
+        return f'{indent}n{out} = {a} {_OPERATORS[kind]} {operand(gate_in_b[gate], level)}'
+
+    lines = [f'def {CYCLES_FUNCTION_NAME}(state, count, samples):']
+    lines.append('    if not count:')
+    lines.append('        return')
+
+    # static nets and latch outputs start from the settled state
+    loaded = [net for net in sorted(static) if net not in driver or driver[net] not in hoisted]
+    loaded.extend(gate_out[gate] for gate in gates if gate_types[gate] in (GATE_LATCH, GATE_LATCH_N))
+    for net in loaded:
+        lines.append(f'    n{net} = state[{net}]')
+    for gate in static_gates:
+        lines.append(gate_line(gate, 0, '    '))
+
+    lines.append('    for cycle in range(count):')
+    for gate in rising:
+        if gate not in hoisted:
+            lines.append(gate_line(gate, 1, '        '))
+    word = ' | '.join(
+        f'({operand(net, 1)} << {bit})' if bit else operand(net, 1) for bit, net in enumerate(sampled)
+    )
+    lines.append(f'        samples[cycle] = {word or "0"}')
+    for gate in falling:
+        if gate not in hoisted:
+            lines.append(gate_line(gate, 0, '        '))
+
+    for gate in gates:
+        out = gate_out[gate]
+        lines.append(f'    state[{out}] = n{out}')
+    lines.append('')
+    return '\n'.join(lines)
+
+
+class SourceCache:
+
+    """
+        Generated sources on disk, one file per structural hash
+
+        The cache is best effort: files that can't be read or written are
+        simply regenerated. Every file starts with a header naming its key and
+        the CODEGEN_VERSION and ends with a trailer, files without both (e.g.
+        truncated ones, or anything else that ended up in the directory) are
+        ignored rather than executed
+    """
+
+    TRAILER = '# end of generated source\n'
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.py')
+
+    @staticmethod
+    def _header(key):
+        return f'# digital-logic-simulator codegen {CODEGEN_VERSION} {key}\n'
+
+    def load(self, key):
+        """
+            Returns the source stored for `key`, None if there is no valid one
+        """
+        try:
+            with open(self._path(key), encoding='utf-8') as file:
+                text = file.read()
+        except (OSError, UnicodeDecodeError):
+            return None
+
+        header = self._header(key)
+        if not text.startswith(header) or not text.endswith(self.TRAILER):
+            return None
+        return text[len(header):-len(self.TRAILER)]
+
+    def store(self, key, source):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            # written to a temporary file first, so readers never see a partial source
+            fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as file:
+                file.write(self._header(key))
+                file.write(source)
+                file.write(self.TRAILER)
+            os.replace(temp, self._path(key))
+        except OSError:
+            pass
+
+
+default_cache = SourceCache(DEFAULT_CACHE_DIR) if DEFAULT_CACHE_DIR else None
+
+# functions compiled in this process, by structural hash
+_compiled = {}  # type: dict[str, callable]
+
+
+def compile_netlist(netlist: Netlist, cache: SourceCache = default_cache):
+    """
+        Returns the generated function (see `generate_source`) for a combinational netlist
+
+        Netlists with the same structure share one function. Sources are looked up in
+        `cache` before being generated, pass None to always generate them
+    """
+    key = structural_hash(netlist)
+    function = _compiled.get(key)
+    if function is not None:
+        return function
+
+    function = _compile(netlist, key, FUNCTION_NAME, lambda: generate_source(netlist), cache)
+    _compiled[key] = function
+    return function
+
+
+def compile_cycles(netlist: Netlist, clock_nets, sampled, cache: SourceCache = default_cache):
+    """
+        Returns the generated function (see `generate_cycles_source`) stepping a netlist
+        through clock cycles, None if the netlist is not synchronous. Cached like `compile_netlist`
+    """
+    key = cycles_key(netlist, clock_nets, sampled)
+    if key in _compiled:
+        return _compiled[key]
+
+    function = _compile(netlist, key, CYCLES_FUNCTION_NAME, lambda: generate_cycles_source(netlist, clock_nets, sampled), cache)
+    _compiled[key] = function
+    return function
+
+
+def _compile(netlist: Netlist, key, name, generate, cache: SourceCache):
+    """
+        Returns the function `name` of the source cached under `key`, generating (and
+        caching) the source if needed. None if `generate` returns None
+    """
+    source = cache.load(key) if cache is not None else None
+    if source is not None:
+        # a damaged file is regenerated (and overwritten) like a missing one
+        try:
+            function = _load_function(source, netlist, key, name)
+        except (SyntaxError, ValueError):
+            function = None
+        if function is not None:
+            return function
+
+    source = generate()
+    if source is None:
+        return None
+
+    function = _load_function(source, netlist, key, name)
+    if cache is not None:
+        cache.store(key, source)
+    return function
+
+
+def _load_function(source, netlist: Netlist, key, name):
+    """
+        Executes a generated source, returns its function `name` or None if it does not define one
+    """
+    namespace = {}
+    exec(compile(source, f'<netlist {netlist.name} {key[:12]}>', 'exec'), namespace)
+    function = namespace.get(name)
+    return function if callable(function) else None
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from array import array
+from collections import deque
+
+from typing import TYPE_CHECKING
+
+from app.pins import ChipPin, SignalEmitter, InputSignalPin, OutputSignalPin
+if TYPE_CHECKING:
+    from app.chip import Chip
+
+
+# kinds of wire endpoints, the same values as the editor's `PinLocation` types
+END_CHIP_IN = 1
+END_CHIP_OUT = 2
+END_SIG_IN = 3
+END_SIG_OUT = 4
+
+# number of ints describing a wire: kind, chip and pin index of both ends
+WIRE_FIELDS = 6
+
+
+class CircuitDefinition:
+
+    """
+        Hierarchical description of a circuit: the chips it is made of and the wires between them
+
+        Unlike a `Netlist`, nothing is flattened. Every chip is referenced by its
+        type, which is either the name of a builtin chip (see `chip_type_name`) or
+        the `CircuitDefinition` of a custom chip, so every custom chip type is
+        described exactly once no matter how often it is used.
+
+        Wires are stored in a flat array, WIRE_FIELDS ints per wire: the kind of
+        the source end, its chip index and pin index, then the same for the target
+        end. Input and output signals use -1 as their chip index and the signal's
+        index as their pin index. `positions` holds the x and y coordinate of
+        every chip, for circuits that are shown in the editor. `input_widths` and
+        `output_widths` hold the number of bits of every signal (see `BusPin`).
+    """
+
+    def __init__(self, name, input_count, output_count, chip_types=None, positions=None, wires=None,
+                 input_widths=None, output_widths=None):
+        self.name = name
+        self.input_count = input_count
+        self.output_count = output_count
+
+        self.input_widths = input_widths if input_widths is not None else array('i', [1]) * input_count  # type: array
+        self.output_widths = output_widths if output_widths is not None else array('i', [1]) * output_count  # type: array
+
+        self.chip_types = chip_types if chip_types is not None else []  # type: list[str | CircuitDefinition]
+        self.positions = positions if positions is not None else array('i')  # type: array
+        self.wires = wires if wires is not None else array('i')  # type: array
+
+        # the compiled template, set by whoever builds it first (see `ChipTemplate.definition`)
+        self.template = None
+
+    @property
+    def ChipCount(self):
+        return len(self.chip_types)
+
+    @property
+    def WireCount(self):
+        return len(self.wires) // WIRE_FIELDS
+
+    def add_chip(self, chip_type, position=(0, 0)):
+        self.chip_types.append(chip_type)
+        self.positions.extend(position)
+        return len(self.chip_types) - 1
+
+    @property
+    def HasBuses(self):
+        return any(width != 1 for width in self.input_widths) or any(width != 1 for width in self.output_widths)
+
+    def add_wire(self, source_kind, source_chip, source_pin, target_kind, target_chip, target_pin):
+        self.wires.extend((source_kind, source_chip, source_pin, target_kind, target_chip, target_pin))
+
+    def dependencies(self):
+        """
+            Returns every custom chip definition used by this circuit (directly or
+            nested), each one after the definitions it uses itself
+        """
+        result = []
+        seen = set()
+
+        # iterative post-order walk, libraries can be nested deeply
+        stack = [(self, iter(self.chip_types))]
+        seen.add(id(self))
+        while stack:
+            definition, types = stack[-1]
+            for chip_type in types:
+                if isinstance(chip_type, CircuitDefinition) and id(chip_type) not in seen:
+                    seen.add(id(chip_type))
+                    stack.append((chip_type, iter(chip_type.chip_types)))
+                    break
+            else:
+                stack.pop()
+                if definition is not self:
+                    result.append(definition)
+
+        return result
+
+    def __repr__(self):
+        return f"CircuitDefinition < name={self.name}, chips={self.ChipCount}, wires={self.WireCount} >"
+
+
+def chip_type_name(chip: Chip) -> str:
+    """
+        Returns the name a builtin chip is stored under. Registers and bus chips are stored along with their width
+    """
+    bits = getattr(chip, 'bits', None)
+    if bits is not None and chip.name == "REG":
+        return f"REG{bits}"
+    width = getattr(chip, 'width', None)
+    if width is not None:
+        return f"{chip.name}{width}"
+    return chip.name
+
+
+def chip_type(chip: Chip):
+    """
+        Returns the type of a chip as referenced by a `CircuitDefinition`
+    """
+    template = getattr(chip, 'template', None)
+    if template is not None:
+        return template.definition
+    return chip_type_name(chip)
+
+
+def define_circuit(name, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin],
+                   sources: list[Chip] = ()) -> CircuitDefinition:
+    """
+        Describes the circuit between a set of input and output signals (i.e. the
+        definition of a custom chip), chips are found the same way as by `compile_circuit`
+    """
+    definition = CircuitDefinition(
+        name, len(input_signals), len(output_signals),
+        input_widths=array('i', [signal.width for signal in input_signals]),
+        output_widths=array('i', [signal.width for signal in output_signals]),
+    )
+
+    # endpoint (kind, chip index, pin index) of every pin that is part of the circuit
+    ends = {}  # type: dict[int, tuple[int, int, int]]
+    for i, signal in enumerate(input_signals):
+        ends[id(signal)] = (END_SIG_IN, -1, i)
+    for i, signal in enumerate(output_signals):
+        ends[id(signal)] = (END_SIG_OUT, -1, i)
+
+    emitters = []  # type: list[SignalEmitter]
+    queue = deque(input_signals)
+    seen = set(id(signal) for signal in input_signals)
+
+    def add_chip(chip):
+        seen.add(id(chip))
+        index = definition.add_chip(chip_type(chip))
+        for i, pin in enumerate(chip.input_pins):
+            ends[id(pin)] = (END_CHIP_IN, index, i)
+        for i, pin in enumerate(chip.output_pins):
+            ends[id(pin)] = (END_CHIP_OUT, index, i)
+        queue.extend(chip.output_pins)
+
+    for chip in sources:
+        if id(chip) not in seen:
+            add_chip(chip)
+
+    while queue:
+        emitter = queue.popleft()
+        emitters.append(emitter)
+
+        for child in emitter.children:
+            if isinstance(child, ChipPin) and child.pin_type == ChipPin.PinType.INPUT:
+                if id(child.chip) not in seen:
+                    add_chip(child.chip)
+
+            elif isinstance(child, SignalEmitter) and id(child) not in seen:
+                seen.add(id(child))
+                queue.append(child)
+
+    # input signals that are not part of the circuit only relay a signal (as in
+    # `compile_circuit`), their wires are saved as coming from the pin driving them
+    relayed = {}  # type: dict[int, tuple[int, int, int]]
+
+    for emitter in emitters:
+        source = ends.get(id(emitter))
+        if source is None:
+            # emitters are in the order they were reached, so a relay's driver comes first
+            source = relayed[id(emitter)]
+
+        for child in emitter.children:
+            target = ends.get(id(child))
+            if target is None:
+                if isinstance(child, SignalEmitter):
+                    relayed[id(child)] = source
+                # anything else outside the circuit (output signals of an enclosing
+                # circuit, probes) reads the signal without being part of it
+                continue
+            definition.wires.extend(source)
+            definition.wires.extend(target)
+
+    return definition
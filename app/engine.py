@@ -0,0 +1,379 @@
+from __future__ import annotations
+
+from app.pins import OscillationError, Scheduler
+from array import array
+
+from app.netlist import Netlist, GATE_AND, GATE_OR, GATE_NOT, GATE_LATCH, GATE_LATCH_N, compile_chip
+from app.codegen import compile_cycles
+
+# number of delta cycles after which a circuit is watched for oscillation, the same as for the object model
+MAX_DELTA_CYCLES = Scheduler.MAX_DELTA_CYCLES
+
+
+def propagate(netlist: Netlist, state: bytearray, gates, queued: bytearray = None) -> int:
+    """
+        Evaluates the given gates and everything downstream of them until no net changes
+
+        Gates are processed in delta cycles: every gate whose input changed during
+        one cycle is evaluated exactly once in the next one. `queued` is scratch
+        space of one (zeroed) byte per gate, callers that propagate often should
+        allocate it once and pass it in. Returns the total number of gate
+        evaluations performed. Raises `OscillationError` if, past `MAX_DELTA_CYCLES`
+        cycles, the circuit spends as many cycles again without reaching a new gate
+    """
+    gate_types = netlist.gate_types
+    gate_in_a = netlist.gate_in_a
+    gate_in_b = netlist.gate_in_b
+    gate_out = netlist.gate_out
+    fanout_start = netlist.fanout_start
+    fanout_gates = netlist.fanout_gates
+
+    if queued is None:
+        queued = bytearray(netlist.GateCount)
+
+    pending = []
+    for gate in gates:
+        if not queued[gate]:
+            queued[gate] = 1
+            pending.append(gate)
+
+    evaluations = 0
+    deltas = 0
+    seen = None
+    stale = 0
+    while pending:
+        deltas += 1
+        if deltas > MAX_DELTA_CYCLES:
+            if seen is None:
+                seen = set()
+
+            size = len(seen)
+            seen.update(pending)
+            stale = stale + 1 if len(seen) == size else 0
+            if stale > MAX_DELTA_CYCLES:
+                for gate in pending:
+                    queued[gate] = 0
+                raise OscillationError(
+                    f"'{netlist.name}' did not settle after {deltas} delta cycles"
+                )
+
+        evaluations += len(pending)
+        scheduled = []
+        for gate in pending:
+            queued[gate] = 0
+
+            kind = gate_types[gate]
+            if kind == GATE_AND:
+                value = state[gate_in_a[gate]] & state[gate_in_b[gate]]
+            elif kind == GATE_OR:
+                value = state[gate_in_a[gate]] | state[gate_in_b[gate]]
+            elif kind == GATE_NOT:
+                value = state[gate_in_a[gate]] ^ 1
+            elif kind == GATE_LATCH:
+                value = state[gate_in_a[gate]] if state[gate_in_b[gate]] else state[gate_out[gate]]
+            elif kind == GATE_LATCH_N:
+                value = state[gate_out[gate]] if state[gate_in_b[gate]] else state[gate_in_a[gate]]
+            else:
+                # clock sources are only ever changed from outside
+                continue
+
+            out = gate_out[gate]
+            if state[out] != value:
+                state[out] = value
+                for i in range(fanout_start[out], fanout_start[out + 1]):
+                    target = fanout_gates[i]
+                    if not queued[target]:
+                        queued[target] = 1
+                        scheduled.append(target)
+
+        pending = scheduled
+
+    return evaluations
+
+
+def fanout_of(netlist: Netlist, nets):
+    """
+        Returns the gates reading any of the given nets
+    """
+    gates = []
+    for net in nets:
+        gates.extend(netlist.fanout(net))
+    return gates
+
+
+class NetlistSimulator:
+
+    """
+        Simulates a compiled `Netlist`
+
+        Typical usage:
+
+            sim = NetlistSimulator(compile_chip(chip))
+            sim.set_input(0, 1)
+            sim.settle()
+            print(sim.Outputs)
+    """
+
+    def __init__(self, netlist: Netlist):
+        self.netlist = netlist
+        self.state = netlist.new_state()
+        self._queued = bytearray(netlist.GateCount)
+
+        # total number of gate evaluations done by this simulator
+        self.evaluations = 0
+
+        # nets that changed since the last call to `settle`
+        self._dirty_nets = []  # type: list[int]
+
+        # bring the whole circuit to a consistent state once, after
+        # that only the parts affected by changed inputs are evaluated
+        self.evaluations += propagate(netlist, self.state, range(netlist.GateCount), self._queued)
+
+    @property
+    def Outputs(self):
+        state = self.state
+        return [state[net] for net in self.netlist.output_nets]
+
+    def set_input(self, index, signal):
+        net = self.netlist.input_nets[index]
+        if self.state[net] != signal:
+            self.state[net] = signal
+            self._dirty_nets.append(net)
+
+    def set_inputs(self, signals):
+        for index, signal in enumerate(signals):
+            self.set_input(index, signal)
+
+    def settle(self):
+        """
+            Propagates all input changes made since the last call through the circuit
+        """
+        if not self._dirty_nets:
+            return
+
+        gates = fanout_of(self.netlist, self._dirty_nets)
+        self._dirty_nets = []
+        self.evaluations += propagate(self.netlist, self.state, gates, self._queued)
+
+    def apply(self, signals):
+        """
+            Sets all inputs at once, settles the circuit and returns the outputs
+        """
+        self.set_inputs(signals)
+        self.settle()
+        return self.Outputs
+
+    def run_cycles(self, count, clock=None, outputs=None, codegen=True) -> array:
+        """
+            Steps `count` full clock cycles (rising then falling edge) and returns the
+            outputs sampled after every rising edge
+
+            By default the clock sources of the netlist are stepped, `clock` selects an
+            input to be used as the clock instead. `outputs` are the indices of the
+            outputs to sample (all of them by default, at most 64). Every sample packs
+            output `outputs[i]` into bit i, the samples are returned in an array('Q')
+
+            Synchronous netlists (see `generate_cycles_source`) are stepped by generated
+            code unless `codegen` is unset, which is several times faster than the event
+            driven engine (about 500k cycles/s for an 8 bit counter, against 40k). Gate
+            evaluations of generated code are not counted in `evaluations`. Other
+            netlists, e.g. with latches built from gates, always use the engine
+        """
+        netlist = self.netlist
+        state = self.state
+        queued = self._queued
+
+        clock_nets = netlist.ClockNets if clock is None else [netlist.input_nets[clock]]
+        if not clock_nets:
+            raise ValueError(f"'{netlist.name}' has no clock")
+
+        if outputs is None:
+            outputs = range(len(netlist.output_nets))
+        sampled = [netlist.output_nets[i] for i in outputs]
+        if len(sampled) > 64:
+            raise ValueError("At most 64 outputs can be sampled")
+
+        self.settle()
+
+        run = compile_cycles(netlist, clock_nets, sampled) if codegen else None
+        if run is not None:
+            samples = array('Q', bytes(8 * count))
+            run(state, count, samples)
+            # a cycle ends on the falling edge
+            if count:
+                for net in clock_nets:
+                    state[net] = 0
+            return samples
+
+        # only the gates reading the clock are evaluated on an edge, from there on
+        # `propagate` follows whatever actually changes
+        clocked = fanout_of(netlist, clock_nets)
+        samples = array('Q', bytes(8 * count))
+        evaluations = 0
+
+        for cycle in range(count):
+            for level in (1, 0):
+                for net in clock_nets:
+                    state[net] = level
+                evaluations += propagate(netlist, state, clocked, queued)
+
+                if level:
+                    word = 0
+                    for bit, net in enumerate(sampled):
+                        if state[net]:
+                            word |= 1 << bit
+                    samples[cycle] = word
+
+        self.evaluations += evaluations
+        return samples
+
+
+# Bit-parallel evaluation
+#
+# Instead of a single bit, every net holds a python int in which bit k is the
+# value of the net for input vector k. A gate is then a single bitwise operation
+# covering all the vectors at once. Vectors are numbered so that in vector `v`,
+# input `i` has the value `(v >> i) & 1`.
+
+# number of vectors evaluated per pass when the caller does not choose one
+DEFAULT_CHUNK_SIZE = 4096
+
+
+def _as_netlist(circuit) -> Netlist:
+    if isinstance(circuit, Netlist):
+        return circuit
+    return compile_chip(circuit)
+
+
+def evaluate_packed(netlist: Netlist, inputs, width) -> list[int]:
+    """
+        Evaluates `width` input vectors in a single pass over the gates
+
+        `inputs[i]` holds the values of input `i` for all the vectors, packed into
+        an int (bit k belongs to vector k). Returns the outputs packed the same way.
+        Only combinational circuits are supported
+    """
+    if not netlist.IsCombinational:
+        raise ValueError(f"'{netlist.name}' is not combinational and cannot be evaluated bit-parallel")
+    order = netlist.topological_order()
+
+    mask = (1 << width) - 1
+
+    # nets that are not driven by anything keep their compile time value for every vector
+    values = [mask if bit else 0 for bit in netlist.initial_state]
+    for net, packed in zip(netlist.input_nets, inputs):
+        values[net] = packed & mask
+
+    gate_types = netlist.gate_types
+    gate_in_a = netlist.gate_in_a
+    gate_in_b = netlist.gate_in_b
+    gate_out = netlist.gate_out
+
+    for gate in order:
+        kind = gate_types[gate]
+        if kind == GATE_AND:
+            values[gate_out[gate]] = values[gate_in_a[gate]] & values[gate_in_b[gate]]
+        elif kind == GATE_OR:
+            values[gate_out[gate]] = values[gate_in_a[gate]] | values[gate_in_b[gate]]
+        else:
+            values[gate_out[gate]] = values[gate_in_a[gate]] ^ mask
+
+    return [values[net] for net in netlist.output_nets]
+
+
+def pack_vectors(vectors, input_count) -> list[int]:
+    """
+        Packs a list of input vectors (sequences of 0/1) into one int per input
+    """
+    packed = [0] * input_count
+    for k, vector in enumerate(vectors):
+        for i in range(input_count):
+            if vector[i]:
+                packed[i] |= 1 << k
+    return packed
+
+
+def unpack_vectors(packed, width) -> list[tuple]:
+    """
+        Inverse of `pack_vectors`
+    """
+    # the binary representation of every word, reversed so that character k is bit k
+    # and translated from '0'/'1' to bytes 0/1, zipping them gives the vectors directly
+    columns = [format(word, f'0{width}b')[:-width - 1:-1].encode().translate(_BIT_DIGITS) for word in packed]
+    if not columns:
+        return [()] * width
+    return list(zip(*columns))
+
+
+_BIT_DIGITS = bytes.maketrans(b'01', b'\x00\x01')
+
+
+def exhaustive_inputs(input_count, start, width) -> list[int]:
+    """
+        Returns the packed inputs for the vectors `start` to `start + width - 1` of
+        a truth table. `start` and `width` must be multiples of a power of two
+        that is at least `width`, which holds for full chunks of a truth table
+    """
+    packed = []
+    for i in range(input_count):
+        period = 1 << (i + 1)
+        if period <= width:
+            # vector v has input i set when bit i of v is set: within every period of
+            # 2^(i+1) vectors, that is the upper half. Multiplying the pattern of a
+            # single period by the "repunit" 0b...0001...0001 repeats it across the word
+            half = 1 << i
+            block = ((1 << half) - 1) << half
+            packed.append(block * (((1 << width) - 1) // ((1 << period) - 1)))
+        else:
+            packed.append((1 << width) - 1 if (start >> i) & 1 else 0)
+    return packed
+
+
+def simulate_vectors(circuit, vectors, chunk_size=DEFAULT_CHUNK_SIZE) -> list[tuple]:
+    """
+        Evaluates every input vector and returns the output vector for each of them
+
+        `circuit` is either a `Chip` or an already compiled `Netlist`
+    """
+    netlist = _as_netlist(circuit)
+    input_count = len(netlist.input_nets)
+
+    vectors = list(vectors)
+    results = []
+    for start in range(0, len(vectors), chunk_size):
+        chunk = vectors[start:start + chunk_size]
+        packed = evaluate_packed(netlist, pack_vectors(chunk, input_count), len(chunk))
+        results.extend(unpack_vectors(packed, len(chunk)))
+
+    return results
+
+
+def packed_truth_table(circuit, chunk_size=DEFAULT_CHUNK_SIZE) -> list[int]:
+    """
+        Evaluates all 2^n input combinations and returns, for every output, an int
+        holding its value for vector v in bit v. Comparing these ints is the fastest
+        way to check two chips for equivalence
+    """
+    netlist = _as_netlist(circuit)
+    input_count = len(netlist.input_nets)
+    total = 1 << input_count
+
+    # the chunk size must be a power of two for `exhaustive_inputs`
+    width = min(total, 1 << max(chunk_size.bit_length() - 1, 0))
+
+    table = [0] * len(netlist.output_nets)
+    for start in range(0, total, width):
+        packed = evaluate_packed(netlist, exhaustive_inputs(input_count, start, width), width)
+        for i, word in enumerate(packed):
+            table[i] |= word << start
+
+    return table
+
+
+def truth_table(circuit, chunk_size=DEFAULT_CHUNK_SIZE) -> list[tuple]:
+    """
+        Returns the output vector for every input combination, indexed by the vector number
+    """
+    netlist = _as_netlist(circuit)
+    table = packed_truth_table(netlist, chunk_size)
+    return unpack_vectors(table, 1 << len(netlist.input_nets))
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import time
+
+from app.pins import ChipPin, InputSignalPin, Scheduler, scheduler
+from app.chip import Chip
+
+
+def _chip_classes():
+    classes = [Chip]
+    i = 0
+    while i < len(classes):
+        classes.extend(classes[i].__subclasses__())
+        i += 1
+    return classes
+
+
+class ChipStats:
+
+    __slots__ = ('name', 'evaluations', 'seconds', 'slowest')
+
+    def __init__(self, name):
+        self.name = name
+        self.evaluations = 0
+        # total time spent evaluating, and the longest single evaluation
+        self.seconds = 0.0
+        self.slowest = 0.0
+
+    def add(self, seconds):
+        self.evaluations += 1
+        self.seconds += seconds
+        if seconds > self.slowest:
+            self.slowest = seconds
+
+
+class Instrumentation:
+
+    """
+        Opt-in statistics about the simulation of the object graph
+
+        While enabled, `process_output` of every chip class and `recv_signal` of
+        chip and input signal pins are replaced with versions that record:
+
+            - evaluation count and time of every chip instance and of every chip type
+            - the number of events (recv_signal calls) caused by every external
+              input change, i.e. a recv_signal call made while nothing settles, or
+              a scope or batch of the scheduler (e.g. a clock tick) as a whole
+            - the number of delta cycles (propagation depth) every settle took
+
+        Disabling puts the original methods back, so there is no cost at all when
+        not instrumenting. Chip classes defined after `enable` are not covered.
+
+        Typical usage:
+
+            with Instrumentation() as stats:
+                ... toggle inputs ...
+            print(stats.report())
+    """
+
+    def __init__(self):
+        self.per_instance = {}  # type: dict[Chip, ChipStats]
+        self.per_type = {}  # type: dict[str, ChipStats]
+
+        self.external_changes = 0
+        self.events = 0
+        self.max_events_per_change = 0
+        self.max_delta_cycles = 0
+
+        self._originals = []  # type: list[tuple[type, str, object]]
+        # nesting level of recv_signal calls, 0 when the next call is an external change
+        self._recv_depth = 0
+        # event count when the first signal of the scope or batch being filled was sent
+        self._scope_start = None  # type: int
+
+    @property
+    def Enabled(self):
+        return bool(self._originals)
+
+    def enable(self):
+        if self.Enabled:
+            return
+
+        for cls in _chip_classes():
+            if 'process_output' in cls.__dict__:
+                self._swap(cls, 'process_output', self._wrap_process_output)
+
+        self._swap(ChipPin, 'recv_signal', self._wrap_recv_signal)
+        self._swap(InputSignalPin, 'recv_signal', self._wrap_recv_signal)
+        self._swap(Scheduler, '_settle', self._wrap_settle)
+
+    def disable(self):
+        for cls, attr, original in reversed(self._originals):
+            setattr(cls, attr, original)
+        self._originals = []
+
+    def __enter__(self):
+        self.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.disable()
+
+    def reset(self):
+        self.per_instance.clear()
+        self.per_type.clear()
+        self.external_changes = 0
+        self.events = 0
+        self.max_events_per_change = 0
+        self.max_delta_cycles = 0
+        self._scope_start = None
+
+    def _swap(self, cls, attr, wrap):
+        original = cls.__dict__[attr]
+        self._originals.append((cls, attr, original))
+        setattr(cls, attr, wrap(original))
+
+    def _wrap_process_output(self, original):
+        per_instance = self.per_instance
+        per_type = self.per_type
+        clock = time.perf_counter
+
+        def process_output(chip):
+            start = clock()
+            original(chip)
+            seconds = clock() - start
+
+            stats = per_instance.get(chip)
+            if stats is None:
+                stats = per_instance[chip] = ChipStats(chip.name)
+            stats.add(seconds)
+
+            stats = per_type.get(chip.name)
+            if stats is None:
+                stats = per_type[chip.name] = ChipStats(chip.name)
+            stats.add(seconds)
+
+        return process_output
+
+    def _wrap_recv_signal(self, original):
+        def recv_signal(pin, signal):
+            self.events += 1
+            if not self._recv_depth and scheduler._frames and self._scope_start is None:
+                # sent inside a scope or batch, the change is counted once it settles
+                self._scope_start = self.events - 1
+
+            if self._recv_depth or scheduler._frames:
+                self._recv_depth += 1
+                try:
+                    original(pin, signal)
+                finally:
+                    self._recv_depth -= 1
+                return
+
+            # an external change, count all the events it causes
+            self.external_changes += 1
+            events = self.events
+            self._recv_depth = 1
+            try:
+                original(pin, signal)
+            finally:
+                self._recv_depth = 0
+                self.max_events_per_change = max(self.max_events_per_change, self.events - events + 1)
+
+        return recv_signal
+
+    def _wrap_settle(self, original):
+        def _settle(scheduler, pending):
+            # settles started by a recv_signal call are part of its change, the
+            # outermost scope or batch is a change of its own
+            external = not self._recv_depth and len(scheduler._frames) == 1
+            if external:
+                self.external_changes += 1
+                events = self.events if self._scope_start is None else self._scope_start
+            try:
+                original(scheduler, pending)
+            finally:
+                if external:
+                    self._scope_start = None
+                    self.max_events_per_change = max(self.max_events_per_change, self.events - events)
+            self.max_delta_cycles = max(self.max_delta_cycles, scheduler.last_delta_cycles)
+
+        return _settle
+
+    def hot_spots(self, top=10, by_type=False, key='seconds'):
+        """
+            Returns the `top` chip instances (or chip types) with the highest `key`
+            ('seconds', 'evaluations' or 'slowest'), highest first
+        """
+        stats = self.per_type if by_type else self.per_instance
+        return sorted(stats.items(), key=lambda item: getattr(item[1], key), reverse=True)[:top]
+
+    def report(self, top=10):
+        lines = []
+        lines.append(f"external input changes: {self.external_changes}")
+        lines.append(f"events (recv_signal):   {self.events}")
+        if self.external_changes:
+            lines.append(f"events per change:      {self.events / self.external_changes:.1f} avg, {self.max_events_per_change} max")
+        lines.append(f"max propagation depth:  {self.max_delta_cycles} delta cycles")
+
+        def table(title, items, label):
+            lines.append("")
+            lines.append(title)
+            lines.append(f"  {'chip':<30} {'evals':>10} {'total ms':>10} {'avg us':>9} {'max us':>9}")
+            for owner, stats in items:
+                avg = stats.seconds / stats.evaluations * 1e6
+                lines.append(
+                    f"  {label(owner, stats):<30} {stats.evaluations:>10} {stats.seconds * 1e3:>10.2f} {avg:>9.1f} {stats.slowest * 1e6:>9.1f}"
+                )
+
+        table("hot chip types", self.hot_spots(top, by_type=True), lambda name, stats: name)
+        table("hot chip instances", self.hot_spots(top), lambda chip, stats: f"{stats.name} @{id(chip):x}")
+
+        return "\n".join(lines)
@@ -0,0 +1,463 @@
+from __future__ import annotations
+
+from array import array
+from collections import deque
+
+from typing import TYPE_CHECKING
+
+from app.pins import ChipPin, SignalEmitter, InputSignalPin, OutputSignalPin, Probe
+if TYPE_CHECKING:
+    from app.chip import Chip
+
+
+# gate type codes used in the flat representation. Builtin chips that compile
+# to a single gate declare their code in their `gate_code` class attribute
+GATE_AND = 0
+GATE_OR = 1
+GATE_NOT = 2
+# level sensitive latches: the output follows the first input while the second
+# (the enable) is high, respectively low, and holds its value otherwise
+GATE_LATCH = 3
+GATE_LATCH_N = 4
+# clock source without inputs, its output only changes when stepped from outside
+GATE_CLOCK = 5
+
+# gates with state of their own, a netlist containing any of these is sequential
+SEQUENTIAL_GATES = frozenset((GATE_LATCH, GATE_LATCH_N, GATE_CLOCK))
+
+
+class Netlist:
+
+    """
+        Flat, array backed representation of a circuit
+
+        Every electrically connected group of pins is collapsed into a single net,
+        identified by its index. Every builtin gate becomes one entry in the gate
+        arrays, which hold its type code, the nets it reads from and the net it
+        drives. Nested custom chips are inlined, so a netlist only ever contains
+        builtin gates. Gates without inputs (clocks) have -1 as their operands.
+
+        Buses are lowered to one net per bit. `input_nets` and `output_nets` list
+        the nets of every bit, and `input_widths` and `output_widths` how they are
+        grouped into pins: the first input pin covers the first `input_widths[0]`
+        input nets (least significant bit first) and so on.
+
+        A netlist is never modified once built. The value of every net lives in
+        a separate state array (see `new_state`) so that any number of
+        simulations can share the same netlist.
+    """
+
+    def __init__(self, name, gate_types, gate_in_a, gate_in_b, gate_out,
+                 initial_state, input_nets, output_nets, input_widths=None, output_widths=None):
+        self.name = name
+
+        self.gate_types = gate_types  # type: array
+        self.gate_in_a = gate_in_a  # type: array
+        # second operand of two input gates, -1 for single input gates
+        self.gate_in_b = gate_in_b  # type: array
+        self.gate_out = gate_out  # type: array
+
+        self.initial_state = initial_state  # type: bytearray
+
+        self.input_nets = input_nets  # type: array
+        self.output_nets = output_nets  # type: array
+
+        # one bit pins only, unless given
+        self.input_widths = input_widths if input_widths is not None else array('l', [1]) * len(input_nets)  # type: array
+        self.output_widths = output_widths if output_widths is not None else array('l', [1]) * len(output_nets)  # type: array
+
+        # fan-out of every net in CSR form: the gates reading net `n` are
+        # fanout_gates[fanout_start[n]:fanout_start[n + 1]]
+        self.fanout_start, self.fanout_gates = self._build_fanout()
+
+        # lazily computed, see `topological_order`
+        self._topological_order = None
+
+    @property
+    def NetCount(self):
+        return len(self.initial_state)
+
+    @property
+    def GateCount(self):
+        return len(self.gate_types)
+
+    def _build_fanout(self):
+        counts = [0] * (self.NetCount + 1)
+        for net in self.gate_in_a:
+            if net != -1:
+                counts[net + 1] += 1
+        for net in self.gate_in_b:
+            if net != -1:
+                counts[net + 1] += 1
+
+        for i in range(self.NetCount):
+            counts[i + 1] += counts[i]
+
+        fanout_start = array('l', counts)
+        fanout_gates = array('l', bytes(fanout_start.itemsize * counts[-1]))
+
+        # `counts` is reused as the insertion cursor of every net
+        for gate in range(self.GateCount):
+            for net in (self.gate_in_a[gate], self.gate_in_b[gate]):
+                if net == -1:
+                    continue
+                fanout_gates[counts[net]] = gate
+                counts[net] += 1
+
+        return fanout_start, fanout_gates
+
+    def fanout(self, net):
+        """
+            Returns the indices of gates that read the given net
+        """
+        return self.fanout_gates[self.fanout_start[net]:self.fanout_start[net + 1]]
+
+    @property
+    def HasBuses(self):
+        return any(width != 1 for width in self.input_widths) or any(width != 1 for width in self.output_widths)
+
+    @property
+    def IsSequential(self):
+        return not SEQUENTIAL_GATES.isdisjoint(self.gate_types)
+
+    @property
+    def IsCombinational(self):
+        return not self.IsSequential and self.topological_order() is not None
+
+    @property
+    def ClockNets(self):
+        """
+            Nets driven by clock sources
+        """
+        gate_out = self.gate_out
+        return [gate_out[gate] for gate, kind in enumerate(self.gate_types) if kind == GATE_CLOCK]
+
+    def topological_order(self):
+        """
+            Returns the gates ordered so that every gate comes after the gates driving its inputs,
+            or None if the circuit contains a feedback loop
+        """
+        if self._topological_order is None:
+            order = self._sort_gates()
+            # False (instead of None) so a failed sort is remembered too
+            self._topological_order = order if order is not None else False
+
+        if self._topological_order is False:
+            return None
+
+        return self._topological_order
+
+    def _sort_gates(self):
+        # driver of every net, -1 for nets that are not driven by a gate
+        driver = array('l', [-1]) * self.NetCount
+        for gate, net in enumerate(self.gate_out):
+            driver[net] = gate
+
+        # number of inputs of every gate that are still waiting on their driver
+        waiting = [0] * self.GateCount
+        for gate in range(self.GateCount):
+            for net in (self.gate_in_a[gate], self.gate_in_b[gate]):
+                if net != -1 and driver[net] != -1:
+                    waiting[gate] += 1
+
+        order = array('l', [gate for gate in range(self.GateCount) if waiting[gate] == 0])
+        i = 0
+        while i < len(order):
+            out = self.gate_out[order[i]]
+            for target in self.fanout(out):
+                waiting[target] -= 1
+                if waiting[target] == 0:
+                    order.append(target)
+            i += 1
+
+        if len(order) != self.GateCount:
+            return None
+
+        return order
+
+    def signature(self):
+        """
+            Returns a value that is equal for two netlists exactly when they are structurally identical
+        """
+        # the initial value of nets driven by a gate or an input is just a snapshot
+        # of the simulation, only undriven (i.e. constant) nets affect behaviour
+        constants = bytearray(self.initial_state)
+        for net in self.gate_out:
+            constants[net] = 0
+        for net in self.input_nets:
+            constants[net] = 0
+
+        return (
+            self.gate_types.tobytes(), self.gate_in_a.tobytes(), self.gate_in_b.tobytes(),
+            self.gate_out.tobytes(), self.input_nets.tobytes(), self.output_nets.tobytes(),
+            self.input_widths.tobytes(), self.output_widths.tobytes(), bytes(constants),
+        )
+
+    def new_state(self):
+        """
+            Returns a fresh state array initialized with the compile time values of all nets
+        """
+        return bytearray(self.initial_state)
+
+
+class NetlistBuilder:
+
+    """
+        Incrementally assembles a `Netlist`
+
+        Nets can be merged at any time using `union` (for example when a wire
+        connects two pins), the final net numbering is only decided in `build`
+    """
+
+    def __init__(self):
+        # union-find forest over net indices
+        self._parent = []  # type: list[int]
+        self._state = bytearray()
+
+        self.gate_types = array('B')
+        self.gate_in_a = array('l')
+        self.gate_in_b = array('l')
+        self.gate_out = array('l')
+
+    def new_net(self, state=0):
+        net = len(self._parent)
+        self._parent.append(net)
+        self._state.append(state)
+        return net
+
+    def find(self, net):
+        parent = self._parent
+        root = net
+        while parent[root] != root:
+            root = parent[root]
+
+        # path compression
+        while parent[net] != root:
+            parent[net], net = root, parent[net]
+
+        return root
+
+    def union(self, driver, net):
+        """
+            Merges `net` into the net of `driver`. The merged net keeps the state of the driver
+        """
+        driver = self.find(driver)
+        net = self.find(net)
+        if driver != net:
+            self._parent[net] = driver
+
+    def add_gate(self, kind, in_a, in_b, out):
+        self.gate_types.append(kind)
+        self.gate_in_a.append(in_a)
+        self.gate_in_b.append(in_b)
+        self.gate_out.append(out)
+
+    def inline(self, netlist: Netlist, state, input_nets):
+        """
+            Adds a copy of all the gates of `netlist` reading from the given input nets, with
+            the internal nets initialized from `state`. Returns the nets of the copy's outputs
+        """
+        nets = [self.new_net(value) for value in state]
+        for net, inner in zip(input_nets, netlist.input_nets):
+            self.union(net, nets[inner])
+
+        gate_in_a = netlist.gate_in_a
+        gate_in_b = netlist.gate_in_b
+        for gate in range(netlist.GateCount):
+            in_a = gate_in_a[gate]
+            in_b = gate_in_b[gate]
+            self.add_gate(
+                netlist.gate_types[gate],
+                nets[in_a] if in_a != -1 else -1,
+                nets[in_b] if in_b != -1 else -1,
+                nets[netlist.gate_out[gate]],
+            )
+
+        return [nets[net] for net in netlist.output_nets]
+
+    def add_chip(self, chip: Chip, input_nets):
+        """
+            Adds the gates of `chip` reading from the given input nets. Returns the nets of its outputs
+        """
+        return _flatten(chip, input_nets, self)
+
+    def build(self, name, input_nets, output_nets, input_widths=None, output_widths=None) -> Netlist:
+        # renumber the root of every set densely, in order of first appearance
+        index = {}
+        remap = array('l', bytes(array('l').itemsize * len(self._parent)))
+        state = bytearray()
+        for net in range(len(self._parent)):
+            root = self.find(net)
+            if root not in index:
+                index[root] = len(state)
+                state.append(self._state[root])
+            remap[net] = index[root]
+
+        def _remap(nets):
+            return array('l', (remap[n] if n != -1 else -1 for n in nets))
+
+        return Netlist(
+            name,
+            array('B', self.gate_types),
+            _remap(self.gate_in_a),
+            _remap(self.gate_in_b),
+            _remap(self.gate_out),
+            state,
+            _remap(input_nets),
+            _remap(output_nets),
+            array('l', input_widths) if input_widths is not None else None,
+            array('l', output_widths) if output_widths is not None else None,
+        )
+
+
+def compile_chip(chip: Chip) -> Netlist:
+    """
+        Flattens a chip (including all the custom chips nested inside it) into a `Netlist`
+
+        The chip's input and output pins become the netlist's input and output nets,
+        in the same order. Net values are initialized from the current pin states
+    """
+    builder = NetlistBuilder()
+    input_nets = []
+    for pin in chip.input_pins:
+        input_nets.extend(pin_nets(builder, pin))
+    output_nets = _flatten(chip, input_nets, builder)
+    return builder.build(
+        chip.name, input_nets, output_nets,
+        [pin.width for pin in chip.input_pins], [pin.width for pin in chip.output_pins],
+    )
+
+
+def pin_nets(builder: NetlistBuilder, pin) -> list[int]:
+    """
+        Adds a net for every bit of the pin, initialized from its current state
+    """
+    state = pin.State
+    if pin.width == 1:
+        return [builder.new_net(state)]
+    return [builder.new_net((state >> i) & 1) for i in range(pin.width)]
+
+
+def split_nets(nets, pins):
+    """
+        Yields every pin along with its share of `nets`, which holds the nets of all their bits in order
+    """
+    i = 0
+    for pin in pins:
+        yield pin, nets[i:i + pin.width]
+        i += pin.width
+
+
+def _flatten(chip: Chip, input_nets, builder: NetlistBuilder):
+    """
+        Adds the gates of `chip` to the builder, reading from the given input nets.
+        Returns the nets driven by the chip's output pins
+
+        Both lists hold one net per bit, bus pins take up as many entries as they
+        have bits (see `split_nets`)
+    """
+    kind = chip.gate_code
+    if kind is not None:
+        in_a = input_nets[0] if len(input_nets) > 0 else -1
+        in_b = input_nets[1] if len(input_nets) > 1 else -1
+        out = builder.new_net(chip.output_pins[0].State)
+        builder.add_gate(kind, in_a, in_b, out)
+        return [out]
+
+    # builtin chips made of several gates add them on their own
+    flatten_into = getattr(chip, 'flatten_into', None)
+    if flatten_into is not None:
+        return flatten_into(builder, input_nets)
+
+    # custom chips carry their already flattened definition
+    template = getattr(chip, 'template', None)
+    if template is not None:
+        return builder.inline(template.netlist, chip.state, input_nets)
+
+    raise TypeError(f"Cannot compile chip of type '{type(chip).__name__}'")
+
+
+def compile_circuit(name, input_signals: list[InputSignalPin], output_signals: list[OutputSignalPin],
+                    sources: list[Chip] = ()) -> Netlist:
+    """
+        Flattens the circuit between a set of input and output signals (i.e. the
+        definition of a custom chip) into a `Netlist`
+
+        Chips are found by following the wires from the inputs. `sources` are chips
+        to include even if no input leads to them, such as clocks
+    """
+    builder = NetlistBuilder()
+    input_nets = []
+    for signal in input_signals:
+        input_nets.extend(pin_nets(builder, signal))
+    output_nets = _flatten_circuit(input_signals, output_signals, input_nets, builder, sources)
+    return builder.build(
+        name, input_nets, output_nets,
+        [signal.width for signal in input_signals], [signal.width for signal in output_signals],
+    )
+
+
+def _flatten_circuit(input_signals, output_signals, input_nets, builder: NetlistBuilder, sources=()):
+    # nets of the pins inside this particular instance, one per bit. Pins are keyed
+    # by identity and the mapping is local to this call, so every instance of a
+    # custom chip gets its own copy of the internal nets
+    nets = {}  # type: dict[int, list[int]]
+
+    def nets_of(pin):
+        found = nets.get(id(pin))
+        if found is None:
+            found = nets[id(pin)] = pin_nets(builder, pin)
+        return found
+
+    for signal, signal_nets in split_nets(input_nets, input_signals):
+        nets[id(signal)] = signal_nets
+
+    # walk the wires starting from the input signals to find every emitter
+    # (and thus every chip) that is part of the circuit
+    emitters = []  # type: list[SignalEmitter]
+    queue = deque(input_signals)
+    seen = set(id(signal) for signal in input_signals)
+
+    def add_chip(inner):
+        seen.add(id(inner))
+
+        inner_inputs = []
+        for pin in inner.input_pins:
+            inner_inputs.extend(nets_of(pin))
+        inner_outputs = _flatten(inner, inner_inputs, builder)
+        for pin, pin_outputs in split_nets(inner_outputs, inner.output_pins):
+            nets[id(pin)] = pin_outputs
+
+        queue.extend(inner.output_pins)
+
+    for inner in sources:
+        if id(inner) not in seen:
+            add_chip(inner)
+
+    while queue:
+        emitter = queue.popleft()
+        emitters.append(emitter)
+
+        for child in emitter.children:
+            if isinstance(child, ChipPin) and child.pin_type == ChipPin.PinType.INPUT:
+                if id(child.chip) not in seen:
+                    add_chip(child.chip)
+
+            elif isinstance(child, SignalEmitter) and id(child) not in seen:
+                seen.add(id(child))
+                queue.append(child)
+
+    # every wire merges the nets of its source with the nets of its target, bit by bit
+    union = builder.union
+    for emitter in emitters:
+        for child in emitter.children:
+            # probes only watch, they would add a net of their own
+            if isinstance(child, Probe):
+                continue
+            for source, target in zip(nets_of(emitter), nets_of(child)):
+                union(source, target)
+
+    output_nets = []
+    for signal in output_signals:
+        output_nets.extend(nets_of(signal))
+    return output_nets
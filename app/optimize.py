@@ -0,0 +1,332 @@
+from __future__ import annotations
+
+from app.netlist import Netlist, NetlistBuilder, GATE_AND, GATE_OR, GATE_NOT, SEQUENTIAL_GATES
+
+
+# names of the available passes, in the order they are applied
+PASS_CONSTANTS = 'constants'
+PASS_INVERTERS = 'inverters'
+PASS_MERGE = 'merge'
+PASS_DEAD = 'dead'
+
+ALL_PASSES = (PASS_CONSTANTS, PASS_INVERTERS, PASS_MERGE, PASS_DEAD)
+
+
+class OptimizationReport:
+
+    """
+        What `optimize_netlist` did to a netlist
+    """
+
+    def __init__(self, name, gates_before):
+        self.name = name
+        self.gates_before = gates_before
+        self.gates_after = gates_before
+
+        # number of gates removed by each pass
+        self.constants = 0
+        self.inverters = 0
+        self.merged = 0
+        self.dead = 0
+
+    @property
+    def Removed(self):
+        return self.gates_before - self.gates_after
+
+    def __repr__(self):
+        return (
+            f"OptimizationReport < name={self.name}, gates={self.gates_before} -> {self.gates_after}, "
+            f"constants={self.constants}, inverters={self.inverters}, merged={self.merged}, dead={self.dead} >"
+        )
+
+
+def optimize_netlist(netlist: Netlist, passes=ALL_PASSES) -> tuple[Netlist, OptimizationReport]:
+    """
+        Returns an equivalent netlist with fewer gates, along with a report of what was removed
+
+        The passes are:
+
+            constants   gates with a constant (undriven) input are folded, e.g.
+                        AND(x, 0) = 0 and OR(x, 0) = x. So are AND(x, x),
+                        AND(x, NOT x) and their OR counterparts
+            inverters   NOT(NOT(x)) reads x directly
+            merge       gates of the same type reading the same nets are merged
+                        into one (structural hashing)
+            dead        gates that no output depends on are removed
+
+        Gates on a feedback loop and gates with state of their own (latches,
+        clocks) are left as they are, since their value depends on more than their
+        inputs. So is every gate feeding them: a loop can hold on to a glitch (e.g.
+        the one pulse of AND(x, NOT x) while x changes), and folding or merging the
+        gates upstream changes the delta cycles glitches take. Everything else only
+        feeds the outputs, which settle to the same values as before
+    """
+    passes = frozenset(passes)
+    report = OptimizationReport(netlist.name, netlist.GateCount)
+
+    gate_types = netlist.gate_types
+    gate_in_a = netlist.gate_in_a
+    gate_in_b = netlist.gate_in_b
+    gate_out = netlist.gate_out
+
+    drivers = [0] * netlist.NetCount
+    for net in gate_out:
+        drivers[net] += 1
+    for net in netlist.input_nets:
+        drivers[net] += 1
+
+    # value of every net that is known to be constant: nets without a driver keep their
+    # compile time value forever (e.g. unconnected pins), folded gates add to these
+    constant = {net: netlist.initial_state[net] for net in range(netlist.NetCount) if drivers[net] == 0}
+
+    # nets replaced by another net carrying the same value
+    alias = {}  # type: dict[int, int]
+
+    def resolve(net):
+        while net in alias:
+            net = alias[net]
+        return net
+
+    # NOT gate driving every net, to spot double inversions and complements
+    inverted = {}  # type: dict[int, int]
+    merged = {}  # type: dict[tuple, int]
+    removed = bytearray(netlist.GateCount)
+
+    order = _gate_order(netlist)
+    protected = _feeding_state(netlist, [~gate for gate in order if gate < 0])
+
+    for gate in order:
+        if gate < 0 or protected[gate]:
+            continue
+
+        kind = gate_types[gate]
+        a = resolve(gate_in_a[gate])
+        b = gate_in_b[gate]
+        b = resolve(b) if b != -1 else -1
+        out = gate_out[gate]
+
+        # shorted outputs and outputs driving an input are left as they are
+        if drivers[out] != 1:
+            continue
+
+        if PASS_CONSTANTS in passes:
+            folded = _fold(kind, a, b, constant, inverted)
+            if folded is not None:
+                is_constant, value = folded
+                if is_constant:
+                    constant[out] = value
+                else:
+                    alias[out] = value
+                removed[gate] = 1
+                report.constants += 1
+                continue
+
+        if kind == GATE_NOT:
+            if PASS_INVERTERS in passes and a in inverted:
+                alias[out] = inverted[a]
+                removed[gate] = 1
+                report.inverters += 1
+                continue
+            inverted[out] = a
+
+        if PASS_MERGE in passes:
+            key = (kind, min(a, b), max(a, b)) if kind != GATE_NOT else (kind, a)
+            existing = merged.get(key)
+            if existing is not None:
+                alias[out] = existing
+                removed[gate] = 1
+                report.merged += 1
+                continue
+            merged[key] = out
+
+    output_nets = [resolve(net) for net in netlist.output_nets]
+
+    if PASS_DEAD in passes:
+        report.dead = _remove_dead(netlist, output_nets, resolve, removed)
+
+    optimized = _rebuild(netlist, removed, resolve, constant, output_nets)
+    report.gates_after = optimized.GateCount
+    return optimized, report
+
+
+def _fold(kind, a, b, constant, inverted):
+    """
+        Returns (True, value) if the gate always outputs `value`, (False, net) if it
+        always outputs the value of `net`, and None if it can't be simplified
+    """
+    if kind == GATE_NOT:
+        if a in constant:
+            return True, constant[a] ^ 1
+        return None
+
+    # the value that decides the output on its own: 0 for AND, 1 for OR
+    if kind == GATE_AND:
+        absorbing = 0
+    elif kind == GATE_OR:
+        absorbing = 1
+    else:
+        return None
+
+    for x, y in ((a, b), (b, a)):
+        if x in constant:
+            if constant[x] == absorbing:
+                return True, absorbing
+            if y in constant:
+                return True, constant[y]
+            return False, y
+
+    if a == b:
+        return False, a
+
+    # x AND NOT x, x OR NOT x
+    if inverted.get(a) == b or inverted.get(b) == a:
+        return True, absorbing
+
+    return None
+
+
+def _gate_order(netlist: Netlist):
+    """
+        Returns every gate after the gates driving its inputs. Gates on a feedback loop
+        can't be ordered like that, they are returned as ~gate (i.e. negative) instead
+    """
+    # Tarjan's algorithm, iterative. Strongly connected components are found in
+    # reverse topological order, so the result only has to be reversed
+    gate_out = netlist.gate_out
+    fanout_start = netlist.fanout_start
+    fanout_gates = netlist.fanout_gates
+
+    count = netlist.GateCount
+    index = [-1] * count
+    low = [0] * count
+    on_stack = bytearray(count)
+    stack = []
+    result = []
+    counter = 0
+
+    for root in range(count):
+        if index[root] != -1:
+            continue
+
+        work = [(root, fanout_start[gate_out[root]])]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = 1
+
+        while work:
+            gate, i = work[-1]
+            end = fanout_start[gate_out[gate] + 1]
+            if i < end:
+                work[-1] = (gate, i + 1)
+                target = fanout_gates[i]
+                if index[target] == -1:
+                    index[target] = low[target] = counter
+                    counter += 1
+                    stack.append(target)
+                    on_stack[target] = 1
+                    work.append((target, fanout_start[gate_out[target]]))
+                elif on_stack[target]:
+                    low[gate] = min(low[gate], index[target])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[gate])
+
+            if low[gate] == index[gate]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = 0
+                    component.append(member)
+                    if member == gate:
+                        break
+
+                looped = len(component) > 1 or gate in netlist.fanout(gate_out[gate])
+                result.extend(~member if looped else member for member in component)
+
+    result.reverse()
+    return result
+
+
+def _feeding_state(netlist: Netlist, looped) -> bytearray:
+    """
+        Marks the gates with state (the `looped` gates and latches and clocks) and
+        every gate they read, directly or through other gates
+    """
+    # shorted nets have more than one driver
+    drivers = {}  # type: dict[int, list[int]]
+    for gate, net in enumerate(netlist.gate_out):
+        drivers.setdefault(net, []).append(gate)
+
+    marked = bytearray(netlist.GateCount)
+    queue = [gate for gate, kind in enumerate(netlist.gate_types) if kind in SEQUENTIAL_GATES]
+    queue.extend(looped)
+    for gate in queue:
+        marked[gate] = 1
+    while queue:
+        gate = queue.pop()
+        for net in (netlist.gate_in_a[gate], netlist.gate_in_b[gate]):
+            for source in drivers.get(net, ()):
+                if not marked[source]:
+                    marked[source] = 1
+                    queue.append(source)
+    return marked
+
+
+def _remove_dead(netlist: Netlist, output_nets, resolve, removed) -> int:
+    driver = {}
+    for gate in range(netlist.GateCount):
+        if not removed[gate]:
+            driver[netlist.gate_out[gate]] = gate
+
+    live = bytearray(netlist.GateCount)
+    queue = [driver[net] for net in output_nets if net in driver]
+    for gate in queue:
+        live[gate] = 1
+    while queue:
+        gate = queue.pop()
+        for net in (netlist.gate_in_a[gate], netlist.gate_in_b[gate]):
+            if net == -1:
+                continue
+            source = driver.get(resolve(net))
+            if source is not None and not live[source]:
+                live[source] = 1
+                queue.append(source)
+
+    dead = 0
+    for gate in range(netlist.GateCount):
+        if not removed[gate] and not live[gate]:
+            removed[gate] = 1
+            dead += 1
+    return dead
+
+
+def _rebuild(netlist: Netlist, removed, resolve, constant, output_nets) -> Netlist:
+    builder = NetlistBuilder()
+    nets = {}
+
+    def net_of(net):
+        if net == -1:
+            return -1
+        net = resolve(net)
+        new = nets.get(net)
+        if new is None:
+            new = nets[net] = builder.new_net(constant.get(net, netlist.initial_state[net]))
+        return new
+
+    input_nets = [net_of(net) for net in netlist.input_nets]
+    for gate in range(netlist.GateCount):
+        if not removed[gate]:
+            builder.add_gate(
+                netlist.gate_types[gate],
+                net_of(netlist.gate_in_a[gate]),
+                net_of(netlist.gate_in_b[gate]),
+                net_of(netlist.gate_out[gate]),
+            )
+
+    return builder.build(
+        netlist.name, input_nets, [net_of(net) for net in output_nets], netlist.input_widths, netlist.output_widths,
+    )
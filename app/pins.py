@@ -1,11 +1,227 @@
 from __future__ import annotations
 
+import contextlib
+
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from app.chip import Chip
 
 
+class OscillationError(RuntimeError):
+    """
+        Raised when a circuit does not settle within the allowed number of delta cycles
+    """
+
+
+class Scheduler:
+
+    """
+        Evaluates chips iteratively instead of recursively
+
+        When an input pin changes, its chip is not evaluated right away but added
+        to the pending set of the innermost active scope. A scope settles by
+        evaluating its pending chips in delta cycles: every chip scheduled during
+        one cycle is evaluated exactly once in the next one. The stack only grows
+        with the nesting depth of custom chips, never with the length of a signal
+        path, and a circuit that keeps changing is reported as an `OscillationError`
+        instead of overflowing the stack.
+    """
+
+    MAX_DELTA_CYCLES = 1000
+
+    def __init__(self):
+        # pending chips of every active scope, innermost last. Dicts are used
+        # as insertion ordered sets so evaluation order stays deterministic
+        self._frames = []  # type: list[dict[Chip, None]]
+
+        # number of delta cycles the most recently settled scope needed
+        self.last_delta_cycles = 0
+        # delta cycles run since the scheduler was created, the time base of the object model
+        self.delta_count = 0
+
+        # whether a `batch` is open, batches inside it join it
+        self._batching = False
+
+    def schedule(self, chip: Chip):
+        if self._frames:
+            self._frames[-1][chip] = None
+            return
+
+        # nothing is settling right now (e.g. the user toggled an input), so settle immediately
+        pending = {chip: None}
+        self._frames.append(pending)
+        try:
+            self._settle(pending)
+        finally:
+            self._frames.pop()
+
+    @contextlib.contextmanager
+    def scope(self):
+        """
+            Collects the chips scheduled inside the `with` block and settles them on exit
+        """
+        pending = {}
+        self._frames.append(pending)
+        try:
+            yield
+            self._settle(pending)
+        finally:
+            self._frames.pop()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+            Like `scope`, for edits that touch many chips at once (see `batch_edit`)
+
+            The chips are first put in the order signals flow through them, so a
+            circuit without feedback settles in a couple of delta cycles instead of
+            one per chip it is deep. Batches inside a batch join it.
+
+            The circuit also settles when the block raises, so the edits made up to
+            that point are fully applied rather than leaving chips with changed inputs
+            and stale outputs
+        """
+        if self._batching:
+            yield
+            return
+
+        pending = {}
+        self._frames.append(pending)
+        self._batching = True
+        try:
+            yield
+        finally:
+            try:
+                # reordered in place, chips scheduled while settling go to the same dict
+                ordered = self._flow_order(pending)
+                pending.clear()
+                pending.update(dict.fromkeys(ordered))
+                self._settle(pending)
+            finally:
+                self._batching = False
+                self._frames.pop()
+
+    @staticmethod
+    def _flow_order(chips):
+        """
+            Returns the chips ordered so that every chip comes after the chips among them
+            driving it, as far as feedback loops allow (reverse DFS post-order)
+        """
+        order = []
+        visited = set()
+        for root in chips:
+            if root in visited:
+                continue
+
+            visited.add(root)
+            stack = [(root, _driven_chips(root))]
+            while stack:
+                chip, driven = stack[-1]
+                for target in driven:
+                    # only the chips being settled are followed, so the cost stays
+                    # proportional to them rather than to the whole circuit
+                    if target not in visited and target in chips:
+                        visited.add(target)
+                        stack.append((target, _driven_chips(target)))
+                        break
+                else:
+                    stack.pop()
+                    order.append(chip)
+
+        order.reverse()
+        return order
+
+    def _settle(self, pending):
+        deltas = 0
+
+        # a long chain legitimately needs one delta cycle per chip, so a high
+        # cycle count alone does not mean oscillation. Past the limit, chips
+        # evaluated are remembered and the circuit is only reported once it
+        # spent another `MAX_DELTA_CYCLES` cycles without reaching a new chip
+        seen = None
+        stale = 0
+
+        while pending:
+            deltas += 1
+            self.delta_count += 1
+            chips = list(pending)
+            pending.clear()
+
+            if deltas > self.MAX_DELTA_CYCLES:
+                if seen is None:
+                    seen = set()
+
+                size = len(seen)
+                seen.update(chips)
+                stale = stale + 1 if len(seen) == size else 0
+                if stale > self.MAX_DELTA_CYCLES:
+                    names = ", ".join(sorted(set(chip.name for chip in chips)))
+                    raise OscillationError(
+                        f"Circuit did not settle after {deltas} delta cycles (still changing: {names})"
+                    )
+
+            for chip in chips:
+                chip.process_output()
+
+        self.last_delta_cycles = deltas
+
+
+def _driven_chips(chip: Chip):
+    """
+        Yields the chips reading any output of `chip`, following wires through signal pins
+    """
+    emitters = list(chip.output_pins)
+    while emitters:
+        for child in emitters.pop().children:
+            if isinstance(child, ChipPin):
+                if child.pin_type == ChipPin.PinType.INPUT:
+                    yield child.chip
+            elif isinstance(child, SignalEmitter):
+                emitters.append(child)
+
+
+scheduler = Scheduler()
+
+
+def batch_edit():
+    """
+        Groups changes to a circuit (connecting and disconnecting pins, setting signals)
+
+        Signals still follow the wires as they are connected, but no chip is
+        evaluated before the block ends, when the whole circuit settles in one go.
+        Building or loading a circuit with n wires thus costs a single settle
+        instead of one per wire. Batches can be nested, only the outermost one settles
+    """
+    return scheduler.batch()
+
+
+# Pins are the most numerous objects of a circuit, so they are kept small:
+# every pin class declares __slots__ (no per instance __dict__), and emitters
+# share an empty tuple as their list of children until the first connection.
+# On 64-bit CPython this puts a pin at:
+#
+#   OutputSignalPin   48 bytes
+#   InputSignalPin    56 bytes (+ list of children once connected)
+#   ChipPin           72 bytes (+ list of children once connected)
+#
+# which is the budget to keep in mind when adding attributes. A connected
+# emitter additionally pays 56 bytes for its list plus 8 bytes per child.
+# Emitters with a fan-out above `SignalEmitter.DICT_FANOUT` switch to a dict,
+# which costs more but makes disconnecting O(1) however wide the fan-out.
+# Bus pins (see `BusPin`) carry a whole word in their state and store their
+# width in one extra slot, every other pin is one bit wide through the class
+# attribute `Pin.width`.
+# Simulations that need to go beyond that should compile the circuit into a
+# flat `app.netlist.Netlist`, which costs a few bytes per net.
+
+
 class Pin:
+
+    __slots__ = ('_state',)
+
+    # number of bits carried by the pin, overridden per instance by bus pins
+    width = 1
+
     def __init__(self):
         self._state = 0
 
@@ -18,22 +234,68 @@ class Pin:
 
 
 class SignalEmitter(Pin):
+
+    __slots__ = ('children',)
+
+    # incremented on every connection change anywhere, lets caches
+    # derived from the wiring of a circuit detect that it was edited
+    connection_generation = 0
+
+    # fan-out above which children are kept in a dict (used as an insertion
+    # ordered set) rather than a list, so removing one is O(1)
+    DICT_FANOUT = 32
+
     def __init__(self):
         super().__init__()
 
-        self.children = []  # type: list[Pin]
+        # shared empty tuple until the first connection, replaced by a list then
+        self.children = ()  # type: list[Pin] | dict[Pin, None]
 
     def broadcast_signal(self, signal):
         for child in self.children:
             child.recv_signal(signal)
 
-    def connect_to(self, target: Pin):
-        self.children.append(target)
+    def connect_to(self, target: Pin, first=False):
+        """
+            Connects `target` to the emitter and sends it the current signal. With `first`
+            set, the target receives every change before the other children
+        """
+        if target.width != self.width:
+            raise ValueError(f"Cannot connect a {self.width} bit pin to a {target.width} bit pin")
+
+        SignalEmitter.connection_generation += 1
+        children = self.children
+        if children.__class__ is dict:
+            if first:
+                self.children = {target: None}
+                self.children.update(children)
+            else:
+                children[target] = None
+        elif not children:
+            self.children = [target]
+        else:
+            if first:
+                children.insert(0, target)
+            else:
+                children.append(target)
+            if len(children) > self.DICT_FANOUT:
+                self.children = dict.fromkeys(children)
+
         target.recv_signal(self._state)
 
     
     def disconnect_from(self, target: Pin):
-        self.children.remove(target)
+        children = self.children
+        try:
+            if children.__class__ is dict:
+                del children[target]
+            else:
+                # at most DICT_FANOUT children to search
+                children.remove(target)
+        except (KeyError, ValueError, AttributeError):
+            raise ValueError("The pin is not connected to this emitter") from None
+
+        SignalEmitter.connection_generation += 1
         target.recv_signal(0)
 
 
@@ -42,6 +304,8 @@ class ChipPin(SignalEmitter):
         Base class for all pins that are either ON or OFF
     """
 
+    __slots__ = ('chip', 'index', 'pin_type')
+
     class PinType:
         INPUT = 1
         OUTPUT = 2
@@ -64,12 +328,15 @@ class ChipPin(SignalEmitter):
 
         self._state = signal
         if self.pin_type == self.PinType.INPUT:
-            self.chip.process_output()
+            scheduler.schedule(self.chip)
         else:
             self.broadcast_signal(signal)
 
 
 class InputSignalPin(SignalEmitter):
+
+    __slots__ = ('index',)
+
     def __init__(self):
         super().__init__()
         self.index = -1
@@ -80,6 +347,75 @@ class InputSignalPin(SignalEmitter):
 
 
 class OutputSignalPin(Pin):
+
+    __slots__ = ('index',)
+
     def __init__(self):
+        super().__init__()
         self.index = -1
 
+
+# Bus pins: the state is an int holding `width` bits (bit i is line i of the
+# bus), so a change of the whole word is a single event. They behave exactly
+# like their one bit counterparts otherwise, and only connect to pins of the
+# same width
+
+
+class BusPin(ChipPin):
+
+    __slots__ = ('width',)
+
+    def __init__(self, width):
+        super().__init__()
+        self.width = width
+
+
+class InputBusPin(InputSignalPin):
+
+    __slots__ = ('width',)
+
+    def __init__(self, width):
+        super().__init__()
+        self.width = width
+
+
+class OutputBusPin(OutputSignalPin):
+
+    __slots__ = ('width',)
+
+    def __init__(self, width):
+        super().__init__()
+        self.width = width
+
+
+class Probe(Pin):
+
+    """
+        Observes an emitter without being part of the circuit
+
+        A probe is connected like any other pin (`emitter.connect_to(probe)`) and
+        calls `on_change(signal)` whenever the emitter's signal changes. Probes are
+        not saved with a circuit and add no gates when it is compiled, so watching
+        a pin does not change the circuit.
+    """
+
+    __slots__ = ('width', 'on_change')
+
+    def __init__(self, on_change, width=1):
+        super().__init__()
+        self.width = width
+        self.on_change = on_change
+
+    def recv_signal(self, signal):
+        if self._state == signal:
+            return
+        self._state = signal
+        self.on_change(signal)
+
+
+def new_input_signal(width=1) -> InputSignalPin:
+    return InputBusPin(width) if width != 1 else InputSignalPin()
+
+
+def new_output_signal(width=1) -> OutputSignalPin:
+    return OutputBusPin(width) if width != 1 else OutputSignalPin()
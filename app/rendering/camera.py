@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import math
+
+
+class Camera:
+
+    """
+        Maps world coordinates (where chips and wires are placed) to the screen
+
+        The camera looks at the world from `x, y`, the world point shown at the
+        top left of the screen, and magnifies it by `Zoom`. Zooming goes in fixed
+        steps of ZOOM_STEP, so the few scales in use can each be cached (see
+        `ChipRenderer.draw`). World coordinates of chips are integers, so points
+        converted back from the screen are rounded down.
+
+        Rectangles are (left, top, width, height) tuples, anything unpacking to
+        that (such as pygame's Rect) is accepted
+    """
+
+    ZOOM_STEP = 1.25
+    MIN_ZOOM_LEVEL = -10
+    MAX_ZOOM_LEVEL = 6
+
+    # below this zoom chips are drawn as plain rectangles and wires without antialiasing
+    DETAIL_ZOOM = 0.5
+
+    def __init__(self, x=0, y=0, zoom_level=0):
+        self.x = x
+        self.y = y
+
+        self.zoom_level = 0
+        self._zoom = 1
+        self.set_zoom_level(zoom_level)
+
+    @property
+    def Zoom(self):
+        return self._zoom
+
+    @property
+    def Detailed(self):
+        """
+            Whether the zoom is high enough to draw pins, labels and antialiased wires
+        """
+        return self._zoom >= self.DETAIL_ZOOM
+
+    def set_zoom_level(self, level):
+        level = max(self.MIN_ZOOM_LEVEL, min(self.MAX_ZOOM_LEVEL, level))
+        self.zoom_level = level
+        # level 0 is exactly 1, so the unzoomed view needs no scaling at all
+        self._zoom = self.ZOOM_STEP ** level if level != 0 else 1
+
+    def pan(self, dx, dy):
+        """
+            Moves the view by the given number of screen pixels
+        """
+        self.x -= dx / self._zoom
+        self.y -= dy / self._zoom
+
+    def zoom_at(self, steps, screen_x, screen_y):
+        """
+            Zooms in (or out, for negative `steps`) keeping the world point under the
+            given screen point in place. Returns whether the zoom changed
+        """
+        level = self.zoom_level
+        world_x = self.x + screen_x / self._zoom
+        world_y = self.y + screen_y / self._zoom
+
+        self.set_zoom_level(level + steps)
+        if self.zoom_level == level:
+            return False
+
+        self.x = world_x - screen_x / self._zoom
+        self.y = world_y - screen_y / self._zoom
+        return True
+
+    def world_to_screen(self, point):
+        zoom = self._zoom
+        return (round((point[0] - self.x) * zoom), round((point[1] - self.y) * zoom))
+
+    def screen_to_world(self, screen_x, screen_y):
+        zoom = self._zoom
+        return (math.floor(self.x + screen_x / zoom), math.floor(self.y + screen_y / zoom))
+
+    def world_rect_to_screen(self, rect):
+        """
+            Returns the screen rectangle covering a world rectangle, rounded outwards
+        """
+        left, top, width, height = rect
+        zoom = self._zoom
+        x_0 = math.floor((left - self.x) * zoom)
+        y_0 = math.floor((top - self.y) * zoom)
+        x_1 = math.ceil((left + width - self.x) * zoom)
+        y_1 = math.ceil((top + height - self.y) * zoom)
+        # one extra pixel for what rounding the end points of lines can add
+        return (x_0 - 1, y_0 - 1, x_1 - x_0 + 2, y_1 - y_0 + 2)
+
+    def screen_rect_to_world(self, rect):
+        """
+            Returns the world rectangle shown in a screen rectangle, rounded outwards
+        """
+        left, top, width, height = rect
+        zoom = self._zoom
+        x_0 = math.floor(self.x + left / zoom)
+        y_0 = math.floor(self.y + top / zoom)
+        x_1 = math.ceil(self.x + (left + width) / zoom)
+        y_1 = math.ceil(self.y + (top + height) / zoom)
+        return (x_0, y_0, x_1 - x_0, y_1 - y_0)
@@ -1,12 +1,18 @@
 from __future__ import annotations
 
+import os
+
 import pygame as pg
-from pygame import gfxdraw
 
-from app.builtinchips import AndGate, NotGate
+from app.pins import batch_edit
+from app.simthread import SimulationThread
+from app.definition import CircuitDefinition, chip_type
+from app.circuitfile import save_library, load_library, create_chips, connect_wires
 
 from .holders import PinLocation as PinLoc, WireConnection
 from .chiprenderer import ChipRenderer
+from .spatial import UniformGrid
+from .camera import Camera
 # from .utils import draw_line
 
 
@@ -17,6 +23,10 @@ class ChipEditor:
     WIRE_COLOR_OFF = (30, 35, 37)
     # WIRE_COLOR_ON = (236, 34, 56)
     WIRE_COLOR_ON = (246, 34, 56)
+    # line width of wires carrying a bus, single bit wires are drawn antialiased instead
+    BUS_WIRE_WIDTH = 3
+    # wires are long compared to chips, so their index uses larger cells
+    WIRE_CELL_SIZE = 256
 
     STATE_IDLE = 0
     STATE_CHIP_MOVING = 1
@@ -30,7 +40,7 @@ class ChipEditor:
     )
 
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, simulation: SimulationThread = None, path=None):
         self.surface = pg.surface.Surface((width, height))
 
         self.chip_renderers = []  # type: list[ChipRenderer]
@@ -38,17 +48,25 @@ class ChipEditor:
         self.output_signals = []  # type: list[OutputSignalPin]
 
         self.wire_connections = [] # type: list[WireConnection]
+
+        # bounds of every chip (keyed by its index), for hit testing
+        self.chip_index = UniformGrid()
+        # bounds of every wire (keyed by its index), to skip the ones outside of what is drawn
+        self.wire_index = UniformGrid(self.WIRE_CELL_SIZE)
+        # index of the chip whose pin is hovered, -1 if none
+        self.hovered_chip_index = -1
+
+        # everything is placed in world coordinates, the camera decides which part is shown
+        self.camera = Camera()
         
         # self.temp()
 
-        self.chip_renderers.append(ChipRenderer(AndGate(), (350, 420)))
-        self.chip_renderers.append(ChipRenderer(NotGate(), (150, 150)))
-        self.chip_renderers.append(ChipRenderer(NotGate(), (290, 90)))
-
         self.state = self.STATE_IDLE
 
+        # mouse position in world coordinates, and where it is on the surface
         self.mouse_x = 0
         self.mouse_y = 0
+        self.mouse_screen = (0, 0)
 
         self.selected_chip_index = -1
         self.mouse_start_offset = (0, 0)
@@ -57,6 +75,27 @@ class ChipEditor:
         self.src_pin_loc = PinLoc()
         self.dest_pin_loc = PinLoc()
 
+        # regions of the world that have to be redrawn in the next frame
+        self.dirty_rects = []  # type: list[pg.Rect]
+        self.full_redraw = True
+
+        # indices of the wires attached to every chip, keyed by chip index
+        self.chip_wires = {}  # type: dict[int, list[int]]
+        # area covered by the wire being placed when it was last drawn
+        self.temp_wire_rect = None  # type: pg.Rect
+
+        # when given, all changes to the circuit are made on the simulation's
+        # worker thread and wire states are read from its snapshots
+        self.simulation = simulation
+        # version of the simulation snapshot the wires were last checked against
+        self.snapshot_version = -1
+
+        if path is None:
+            self.load_definition(self.demo_circuit())
+        elif os.path.exists(path):
+            self.load(path)
+        # otherwise the file is new, it is created on the first save of the (empty) circuit
+
 
     # def temp(self):
         # src = PinLoc(0, PinLoc.PL_CHIP_OUT, 0)
@@ -68,10 +107,117 @@ class ChipEditor:
     def RenderResult(self):
         return self.surface
 
-    # def clear(self):
-    #     self.chip_renderers = []
-    #     self.input_signals = []
-    #     self.output_signals = []
+    @property
+    def SimulationRunning(self):
+        """
+            Whether signals can change without any user input, in which case the
+            application has to keep redrawing while idle
+        """
+        simulation = self.simulation
+        if simulation is None:
+            return False
+        return simulation.Busy or simulation.version != self.snapshot_version
+
+    def add_chip(self, renderer: ChipRenderer):
+        self.chip_renderers.append(renderer)
+        self.chip_index.insert(len(self.chip_renderers) - 1, renderer.get_bounds())
+
+    def chips_at(self, x, y):
+        """
+            Returns the indices of the chips whose bounds contain the point, in drawing order
+        """
+        return sorted(self.chip_index.query_point(x, y))
+
+    def mark_dirty(self, rect):
+        """
+            Schedules the given region of the world to be redrawn in the next frame
+        """
+        self.dirty_rects.append(rect)
+
+    def mark_chip_dirty(self, chip_index):
+        self.mark_dirty(self.chip_renderers[chip_index].get_bounds())
+
+    def mark_all_dirty(self):
+        self.full_redraw = True
+
+    def clear(self):
+        """
+            Removes every chip and wire from the editor
+        """
+        self.chip_renderers = []
+        self.input_signals = []
+        self.output_signals = []
+        self.wire_connections = []
+
+        self.chip_index.clear()
+        self.wire_index.clear()
+        self.chip_wires = {}
+        self.hovered_chip_index = -1
+        self.selected_chip_index = -1
+        self.src_pin_loc.clear()
+        self.dest_pin_loc.clear()
+        self.state = self.STATE_IDLE
+
+        self.mark_all_dirty()
+
+    def define(self, name="main") -> CircuitDefinition:
+        """
+            Describes the circuit in the editor, including where every chip is placed
+        """
+        definition = CircuitDefinition(name, len(self.input_signals), len(self.output_signals))
+        for renderer in self.chip_renderers:
+            definition.add_chip(chip_type(renderer.chip), renderer.position)
+
+        # editor pin locations use the same type codes as definition wire ends
+        for conn in self.wire_connections:
+            definition.add_wire(
+                conn.source.pin_type, conn.source.chip_index, conn.source.pin_index,
+                conn.dest.pin_type, conn.dest.chip_index, conn.dest.pin_index,
+            )
+
+        return definition
+
+    def save(self, path):
+        save_library(path, self.define())
+
+    def load(self, path):
+        with load_library(path) as library:
+            self.load_definition(library.Top)
+
+    def load_definition(self, definition: CircuitDefinition):
+        """
+            Replaces the circuit in the editor with the given one
+        """
+        self.clear()
+
+        chips, self.input_signals, self.output_signals = create_chips(definition)
+        for i, chip in enumerate(chips):
+            position = (definition.positions[2 * i], definition.positions[2 * i + 1])
+            self.add_chip(ChipRenderer(chip, position))
+
+        # the objects are new, so they can be built here, but wiring them up
+        # propagates signals, which is the simulation's job once it runs
+        with self.batch():
+            if self.simulation is not None:
+                self.simulation.submit(connect_wires, definition, chips, self.input_signals, self.output_signals)
+            else:
+                connect_wires(definition, chips, self.input_signals, self.output_signals)
+
+            wires = definition.wires
+            for i in range(0, len(wires), 6):
+                source_loc = PinLoc(wires[i + 1], wires[i], wires[i + 2])
+                target_loc = PinLoc(wires[i + 4], wires[i + 3], wires[i + 5])
+                # `connect_wires` skips wires between pins of different widths
+                if self.pin_from_loc(source_loc).width == self.pin_from_loc(target_loc).width:
+                    self.add_wire(source_loc, target_loc, connect=False)
+
+    def batch(self):
+        """
+            Groups the edits made inside a `with` block, the circuit settles once after all of them
+        """
+        if self.simulation is not None:
+            return self.simulation.transaction()
+        return batch_edit()
   
     def on_mouse_down(self):
 
@@ -98,9 +244,31 @@ class ChipEditor:
             self.state = self.STATE_IDLE
 
     def on_mouse_move(self, mouse_x, mouse_y):
-        self.mouse_x = mouse_x
-        self.mouse_y = mouse_y
+        self.mouse_screen = (mouse_x, mouse_y)
+        self.mouse_x, self.mouse_y = self.camera.screen_to_world(mouse_x, mouse_y)
+
+    def pan(self, dx, dy):
+        """
+            Moves the view by the given number of pixels
+        """
+        self.camera.pan(dx, dy)
+        self._view_changed()
+
+    def zoom(self, steps, screen_x, screen_y):
+        """
+            Zooms in (or out, for negative `steps`) around the given point of the surface
+        """
+        if self.camera.zoom_at(steps, screen_x, screen_y):
+            self._view_changed()
 
+    def _view_changed(self):
+        # the mouse did not move on the screen, but it points at a different place of the world
+        self.on_mouse_move(*self.mouse_screen)
+        if self.state == self.STATE_CHIP_MOVING:
+            # the dragged chip stays under the mouse
+            self.mouse_start_offset = self.chip_renderers[self.selected_chip_index].position
+            self.mouse_start_position = (self.mouse_x, self.mouse_y)
+        self.mark_all_dirty()
 
 
     def place_wire(self):
@@ -123,21 +291,48 @@ class ChipEditor:
                     source_loc, target_loc = target_loc, source_loc
 
                 same_chip = source_loc.chip_index == target_loc.chip_index and source_loc.chip_index != -1
-                if not same_chip:
-
-                    source_pin = self.pin_from_loc(source_loc)
-                    target_pin = self.pin_from_loc(target_loc)
-
-                    # notify actual pins about connection
-                    source_pin.connect_to(target_pin)
-
-                    self.wire_connections.append(
-                        WireConnection(source_loc.clone(), target_loc.clone())
-                    )
+                # buses only connect to pins of their own width
+                same_width = self.pin_from_loc(source_loc).width == self.pin_from_loc(target_loc).width
+                if not same_chip and same_width:
+                    self.add_wire(source_loc.clone(), target_loc.clone())
 
         self.src_pin_loc.clear()
         self.dest_pin_loc.clear()
 
+    def add_wire(self, source_loc: PinLoc, target_loc: PinLoc, connect=True):
+        """
+            Adds a wire between two pins. With `connect` unset the pins are expected
+            to be connected already (e.g. when loading a circuit)
+        """
+        source_pin = self.pin_from_loc(source_loc)
+        target_pin = self.pin_from_loc(target_loc)
+
+        conn = WireConnection(source_loc, target_loc)
+        conn.source_pin = source_pin
+
+        # notify actual pins about connection
+        with self.batch():
+            if self.simulation is not None:
+                # the state shows up in the snapshots once the worker made the connection
+                conn.watch_index = self.simulation.watch(source_pin)
+                if connect:
+                    self.simulation.connect(source_pin, target_pin)
+            elif connect:
+                source_pin.connect_to(target_pin)
+        if self.simulation is None:
+            conn.state = source_pin.State
+        self.update_wire_geometry(conn)
+
+        wire_index = len(self.wire_connections)
+        self.wire_connections.append(conn)
+        self.wire_index.insert(wire_index, conn.rect)
+        for loc in (source_loc, target_loc):
+            if loc.chip_index != -1:
+                self.chip_wires.setdefault(loc.chip_index, []).append(wire_index)
+
+        self.mark_dirty(conn.rect)
+        return conn
+
 
     def pin_from_loc(self, loc: PinLoc):
         """
@@ -158,53 +353,210 @@ class ChipEditor:
         """
         'Activates' the pin that is currenly under the mouse
         """
+        previous = self.selected_chip_index
+
         self.selected_chip_index = -1
-        for i, renderer in enumerate(self.chip_renderers):
-            if renderer.check_collision(self.mouse_x, self.mouse_y):
+        for i in self.chips_at(self.mouse_x, self.mouse_y):
+            if self.chip_renderers[i].check_collision(self.mouse_x, self.mouse_y):
                 self.selected_chip_index = i
                 break
 
-    def draw_wires(self):
+        # the selection decides the border and the drawing order
+        if previous != self.selected_chip_index:
+            if previous != -1:
+                self.mark_chip_dirty(previous)
+            if self.selected_chip_index != -1:
+                self.mark_chip_dirty(self.selected_chip_index)
+
+    def update_wire_geometry(self, conn: WireConnection):
+        """
+            Recalculates the cached end points and bounds of a wire
+        """
+        conn.start = self.chip_renderers[conn.source.chip_index].get_pin_pos(conn.source.pin_type, conn.source.pin_index)
+        conn.end = self.chip_renderers[conn.dest.chip_index].get_pin_pos(conn.dest.pin_type, conn.dest.pin_index)
+        conn.rect = self._line_rect(conn.start, conn.end, self.BUS_WIRE_WIDTH if conn.source_pin.width != 1 else 1)
+
+    @staticmethod
+    def _line_rect(start, end, width):
+        left = min(start[0], end[0]) - width
+        top = min(start[1], end[1]) - width
+        return pg.Rect(left, top, abs(start[0] - end[0]) + 2 * width + 1, abs(start[1] - end[1]) + 2 * width + 1)
+
+    def mark_chip_wires_dirty(self, chip_index):
+        """
+            Marks the regions of all the wires attached to a chip
+        """
+        for wire_index in self.chip_wires.get(chip_index, ()):
+            self.mark_dirty(self.wire_connections[wire_index].rect)
+
+    def update_chip_wires(self, chip_index):
+        """
+            Recalculates the geometry of the wires attached to a chip, after it moved
+        """
+        for wire_index in self.chip_wires.get(chip_index, ()):
+            conn = self.wire_connections[wire_index]
+            self.update_wire_geometry(conn)
+            self.wire_index.update(wire_index, conn.rect)
+
+    def check_wire_states(self):
+        """
+            Marks the wires whose signal changed since they were last drawn
+        """
+        if self.simulation is not None:
+            self.check_snapshot()
+            return
+
         for conn in self.wire_connections:
-            start = self.chip_renderers[conn.source.chip_index].get_pin_pos(conn.source.pin_type, conn.source.pin_index)
-            end = self.chip_renderers[conn.dest.chip_index].get_pin_pos(conn.dest.pin_type, conn.dest.pin_index)
-            pin = self.pin_from_loc(conn.source)
-            # pin = self.pin_from_loc(conn.dest)
+            state = conn.source_pin.State
+            if state != conn.state:
+                conn.state = state
+                self.mark_dirty(conn.rect)
 
-            # print(conn.source, conn.dest)
+    def check_snapshot(self):
+        """
+            Like `check_wire_states`, but reads the states from the latest simulation snapshot
+        """
+        # the snapshot is published before its version, so it is at least this recent
+        version = self.simulation.version
+        if version == self.snapshot_version:
+            return
 
-            # pg.draw.line(self.surface, self.WIRE_COLOR_OFF if pin.State == 0 else self.WIRE_COLOR_ON, start, end, width=3)
-            pg.draw.aaline(self.surface, self.WIRE_COLOR_OFF if pin.State == 0 else self.WIRE_COLOR_ON, start, end)
-            # gfxdraw.line(self.surface, start[0], start[1], end[0], end[1], self.WIRE_COLOR_OFF)
-            # pg.draw.aaline(self.surface, self.WIRE_COLOR_OFF, start, end)
+        snapshot = self.simulation.Snapshot
+        self.snapshot_version = version
 
+        for conn in self.wire_connections:
+            if conn.watch_index >= len(snapshot):
+                # not connected by the worker yet
+                continue
 
-    def draw(self):
-        self.surface.fill(self.EDITOR_BACKGROUND)
+            state = snapshot[conn.watch_index]
+            if state != conn.state:
+                conn.state = state
+                self.mark_dirty(conn.rect)
 
-        self.draw_wires()
+    def draw_wires(self, world_region):
+        """
+            Draws the wires overlapping a region of the world
+        """
+        camera = self.camera
+        wire_connections = self.wire_connections
+
+        # wires are grouped by color and then drawn one color at a time
+        wires_off = []
+        wires_on = []
+        for wire_index in sorted(self.wire_index.query_rect(world_region)):
+            conn = wire_connections[wire_index]
+            (wires_off if conn.state == 0 else wires_on).append(conn)
+
+        surface = self.surface
+        # antialiasing is dropped when zoomed out too far for it to be noticed
+        thin_line = pg.draw.aaline if camera.Detailed else pg.draw.line
+        line = pg.draw.line
+        to_screen = camera.world_to_screen
+        bus_width = max(round(self.BUS_WIRE_WIDTH * camera.Zoom), 1)
+
+        for wires, color in ((wires_off, self.WIRE_COLOR_OFF), (wires_on, self.WIRE_COLOR_ON)):
+            for conn in wires:
+                # a bus counts as on while any of its bits is set
+                if conn.source_pin.width != 1:
+                    line(surface, color, to_screen(conn.start), to_screen(conn.end), bus_width)
+                else:
+                    thin_line(surface, color, to_screen(conn.start), to_screen(conn.end))
+
+
+    def draw_region(self, region=None):
+        """
+            Redraws everything inside `region` of the surface (the whole surface if None).
+            Only the chips and wires overlapping it are looked at
+        """
+        camera = self.camera
+        if region is None:
+            region = self.surface.get_rect()
+        world_region = camera.screen_rect_to_world(region)
 
-        if self.state == self.STATE_PLACING_WIRE:
+        self.surface.set_clip(region)
+        self.surface.fill(self.EDITOR_BACKGROUND, region)
+
+        self.draw_wires(world_region)
+
+        if self.state == self.STATE_PLACING_WIRE and self.temp_wire_rect is not None:
             loc = self.src_pin_loc
             start = self.chip_renderers[loc.chip_index].get_pin_pos(loc.pin_type, loc.pin_index)
-            pg.draw.line(self.surface, (0, 0, 0), start, (self.mouse_x, self.mouse_y), width=3)
+            width = max(round(3 * camera.Zoom), 1)
+            pg.draw.line(self.surface, (0, 0, 0), camera.world_to_screen(start), camera.world_to_screen((self.mouse_x, self.mouse_y)), width=width)
 
-
-        for i, renderer in enumerate(self.chip_renderers):
+        visible = sorted(self.chip_index.query_rect(world_region))
+        for i in visible:
             if i == self.selected_chip_index:
                 # skip the selected chip to later draw it on top
                 continue
-
-            renderer.draw(self.surface)
+            self.chip_renderers[i].draw(self.surface, camera)
 
         # draw the selected chip on top
-        if self.selected_chip_index != -1:
-            renderer = self.chip_renderers[self.selected_chip_index]
-            renderer.draw_chip_border(self.surface)
-            renderer.draw(self.surface)
+        if self.selected_chip_index in visible:
+            self.chip_renderers[self.selected_chip_index].draw(self.surface, camera, selected=True)
+
+        self.surface.set_clip(None)
+
+
+    def draw(self):
+        """
+            Redraws the regions that changed since the last frame and returns them
+        """
+        self.check_wire_states()
+
+        # the wire being placed follows the mouse
+        temp_wire_rect = None
+        if self.state == self.STATE_PLACING_WIRE:
+            loc = self.src_pin_loc
+            start = self.chip_renderers[loc.chip_index].get_pin_pos(loc.pin_type, loc.pin_index)
+            temp_wire_rect = self._line_rect(start, (self.mouse_x, self.mouse_y), 2)
+
+        if temp_wire_rect != self.temp_wire_rect:
+            if self.temp_wire_rect is not None:
+                self.mark_dirty(self.temp_wire_rect)
+            if temp_wire_rect is not None:
+                self.mark_dirty(temp_wire_rect)
+            self.temp_wire_rect = temp_wire_rect
+
+        if self.full_redraw:
+            self.full_redraw = False
+            self.dirty_rects = []
+            self.draw_region()
+            return [self.surface.get_rect()]
+
+        if not self.dirty_rects:
+            return []
+
+        # overlapping regions are merged so nothing is drawn twice
+        surface_rect = self.surface.get_rect()
+        world_rect_to_screen = self.camera.world_rect_to_screen
+        regions = []
+        for rect in self.dirty_rects:
+            # regions outside of the view are dropped here
+            rect = pg.Rect(world_rect_to_screen(rect)).clip(surface_rect)
+            if rect.width == 0 or rect.height == 0:
+                continue
+
+            i = rect.collidelist(regions)
+            while i != -1:
+                rect.union_ip(regions.pop(i))
+                i = rect.collidelist(regions)
+            regions.append(rect)
+
+        self.dirty_rects = []
+
+        for region in regions:
+            self.draw_region(region)
+
+        return regions
 
 
     def update(self):
+        """
+            Handles the mouse state and redraws what changed. Returns the regions
+            of the surface that were redrawn
+        """
 
         if self.state == self.STATE_CHIP_MOVING:
             selected_renderer = self.chip_renderers[self.selected_chip_index]
@@ -212,7 +564,17 @@ class ChipEditor:
             relative_offset = (self.mouse_x - self.mouse_start_position[0], self.mouse_y - self.mouse_start_position[1])
 
             target_offset = (self.mouse_start_offset[0] + relative_offset[0], self.mouse_start_offset[1] + relative_offset[1])
-            selected_renderer.move_to(target_offset[0], target_offset[1])
+            if target_offset != selected_renderer.position:
+                # the chip and its wires are redrawn at both the old and new positions
+                self.mark_chip_dirty(self.selected_chip_index)
+                self.mark_chip_wires_dirty(self.selected_chip_index)
+
+                selected_renderer.move_to(target_offset[0], target_offset[1])
+                self.chip_index.update(self.selected_chip_index, selected_renderer.get_bounds())
+                self.update_chip_wires(self.selected_chip_index)
+
+                self.mark_chip_dirty(self.selected_chip_index)
+                self.mark_chip_wires_dirty(self.selected_chip_index)
             # self.src_pin_loc.clear()
             # self.dest_pin_loc.clear()
 
@@ -226,8 +588,21 @@ class ChipEditor:
 
             target_loc.clear()
 
-            for i, renderer in enumerate(self.chip_renderers):
+            # only chips under the mouse can have a hovered pin, plus the previously
+            # hovered one which has to be cleared if the mouse left it
+            candidates = self.chips_at(self.mouse_x, self.mouse_y)
+            if self.hovered_chip_index != -1 and self.hovered_chip_index not in candidates:
+                candidates.insert(0, self.hovered_chip_index)
+
+            self.hovered_chip_index = -1
+
+            for i in candidates:
+                renderer = self.chip_renderers[i]
+                previous = (renderer.hovered_pin_type, renderer.hovered_pin_index)
                 hovered_pin = renderer.update_hovered_pin(self.mouse_x, self.mouse_y)
+                if previous != (renderer.hovered_pin_type, renderer.hovered_pin_index):
+                    self.mark_chip_dirty(i)
+
                 if hovered_pin is None:
                     continue
 
@@ -236,11 +611,23 @@ class ChipEditor:
                 target_loc.chip_index = i
                 target_loc.pin_type = pin_type
                 target_loc.pin_index = pin_index
+                self.hovered_chip_index = i
 
 
-        self.draw()
+        return self.draw()
 
 
+    @staticmethod
+    def demo_circuit() -> CircuitDefinition:
+        """
+            The circuit shown when the editor starts without a file
+        """
+        definition = CircuitDefinition("demo", 0, 0)
+        definition.add_chip("AND", (350, 420))
+        definition.add_chip("NOT", (150, 150))
+        definition.add_chip("NOT", (290, 90))
+        return definition
+
     # def package(self, name=None):
     #     ChipFactory = custom_chip_factory(self.input_signals, self.output_signals)
     #     self.clear()
@@ -3,17 +3,19 @@ from __future__ import annotations
 import pygame as pg
 from pygame import freetype
 
-from app.chip import Chip, ChipPin
+from app.chip import Chip
 
 from .utils import draw_circle, render_text
 from .holders import PinLocation
+from .camera import Camera
 
 freetype.init()
 
 
 class ChipRenderer:
 
-    chip_text_font = freetype.SysFont("Noto Sans Medium", 1)
+    # looked up on first use, scanning the system fonts is slow
+    chip_text_font = None  # type: freetype.Font
 
     PIN_RADIUS = 7
     PIN_MARGIN = 2
@@ -32,6 +34,15 @@ class ChipRenderer:
     FONT_COLOR = (226, 235, 240)
     FONT_SIZE = 14
 
+    # pre-rendered chips, shared by all renderers. Keyed by the chip's name and pin
+    # counts (which decide its size and look) and the visual state, see `get_sprite`
+    _sprite_cache = {}  # type: dict[tuple, pg.Surface]
+    # rendered chip names, keyed by name
+    _name_cache = {}  # type: dict[str, pg.Surface]
+    # the same sprites scaled to the zoom in `_scaled_zoom`, keyed by the unscaled sprite
+    _scaled_cache = {}  # type: dict[pg.Surface, pg.Surface]
+    _scaled_zoom = 1
+
     def __init__(self, chip: Chip, position: tuple = (0, 0)):
         # the chip this renderer is responsible for
         self.chip = chip
@@ -54,10 +65,15 @@ class ChipRenderer:
             y = self.TOTAL_DIAMETER * i + self.TOTAL_RADIUS
             self.output_pins_y.append(y)
 
-        # rendered chip name (calculated one time only as name does not change )
-        self.chip_name_surface = render_text(self.chip_text_font, chip.name, self.FONT_SIZE, self.FONT_COLOR)
+        # rendered chip name (calculated one time only per name as name does not change )
+        self.chip_name_surface = self._name_cache.get(chip.name)
+        if self.chip_name_surface is None:
+            self.chip_name_surface = render_text(self.get_font(), chip.name, self.FONT_SIZE, self.FONT_COLOR)
+            self._name_cache[chip.name] = self.chip_name_surface
 
-        self.height = max(self.input_pins_y[-1], self.output_pins_y[-1]) + self.TOTAL_RADIUS + 1 # for some reason this 1 balances height
+        # chips without inputs (e.g. clocks) are sized by their outputs alone
+        last_pin_y = max(self.input_pins_y[-1:] + self.output_pins_y[-1:])
+        self.height = last_pin_y + self.TOTAL_RADIUS + 1 # for some reason this 1 balances height
         self.width = 2 * self.PIN_RADIUS + 8 + self.chip_name_surface.get_width()
 
         # coordinates (relative to top left of chip) where chip's name will be rendered
@@ -65,8 +81,8 @@ class ChipRenderer:
         self.txt_y = (self.height - self.chip_name_surface.get_height()) // 2
 
         # just centering things, nothing too fancy
-        input_padding = (self.height - self.input_pins_y[-1] - self.TOTAL_RADIUS) // 2
-        output_padding = (self.height - self.output_pins_y[-1] - self.TOTAL_RADIUS) // 2
+        input_padding = (self.height - (self.input_pins_y or [0])[-1] - self.TOTAL_RADIUS) // 2
+        output_padding = (self.height - (self.output_pins_y or [0])[-1] - self.TOTAL_RADIUS) // 2
 
         for i in range(chip.InputPinCount):
             self.input_pins_y[i] += input_padding
@@ -77,27 +93,102 @@ class ChipRenderer:
         self.bound_width = self.width + self.PIN_DIAMETER
         self.bound_height = self.height + self.PIN_DIAMETER
 
-    def draw(self, surface):
+    @classmethod
+    def get_font(cls):
+        if cls.chip_text_font is None:
+            cls.chip_text_font = freetype.SysFont("Noto Sans Medium", 1)
+        return cls.chip_text_font
+
+    def draw(self, surface, camera: Camera, selected=False):
+        """
+            Draws the chip as seen by `camera`, with a border around it if `selected`
+        """
+        # the sprite's top left corner is at the top left of the chip's bounds
+        offset = self.PIN_RADIUS + 1
+        screen_pos = camera.world_to_screen((self.position[0] - offset, self.position[1] - offset))
+
+        if not camera.Detailed:
+            self.draw_outline(surface, camera, selected)
+        elif camera.Zoom == 1:
+            surface.blit(self.get_sprite(selected), screen_pos)
+        else:
+            surface.blit(self.get_scaled_sprite(camera.Zoom, selected), screen_pos)
+
+    def draw_outline(self, surface, camera: Camera, selected=False):
+        """
+            Draws the chip as a plain rectangle, for when it is too small for pins and labels to be seen
+        """
+        left, top = camera.world_to_screen(self.position)
+        right, bottom = camera.world_to_screen((self.position[0] + self.width, self.position[1] + self.height))
+        rect = pg.Rect(left, top, max(right - left, 1), max(bottom - top, 1))
+
+        if selected:
+            pg.draw.rect(surface, self.CHIP_HOVER_BORDER_COLOR, rect.inflate(2, 2))
+        pg.draw.rect(surface, self.CHIP_BACKGROUND, rect)
+
+    def get_sprite(self, selected=False):
+        """
+            Returns the pre-rendered image of the chip in its current visual state
+        """
+        key = (
+            self.chip.name, self.chip.InputPinCount, self.chip.OutputPinCount,
+            self.hovered_pin_type, self.hovered_pin_index, selected
+        )
+        sprite = self._sprite_cache.get(key)
+        if sprite is None:
+            sprite = self._sprite_cache[key] = self._render_sprite(selected)
+        return sprite
+
+    def get_scaled_sprite(self, zoom, selected=False):
+        """
+            Like `get_sprite`, scaled by `zoom`
+        """
+        cache = ChipRenderer._scaled_cache
+        # only the sprites of the current zoom are kept
+        if zoom != ChipRenderer._scaled_zoom:
+            cache.clear()
+            ChipRenderer._scaled_zoom = zoom
+
+        sprite = self.get_sprite(selected)
+        scaled = cache.get(sprite)
+        if scaled is None:
+            width, height = sprite.get_size()
+            size = (max(round(width * zoom), 1), max(round(height * zoom), 1))
+            scaled = cache[sprite] = pg.transform.smoothscale(sprite, size)
+        return scaled
+
+    def _render_sprite(self, selected):
+        bounds = self.get_bounds()
+        sprite = pg.Surface(bounds.size, pg.SRCALPHA)
+
+        # coordinates of the chip's top left corner inside the sprite
+        x = y = self.PIN_RADIUS + 1
+
+        if selected:
+            pg.draw.rect(sprite, self.CHIP_HOVER_BORDER_COLOR, pg.Rect(1, 1, self.bound_width, self.bound_height))
+
         # draw the actual chip
-        pg.draw.rect(surface, self.CHIP_BACKGROUND, pg.Rect(self.position[0], self.position[1], self.width, self.height))
+        pg.draw.rect(sprite, self.CHIP_BACKGROUND, pg.Rect(x, y, self.width, self.height))
 
         # draw input and output pins
-        for i, y in enumerate(self.input_pins_y):
+        for i, pin_y in enumerate(self.input_pins_y):
             if self.hovered_pin_type == PinLocation.PL_CHIP_IN and self.hovered_pin_index == i:
                 color = self.PIN_HOVER_COLOR
             else:
                 color = self.PIN_COLOR
-            draw_circle(surface, self.position[0], self.position[1] + y, self.PIN_RADIUS, color)
+            draw_circle(sprite, x, y + pin_y, self.PIN_RADIUS, color)
 
-        for i, y in enumerate(self.output_pins_y):
+        for i, pin_y in enumerate(self.output_pins_y):
             if self.hovered_pin_type == PinLocation.PL_CHIP_OUT and self.hovered_pin_index == i:
                 color = self.PIN_HOVER_COLOR
             else:
                 color = self.PIN_COLOR
-            draw_circle(surface, self.position[0] + self.width, self.position[1] + y, self.PIN_RADIUS, color)
+            draw_circle(sprite, x + self.width, y + pin_y, self.PIN_RADIUS, color)
 
         # render chip name
-        surface.blit(self.chip_name_surface, (self.position[0] + self.txt_x, self.position[1] + self.txt_y))
+        sprite.blit(self.chip_name_surface, (x + self.txt_x, y + self.txt_y))
+
+        return sprite
 
 
     def get_pin_pos(self, pin_type, index):
@@ -172,5 +263,17 @@ class ChipRenderer:
 
         return x >= left and x <= right and y >= top and y <= bottom
 
+    def get_bounds(self):
+        """
+            Returns the rectangle covering everything drawn for the chip, including its pins and border
+        """
+        # one extra pixel on each side for the antialiased edges of pins
+        return pg.Rect(
+            self.position[0] - self.PIN_RADIUS - 1,
+            self.position[1] - self.PIN_RADIUS - 1,
+            self.bound_width + 2,
+            self.bound_height + 2,
+        )
+
     def move_to(self, x, y):
         self.position = (x, y)
@@ -8,6 +8,8 @@ class PinLocation:
     PL_SIG_IN = 3
     PL_SIG_OUT = 4
 
+    __slots__ = ('chip_index', 'pin_type', 'pin_index')
+
     chip_index: int
     pin_type: int
     pin_index: int
@@ -42,6 +44,19 @@ class PinLocation:
    
 
 class WireConnection:
+
+    __slots__ = ('source', 'dest', 'source_pin', 'watch_index', 'state', 'start', 'end', 'rect')
+
     def __init__(self, source: PinLocation, dest: PinLocation):
         self.source = source
         self.dest = dest
+
+        # cached by the editor: the pin driving the wire (and its index in
+        # simulation snapshots), the signal the wire was last drawn with,
+        # and the wire's screen geometry
+        self.source_pin = None
+        self.watch_index = -1
+        self.state = 0
+        self.start = (0, 0)
+        self.end = (0, 0)
+        self.rect = None
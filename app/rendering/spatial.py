@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+
+class UniformGrid:
+
+    """
+        Spatial index over axis aligned rectangles
+
+        The plane is divided into square cells and every cell remembers the keys
+        of the rectangles overlapping it. Looking up what is under a point only
+        has to check the rectangles in one cell, and moving a rectangle only
+        touches the cells it leaves and enters.
+
+        Rectangles are anything unpacking to (left, top, width, height), such as
+        pygame's Rect
+    """
+
+    DEFAULT_CELL_SIZE = 64
+
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+
+        self._cells = {}  # type: dict[tuple[int, int], set]
+        # cell range (first column, first row, last column, last row) of every key
+        self._ranges = {}  # type: dict[object, tuple[int, int, int, int]]
+        self._rects = {}  # type: dict[object, tuple[int, int, int, int]]
+
+    def __len__(self):
+        return len(self._ranges)
+
+    def __contains__(self, key):
+        return key in self._ranges
+
+    def _cell_range(self, rect):
+        left, top, width, height = rect
+        size = self.cell_size
+        return (
+            left // size, top // size,
+            (left + max(width, 1) - 1) // size, (top + max(height, 1) - 1) // size,
+        )
+
+    def _add_cells(self, key, cell_range):
+        col_0, row_0, col_1, row_1 = cell_range
+        cells = self._cells
+        for col in range(col_0, col_1 + 1):
+            for row in range(row_0, row_1 + 1):
+                cell = cells.get((col, row))
+                if cell is None:
+                    cell = cells[(col, row)] = set()
+                cell.add(key)
+
+    def _remove_cells(self, key, cell_range):
+        col_0, row_0, col_1, row_1 = cell_range
+        cells = self._cells
+        for col in range(col_0, col_1 + 1):
+            for row in range(row_0, row_1 + 1):
+                cell = cells[(col, row)]
+                cell.discard(key)
+                if not cell:
+                    del cells[(col, row)]
+
+    def insert(self, key, rect):
+        if key in self._ranges:
+            self.update(key, rect)
+            return
+
+        cell_range = self._cell_range(rect)
+        self._ranges[key] = cell_range
+        self._rects[key] = tuple(rect)
+        self._add_cells(key, cell_range)
+
+    def update(self, key, rect):
+        """
+            Moves (or resizes) the rectangle of an already inserted key
+        """
+        cell_range = self._cell_range(rect)
+        self._rects[key] = tuple(rect)
+
+        old_range = self._ranges[key]
+        if cell_range == old_range:
+            return
+
+        self._remove_cells(key, old_range)
+        self._add_cells(key, cell_range)
+        self._ranges[key] = cell_range
+
+    def remove(self, key):
+        self._remove_cells(key, self._ranges.pop(key))
+        del self._rects[key]
+
+    def clear(self):
+        self._cells.clear()
+        self._ranges.clear()
+        self._rects.clear()
+
+    def query_point(self, x, y):
+        """
+            Returns the keys of all rectangles containing the point, in no particular order
+        """
+        size = self.cell_size
+        cell = self._cells.get((x // size, y // size))
+        if not cell:
+            return []
+
+        result = []
+        rects = self._rects
+        for key in cell:
+            left, top, width, height = rects[key]
+            if left <= x < left + width and top <= y < top + height:
+                result.append(key)
+        return result
+
+    def query_rect(self, rect):
+        """
+            Returns the keys of all rectangles overlapping the given one
+        """
+        left, top, width, height = rect
+        right = left + width
+        bottom = top + height
+
+        col_0, row_0, col_1, row_1 = self._cell_range(rect)
+        cells = self._cells
+        rects = self._rects
+
+        # small queries look at cells, large ones (more cells than keys) at the keys directly
+        if (col_1 - col_0 + 1) * (row_1 - row_0 + 1) > len(rects):
+            candidates = rects.keys()
+        else:
+            candidates = set()
+            for col in range(col_0, col_1 + 1):
+                for row in range(row_0, row_1 + 1):
+                    cell = cells.get((col, row))
+                    if cell:
+                        candidates.update(cell)
+
+        result = []
+        for key in candidates:
+            k_left, k_top, k_width, k_height = rects[key]
+            if k_left < right and left < k_left + k_width and k_top < bottom and top < k_top + k_height:
+                result.append(key)
+        return result
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import itertools
+import multiprocessing
+import os
+from collections import deque
+
+from app.netlist import Netlist
+from app.engine import exhaustive_inputs, pack_vectors, unpack_vectors
+from app.codegen import compile_netlist
+
+
+# vectors per task, a power of two so that exhaustive chunks line up with the truth table
+DEFAULT_CHUNK_SIZE = 1 << 14
+
+
+# the circuit of the current worker process and its generated evaluation function, set
+# once by `_init_worker`. Only used in pool workers, a runner without a pool keeps its own
+_worker_netlist = None  # type: Netlist
+_worker_evaluate = None
+
+
+def _init_worker(netlist: Netlist):
+    global _worker_netlist, _worker_evaluate
+    _worker_netlist = netlist
+    _worker_evaluate = compile_netlist(netlist)
+
+
+def _worker_task(chunk_func, task):
+    return chunk_func(_worker_netlist, _worker_evaluate, task)
+
+
+def _format_rows(packed, width) -> str:
+    """
+        Formats packed outputs as one line of 0s and 1s per vector
+    """
+    if not packed:
+        return '\n' * width
+
+    # character k of every (reversed) binary representation is the value for vector k
+    columns = [format(word, f'0{width}b')[:-width - 1:-1] for word in packed]
+    return '\n'.join(map(''.join, zip(*columns))) + '\n'
+
+
+def _exhaustive_task(netlist: Netlist, evaluate, task):
+    start, width, as_text = task
+    packed = evaluate(exhaustive_inputs(len(netlist.input_nets), start, width), (1 << width) - 1)
+    return _format_rows(packed, width) if as_text else packed
+
+
+def _vectors_task(netlist: Netlist, evaluate, task):
+    vectors, as_text = task
+    packed = evaluate(pack_vectors(vectors, len(netlist.input_nets)), (1 << len(vectors)) - 1)
+    return _format_rows(packed, len(vectors)) if as_text else unpack_vectors(packed, len(vectors))
+
+
+class ShardedRunner:
+
+    """
+        Evaluates large sets of input vectors of a combinational circuit on all cores
+
+        Stimuli are split into chunks, every worker process holds its own copy of
+        the compiled circuit and evaluates whole chunks bit-parallel. Results are
+        yielded in the original order as soon as they are available, only a few
+        chunks per worker are in flight at any time so memory stays bounded no
+        matter how many vectors there are.
+
+        Typical usage:
+
+            with ShardedRunner(compile_chip(chip)) as runner:
+                for outputs in runner.exhaustive():
+                    ...
+    """
+
+    def __init__(self, netlist: Netlist, jobs=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        if not netlist.IsCombinational:
+            raise ValueError(f"'{netlist.name}' has a feedback loop, its vectors cannot be evaluated independently")
+
+        self.netlist = netlist
+        self.jobs = jobs or os.cpu_count() or 1
+        # rounded down to a power of two, see `exhaustive_inputs`
+        self.chunk_size = 1 << max(chunk_size.bit_length() - 1, 0)
+
+        self._pool = None
+        self._evaluate = None
+        if self.jobs > 1:
+            self._pool = multiprocessing.Pool(self.jobs, _init_worker, (netlist,))
+        else:
+            self._evaluate = compile_netlist(netlist)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _map(self, func, tasks):
+        """
+            Like `map`, but runs on the pool with a bounded number of tasks in flight. `func`
+            is called with the circuit and its evaluation function, then the task
+        """
+        if self._pool is None:
+            for task in tasks:
+                yield func(self.netlist, self._evaluate, task)
+            return
+
+        in_flight = deque()
+        for task in tasks:
+            in_flight.append(self._pool.apply_async(_worker_task, (func, task)))
+            if len(in_flight) >= 2 * self.jobs:
+                yield in_flight.popleft().get()
+
+        while in_flight:
+            yield in_flight.popleft().get()
+
+    def _exhaustive_tasks(self, as_text):
+        total = 1 << len(self.netlist.input_nets)
+        width = min(total, self.chunk_size)
+        return ((start, width, as_text) for start in range(0, total, width))
+
+    def _vector_tasks(self, vectors, as_text):
+        vectors = iter(vectors)
+        while True:
+            chunk = list(itertools.islice(vectors, self.chunk_size))
+            if not chunk:
+                return
+            yield (chunk, as_text)
+
+    def exhaustive(self):
+        """
+            Yields the outputs for every input combination, in truth table order
+            (input `i` of vector `v` is `(v >> i) & 1`)
+        """
+        for packed in self._map(_exhaustive_task, self._exhaustive_tasks(False)):
+            yield from unpack_vectors(packed, min(self.chunk_size, 1 << len(self.netlist.input_nets)))
+
+    def exhaustive_packed(self):
+        """
+            Yields the packed outputs (see `evaluate_packed`) of the truth table, chunk by chunk
+        """
+        return self._map(_exhaustive_task, self._exhaustive_tasks(False))
+
+    def exhaustive_text(self):
+        """
+            Yields the truth table as text, one block of lines per chunk. Formatting happens
+            in the workers, which matters when the output is what is being produced
+        """
+        return self._map(_exhaustive_task, self._exhaustive_tasks(True))
+
+    def run(self, vectors):
+        """
+            Yields the outputs for every input vector (sequences of 0/1), in order
+        """
+        for rows in self._map(_vectors_task, self._vector_tasks(vectors, False)):
+            yield from rows
+
+    def run_text(self, vectors):
+        """
+            Like `run`, but yields blocks of formatted output lines
+        """
+        return self._map(_vectors_task, self._vector_tasks(vectors, True))
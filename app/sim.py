@@ -0,0 +1,238 @@
+"""
+    Headless simulation, usable without a display (pygame is never imported)
+
+    Usage:
+
+        python -m app.sim CIRCUIT [VECTORS]
+        python -m app.sim CIRCUIT --cycles N [--clock INPUT]
+
+    CIRCUIT names a python object as `module:attribute`, for example
+    `app.builtinchips:AndGate`. The attribute can be a `Chip`, a chip class, a
+    chip factory or any function returning one of those. VECTORS is a file with one
+    input vector per line (read from stdin when omitted or `-`). A vector is a
+    list of 0s and 1s, optionally separated by spaces or commas; empty lines
+    and lines starting with `#` are ignored. For every vector the values of
+    the outputs are written to stdout on a line of their own, as soon as the
+    circuit settled.
+
+    Options:
+
+        --exhaustive    ignore VECTORS and print the whole truth table instead,
+                        in order (input `i` of line `v` is bit `i` of `v`)
+        --jobs N        evaluate on N worker processes (0 for one per core).
+                        Vectors are then independent of each other, which
+                        requires a circuit without feedback
+        --cycles N      step N clock cycles and print the outputs after every
+                        rising edge. The circuit's clocks are stepped, or input
+                        INPUT when `--clock` is given; other inputs stay 0
+        --vcd PATH      also write the inputs and outputs to a VCD file, with
+                        one time unit per vector (or per cycle with `--cycles`,
+                        which records the outputs only). Not available
+                        with `--exhaustive` or `--jobs`
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib
+import sys
+
+from app.pins import OscillationError
+from app.netlist import Netlist, compile_chip
+from app.engine import NetlistSimulator
+from app.runner import ShardedRunner
+from app.waveform import WaveformRecorder
+
+
+def load_circuit(spec: str) -> Netlist:
+    """
+        Imports the object named by `module:attribute` and compiles the chip it describes
+    """
+    module_name, sep, attr = spec.partition(':')
+    if not sep or not attr:
+        raise ValueError(f"Circuit must be given as 'module:attribute', got '{spec}'")
+
+    obj = importlib.import_module(module_name)
+    for part in attr.split('.'):
+        obj = getattr(obj, part)
+
+    # chip classes, factories and plain functions all build a chip when called,
+    # functions may also return a factory
+    while callable(obj):
+        obj = obj()
+
+    return compile_chip(obj)
+
+
+def parse_vector(line: str):
+    """
+        Returns the input values in a line of a vector file, None for lines without any
+    """
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+
+    vector = []
+    for char in line:
+        if char == '0' or char == '1':
+            vector.append(ord(char) - 48)
+        elif char not in ' \t,':
+            raise ValueError(f"Invalid character '{char}' in input vector '{line}'")
+
+    return vector
+
+
+def read_vectors(stream):
+    """
+        Yields the input vectors of a vector file, one at a time
+    """
+    for line in stream:
+        vector = parse_vector(line)
+        if vector is not None:
+            yield vector
+
+
+def run(netlist: Netlist, vectors, recorder: WaveformRecorder = None):
+    """
+        Applies the vectors in order and yields the outputs after each of them
+
+        State carries over from one vector to the next, so sequential circuits
+        behave as if the inputs were toggled by hand. With a `recorder`, the nets it
+        watches are sampled after every vector, vector `v` being time `v`
+    """
+    sim = NetlistSimulator(netlist)
+    input_count = len(netlist.input_nets)
+    for time, vector in enumerate(vectors):
+        if len(vector) != input_count:
+            raise ValueError(f"'{netlist.name}' has {input_count} inputs, got a vector of {len(vector)}")
+        outputs = sim.apply(vector)
+        if recorder is not None:
+            recorder.sample(time, sim.state)
+        yield outputs
+
+
+def format_vector(values) -> str:
+    return ''.join('1' if value else '0' for value in values)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m app.sim', description='Simulates a circuit without opening the editor')
+    parser.add_argument('circuit', help="python object to simulate, as 'module:attribute'")
+    parser.add_argument('vectors', nargs='?', default='-', help="file with one input vector per line, '-' for stdin")
+    parser.add_argument('--exhaustive', action='store_true', help="print the full truth table instead of reading vectors")
+    parser.add_argument('--jobs', type=int, default=None, help="number of worker processes, 0 for one per core")
+    parser.add_argument('--cycles', type=int, default=None, help="number of clock cycles to run")
+    parser.add_argument('--clock', type=int, default=None, help="index of the input driving the clock")
+    parser.add_argument('--vcd', default=None, help="file to write a waveform of the inputs and outputs to")
+    args = parser.parse_args(argv)
+
+    if args.vcd is not None and args.cycles is None and (args.exhaustive or args.jobs is not None):
+        # vectors are evaluated out of order by the workers, there is no timeline to record
+        parser.error("--vcd cannot be combined with --exhaustive or --jobs")
+
+    try:
+        netlist = load_circuit(args.circuit)
+    except (ImportError, AttributeError, ValueError, TypeError, OscillationError) as e:
+        parser.error(f"cannot load circuit: {e}")
+
+    if args.cycles is not None:
+        return _main_cycles(args, netlist)
+
+    if args.exhaustive or args.jobs is not None:
+        return _main_sharded(args, netlist)
+
+    stream = trace = recorder = None
+    try:
+        stream = sys.stdin if args.vectors == '-' else open(args.vectors)
+        if args.vcd is not None:
+            trace = open(args.vcd, 'w')
+            recorder = WaveformRecorder(trace, timescale='1s', scope=_scope_name(netlist))
+            for i, net in enumerate(netlist.input_nets):
+                recorder.watch_net(net, f'in{i}', netlist.initial_state[net])
+            for i, net in enumerate(netlist.output_nets):
+                recorder.watch_net(net, f'out{i}', netlist.initial_state[net])
+
+        out = sys.stdout
+        for outputs in run(netlist, read_vectors(stream), recorder):
+            out.write(format_vector(outputs))
+            out.write('\n')
+            # flushed right away, so whatever reads the outputs gets them as the vectors come in
+            out.flush()
+    except (ValueError, OscillationError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if stream is not None and stream is not sys.stdin:
+            stream.close()
+        if trace is not None:
+            recorder.close()
+            trace.close()
+
+    return 0
+
+
+def _scope_name(netlist: Netlist):
+    # VCD scopes are single words
+    return '_'.join(netlist.name.split()) or 'top'
+
+
+def _main_cycles(args, netlist: Netlist):
+    try:
+        samples = NetlistSimulator(netlist).run_cycles(args.cycles, clock=args.clock)
+    except (ValueError, IndexError, OscillationError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+
+    output_count = len(netlist.output_nets)
+    out = sys.stdout
+    for word in samples:
+        out.write(format(word, f'0{output_count}b')[::-1] if output_count else '')
+        out.write('\n')
+
+    if args.vcd is not None:
+        try:
+            with open(args.vcd, 'w') as trace, WaveformRecorder(trace, timescale='1s', scope=_scope_name(netlist)) as recorder:
+                for i in range(output_count):
+                    recorder.add_signal(f'out{i}')
+                for cycle, word in enumerate(samples):
+                    for i in range(output_count):
+                        recorder.record(cycle, i, (word >> i) & 1)
+        except OSError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+def _main_sharded(args, netlist: Netlist):
+    stream = None
+    try:
+        with ShardedRunner(netlist, jobs=args.jobs or None) as runner:
+            if args.exhaustive:
+                blocks = runner.exhaustive_text()
+            else:
+                stream = sys.stdin if args.vectors == '-' else open(args.vectors)
+                blocks = runner.run_text(_checked_vectors(netlist, read_vectors(stream)))
+
+            for block in blocks:
+                sys.stdout.write(block)
+    except (ValueError, OscillationError, OSError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        if stream is not None and stream is not sys.stdin:
+            stream.close()
+
+    return 0
+
+
+def _checked_vectors(netlist: Netlist, vectors):
+    input_count = len(netlist.input_nets)
+    for vector in vectors:
+        if len(vector) != input_count:
+            raise ValueError(f"'{netlist.name}' has {input_count} inputs, got a vector of {len(vector)}")
+        yield vector
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import contextlib
+import queue
+import threading
+import time
+import traceback
+
+from app.pins import Pin, SignalEmitter, OscillationError, batch_edit
+
+
+class SimulationThread(threading.Thread):
+
+    """
+        Runs the simulation on a worker thread, so an expensive change does not freeze the UI
+
+        The worker owns the circuit: once it is started, every change to connected
+        pins has to be sent through `submit` (or the helpers built on it) rather than
+        made directly, and is applied on the worker in order.
+
+        The UI reads pin states from snapshots instead of the pins. Pins are
+        registered with `watch`, which returns the position of the pin's state in
+        every snapshot. After applying commands (or ticking) the worker copies the
+        state of all watched pins into its back buffer and publishes an immutable
+        copy of it as the new `Snapshot`, so readers always see a consistent state
+        even while the worker is in the middle of a change.
+
+        With `tick_rate` set, the worker wakes up `tick_rate` times per second and
+        calls every function in `tick_callbacks` (e.g. to advance a clock), without
+        it the worker is free-running: it sleeps until a command arrives and then
+        processes commands as fast as it can.
+    """
+
+    def __init__(self, tick_rate=None):
+        super().__init__(name="simulation", daemon=True)
+
+        self.tick_rate = tick_rate
+        self.tick_callbacks = []  # type: list[callable]
+
+        self.commands = queue.Queue()
+
+        # the pins whose state is published, in snapshot order
+        self._watched = []  # type: list[Pin]
+        # number of pins watched so far, assigned on the caller's thread
+        self._watch_count = 0
+
+        # a list rather than bytes, bus pins carry whole words
+        self._back = []  # type: list[int]
+        self._snapshot = ()
+
+        # incremented every time a snapshot is published
+        self.version = 0
+
+        # the last exception raised by a command, e.g. an `OscillationError`, and
+        # how many were raised so far (to tell a new error from one already shown)
+        self.last_error = None  # type: Exception
+        self.error_count = 0
+
+        # commands of the open transaction, None outside of one
+        self._batch = None  # type: list[tuple]
+
+        self._stopping = False
+
+    @property
+    def Snapshot(self) -> tuple:
+        """
+            State of every watched pin at the time of the latest published snapshot
+        """
+        return self._snapshot
+
+    @property
+    def Busy(self):
+        """
+            Whether the state may still change without further commands
+        """
+        return bool(self.tick_callbacks) or self.commands.unfinished_tasks > 0
+
+    def submit(self, func, *args):
+        """
+            Runs `func(*args)` on the worker
+        """
+        if self._batch is not None:
+            self._batch.append((func, args))
+        else:
+            self.commands.put((func, args))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """
+            Groups the commands submitted inside the `with` block: the worker runs them
+            all in one `batch_edit`, so the circuit settles once after the last of them
+            and no snapshot shows the edit half done. Meant to be used from the thread
+            submitting the commands; nested transactions join the outermost one.
+
+            The commands submitted before the block raises are still run, the caller
+            may already have acted upon them (e.g. the editor adding its wires)
+        """
+        if self._batch is not None:
+            yield
+            return
+
+        self._batch = []
+        try:
+            yield
+        finally:
+            commands, self._batch = self._batch, None
+            if commands:
+                self.commands.put((self._run_batch, (commands,)))
+
+    def connect(self, source: SignalEmitter, target: Pin):
+        self.submit(source.connect_to, target)
+
+    def disconnect(self, source: SignalEmitter, target: Pin):
+        self.submit(source.disconnect_from, target)
+
+    def set_signal(self, pin: Pin, signal):
+        self.submit(pin.recv_signal, signal)
+
+    def watch(self, pin: Pin) -> int:
+        """
+            Publishes the state of `pin` in every snapshot from now on. Returns its index in the snapshots
+        """
+        index = self._watch_count
+        self._watch_count += 1
+        self.submit(self._watched.append, pin)
+        return index
+
+    def stop(self):
+        self._stopping = True
+        # wake up the worker if it is waiting for a command
+        self.commands.put((None, ()))
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        interval = 1 / self.tick_rate if self.tick_rate else None
+        next_tick = time.perf_counter()
+
+        while not self._stopping:
+            if interval is None:
+                timeout = None
+            else:
+                timeout = max(next_tick - time.perf_counter(), 0)
+
+            try:
+                command = self.commands.get(timeout=timeout)
+            except queue.Empty:
+                command = None
+
+            applied = 0
+            try:
+                if command is not None:
+                    applied = 1
+                    self._apply(command)
+                    # apply everything that queued up in the meantime before publishing
+                    while True:
+                        try:
+                            command = self.commands.get_nowait()
+                        except queue.Empty:
+                            break
+                        applied += 1
+                        self._apply(command)
+
+                ticked = False
+                if interval is not None and time.perf_counter() >= next_tick:
+                    next_tick += interval
+                    for callback in self.tick_callbacks:
+                        self._run_guarded(callback, ())
+                    ticked = True
+
+                if applied or ticked:
+                    self._publish()
+            finally:
+                # commands only count as done once their result is published, so
+                # `Busy` never turns False before the snapshot shows the change
+                for _ in range(applied):
+                    self.commands.task_done()
+
+    def _apply(self, command):
+        func, args = command
+        if func is not None:
+            self._run_guarded(func, args)
+
+    def _run_batch(self, commands):
+        with batch_edit():
+            for func, args in commands:
+                self._run_guarded(func, args)
+
+    def _run_guarded(self, func, args):
+        """
+            Runs a command, an exception is recorded in `last_error` instead of stopping the worker
+        """
+        try:
+            func(*args)
+        except Exception as e:
+            if not isinstance(e, (OscillationError, ValueError, IndexError)):
+                # not caused by the circuit, so most likely a bug worth a traceback
+                traceback.print_exc()
+            self.last_error = e
+            self.error_count += 1
+
+    def _publish(self):
+        back = self._back
+        watched = self._watched
+        if len(back) != len(watched):
+            back.extend([0] * (len(watched) - len(back)))
+
+        for i, pin in enumerate(watched):
+            back[i] = pin.State
+
+        # tuples are immutable, readers holding on to an old snapshot are never affected
+        self._snapshot = tuple(back)
+        self.version += 1
@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+import heapq
+from array import array
+
+from app.pins import OscillationError
+from app.netlist import Netlist, GATE_AND, GATE_OR, GATE_NOT, GATE_LATCH, GATE_LATCH_N, GATE_CLOCK
+from app.engine import propagate, MAX_DELTA_CYCLES
+
+
+# propagation delay of every gate type when none is configured, in time units
+DEFAULT_DELAYS = {
+    GATE_AND: 1,
+    GATE_OR: 1,
+    GATE_NOT: 1,
+    GATE_LATCH: 1,
+    GATE_LATCH_N: 1,
+    GATE_CLOCK: 0,
+}
+
+
+class TimingWheel:
+
+    """
+        Calendar queue of events scheduled at integer times
+
+        Events less than `size` time units ahead go straight into the bucket of
+        their time slot, which makes scheduling O(1). Events further ahead wait in
+        an overflow heap and are moved into the wheel once it turns close enough.
+        Gate delays are small compared to the wheel, so nearly every event takes
+        the fast path.
+    """
+
+    DEFAULT_SIZE = 1024
+
+    def __init__(self, size=DEFAULT_SIZE):
+        self.size = size
+        self.now = 0
+
+        self._buckets = [[] for _ in range(size)]
+        # number of events in the buckets
+        self._count = 0
+
+        self._overflow = []  # type: list[tuple[int, int, object]]
+        # tie breaker keeping overflow events of the same time in scheduling order
+        self._sequence = 0
+
+    def __len__(self):
+        return self._count + len(self._overflow)
+
+    def schedule(self, time, event):
+        if time < self.now:
+            raise ValueError(f"Cannot schedule an event at {time}, the wheel is already at {self.now}")
+
+        if time - self.now < self.size:
+            self._buckets[time % self.size].append(event)
+            self._count += 1
+        else:
+            heapq.heappush(self._overflow, (time, self._sequence, event))
+            self._sequence += 1
+
+    def _migrate(self):
+        overflow = self._overflow
+        horizon = self.now + self.size
+        while overflow and overflow[0][0] < horizon:
+            time, _, event = heapq.heappop(overflow)
+            self._buckets[time % self.size].append(event)
+            self._count += 1
+
+    def next_time(self):
+        """
+            Returns the time of the earliest pending event, None if there are none
+        """
+        if self._count == 0:
+            if not self._overflow:
+                return None
+            return self._overflow[0][0]
+
+        time = self.now
+        buckets = self._buckets
+        size = self.size
+        while not buckets[time % size]:
+            time += 1
+        return time
+
+    def pop(self):
+        """
+            Advances to the earliest pending event and returns its time and all the events
+            scheduled for that time (in scheduling order). Returns None if there are none
+        """
+        time = self.next_time()
+        if time is None:
+            return None
+
+        self.now = time
+        self._migrate()
+
+        bucket = self._buckets[time % self.size]
+        self._buckets[time % self.size] = []
+        self._count -= len(bucket)
+        return time, bucket
+
+
+class TimedSimulator:
+
+    """
+        Simulates a `Netlist` with a propagation delay for every gate
+
+        Gate outputs follow their inputs after the gate's delay (transport delay),
+        so short pulses and glitches are simulated rather than filtered out and
+        circuits with feedback, like ring oscillators or clocked designs built
+        from gates, simply keep producing events over time instead of failing to
+        settle. Events are kept in a `TimingWheel`.
+
+        `delays` maps gate types to their delay. Keys can be gate codes or builtin
+        chip classes (AndGate, OrGate, NotGate); custom chips are flattened into
+        builtin gates, so their timing follows from the gates inside them.
+        `gate_delays` overrides the delay of individual gates by index.
+    """
+
+    def __init__(self, netlist: Netlist, delays=None, gate_delays=None, wheel_size=TimingWheel.DEFAULT_SIZE):
+        self.netlist = netlist
+        self.state = netlist.new_state()
+
+        self.delays = self._gate_delays(netlist, delays, gate_delays)
+        self.wheel = TimingWheel(wheel_size)
+
+        # number of times every net changed, glitches show up as extra transitions
+        self.transitions = array('L', bytes(array('L').itemsize * netlist.NetCount))
+        self.events = 0
+
+        # called as on_change(time, net, value) for every net change, e.g. to record waveforms
+        self.on_change = None
+
+        # start from a settled state, as if the inputs had been stable forever
+        try:
+            propagate(netlist, self.state, range(netlist.GateCount))
+        except OscillationError:
+            # a loop without a stable state (e.g. a ring oscillator) oscillates with its real
+            # delays instead. Settling went as far as it could, so in a ring only the gate at
+            # the wave front is left with an output that does not match its inputs
+            self._schedule_all()
+
+    def _schedule_all(self):
+        """
+            Evaluates every gate once, its output changes after the gate's delay
+        """
+        netlist = self.netlist
+        state = self.state
+        gate_in_a = netlist.gate_in_a
+        gate_in_b = netlist.gate_in_b
+        gate_out = netlist.gate_out
+        time = self.Now
+
+        for gate, kind in enumerate(netlist.gate_types):
+            if kind == GATE_AND:
+                value = state[gate_in_a[gate]] & state[gate_in_b[gate]]
+            elif kind == GATE_OR:
+                value = state[gate_in_a[gate]] | state[gate_in_b[gate]]
+            elif kind == GATE_NOT:
+                value = state[gate_in_a[gate]] ^ 1
+            elif kind == GATE_LATCH:
+                value = state[gate_in_a[gate]] if state[gate_in_b[gate]] else state[gate_out[gate]]
+            elif kind == GATE_LATCH_N:
+                value = state[gate_out[gate]] if state[gate_in_b[gate]] else state[gate_in_a[gate]]
+            else:
+                continue
+            self.wheel.schedule(time + self.delays[gate], (gate_out[gate], value))
+
+    @staticmethod
+    def _gate_delays(netlist: Netlist, delays, gate_delays):
+        by_code = dict(DEFAULT_DELAYS)
+        for key, delay in (delays or {}).items():
+            code = getattr(key, 'gate_code', key)
+            by_code[code] = delay
+
+        result = array('l', (by_code[kind] for kind in netlist.gate_types))
+        for gate, delay in (gate_delays or {}).items():
+            result[gate] = delay
+
+        if any(delay < 0 for delay in result):
+            raise ValueError("Gate delays cannot be negative")
+        return result
+
+    @property
+    def Now(self):
+        return self.wheel.now
+
+    @property
+    def Outputs(self):
+        state = self.state
+        return [state[net] for net in self.netlist.output_nets]
+
+    def set_input(self, index, signal, time=None):
+        """
+            Schedules input `index` to change to `signal` at `time` (now by default)
+        """
+        self.wheel.schedule(self.Now if time is None else time, (self.netlist.input_nets[index], signal))
+
+    def schedule_clock(self, half_period, cycles, start=None):
+        """
+            Schedules `cycles` periods of the netlist's clock sources, each high for
+            `half_period` time units and then low for as long, starting at `start` (now by default)
+        """
+        clock_nets = self.netlist.ClockNets
+        time = self.Now if start is None else start
+        for _ in range(cycles):
+            for net in clock_nets:
+                self.wheel.schedule(time, (net, 1))
+                self.wheel.schedule(time + half_period, (net, 0))
+            time += 2 * half_period
+
+    def run_until(self, time):
+        """
+            Processes every event scheduled up to and including `time`
+        """
+        wheel = self.wheel
+        while True:
+            next_time = wheel.next_time()
+            if next_time is None or next_time > time:
+                break
+            self._process(*wheel.pop())
+
+        # nothing else happens before `time`, later events can be scheduled from there
+        if time > wheel.now:
+            wheel.now = time
+            wheel._migrate()
+
+    def run(self, max_time=None):
+        """
+            Processes events until none are left (or `max_time` is reached).
+            Returns the time of the last processed event
+        """
+        wheel = self.wheel
+        while True:
+            next_time = wheel.next_time()
+            if next_time is None or (max_time is not None and next_time > max_time):
+                return wheel.now
+            self._process(*wheel.pop())
+
+    def _process(self, time, events):
+        netlist = self.netlist
+        state = self.state
+        delays = self.delays
+        transitions = self.transitions
+        on_change = self.on_change
+
+        gate_types = netlist.gate_types
+        gate_in_a = netlist.gate_in_a
+        gate_in_b = netlist.gate_in_b
+        gate_out = netlist.gate_out
+        fanout_start = netlist.fanout_start
+        fanout_gates = netlist.fanout_gates
+
+        wheel = self.wheel
+        deltas = 0
+
+        # zero delay gates schedule into the current slot, which is handled in further delta cycles
+        while events:
+            deltas += 1
+            if deltas > MAX_DELTA_CYCLES:
+                raise OscillationError(f"'{netlist.name}' did not settle at time {time} (zero delay loop)")
+
+            self.events += len(events)
+
+            gates = {}
+            for net, value in events:
+                if state[net] == value:
+                    continue
+                state[net] = value
+                transitions[net] += 1
+                if on_change is not None:
+                    on_change(time, net, value)
+                for i in range(fanout_start[net], fanout_start[net + 1]):
+                    gates[fanout_gates[i]] = None
+
+            for gate in gates:
+                kind = gate_types[gate]
+                if kind == GATE_AND:
+                    value = state[gate_in_a[gate]] & state[gate_in_b[gate]]
+                elif kind == GATE_OR:
+                    value = state[gate_in_a[gate]] | state[gate_in_b[gate]]
+                elif kind == GATE_NOT:
+                    value = state[gate_in_a[gate]] ^ 1
+                elif kind == GATE_LATCH:
+                    value = state[gate_in_a[gate]] if state[gate_in_b[gate]] else state[gate_out[gate]]
+                elif kind == GATE_LATCH_N:
+                    value = state[gate_out[gate]] if state[gate_in_b[gate]] else state[gate_in_a[gate]]
+                else:
+                    continue
+                wheel.schedule(time + delays[gate], (gate_out[gate], value))
+
+            events = wheel._buckets[time % wheel.size]
+            wheel._buckets[time % wheel.size] = []
+            wheel._count -= len(events)
+
+    def critical_path(self):
+        """
+            Returns the longest input to output delay of a combinational netlist and the gates along it
+        """
+        netlist = self.netlist
+        if not netlist.IsCombinational:
+            raise ValueError(f"'{netlist.name}' is not combinational, it has no critical path")
+        order = netlist.topological_order()
+
+        # arrival time of every net and the gate driving it along the slowest path
+        arrival = [0] * netlist.NetCount
+        through = [-1] * netlist.NetCount
+        for gate in order:
+            a = netlist.gate_in_a[gate]
+            b = netlist.gate_in_b[gate]
+            source = a if b == -1 or arrival[a] >= arrival[b] else b
+            out = netlist.gate_out[gate]
+            arrival[out] = arrival[source] + self.delays[gate]
+            through[out] = gate
+
+        if not netlist.output_nets:
+            return 0, []
+        net = max(netlist.output_nets, key=lambda n: arrival[n])
+        delay = arrival[net]
+
+        path = []
+        while through[net] != -1:
+            gate = through[net]
+            path.append(gate)
+            a = netlist.gate_in_a[gate]
+            b = netlist.gate_in_b[gate]
+            net = a if b == -1 or arrival[a] >= arrival[b] else b
+        path.reverse()
+
+        return delay, path
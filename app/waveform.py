@@ -0,0 +1,305 @@
+"""
+    Recording signal changes over time
+
+    A `WaveformRecorder` keeps the latest value changes of a set of signals in a
+    ring buffer of fixed size, and optionally streams every change to a VCD file
+    (Value Change Dump, readable by e.g. GTKWave) while the simulation runs.
+
+    Signals come from either simulation model:
+
+        object model    `watch_pin` attaches a `Probe` to a chip output pin or an
+                        input signal. Changes are timestamped with the number of
+                        delta cycles the scheduler ran so far, unless a different
+                        `time_source` is given
+        netlists        `watch_net` registers a net. A `TimedSimulator` reports its
+                        changes through `net_listener`, other simulators can call
+                        `sample` with their state array whenever time advances
+
+    Typical usage:
+
+        with open('trace.vcd', 'w') as stream, WaveformRecorder(stream) as recorder:
+            sim = TimedSimulator(netlist)
+            recorder.watch_net(netlist.output_nets[0], 'out')
+            sim.on_change = recorder.net_listener()
+            sim.run()
+"""
+
+from __future__ import annotations
+
+from array import array
+
+from app.pins import ChipPin, SignalEmitter, Probe, scheduler
+
+
+# memory used by the ring buffer when no limit is given, in bytes
+DEFAULT_MAX_BYTES = 16 * 1024 * 1024
+
+# bytes taken by one change in the ring buffer: time, signal index and value
+CHANGE_SIZE = 8 + 4 + 8
+
+# values are kept in 64 bit slots
+MAX_WIDTH = 64
+
+# lines written to the VCD stream are buffered and written in blocks of this many
+STREAM_BLOCK = 4096
+
+
+def vcd_identifier(index) -> str:
+    """
+        Returns the short VCD identifier of a signal, made of printable characters ('!' to '~')
+    """
+    chars = []
+    while True:
+        index, digit = divmod(index, 94)
+        chars.append(chr(33 + digit))
+        if index == 0:
+            return ''.join(chars)
+        index -= 1
+
+
+class WaveformRecorder:
+
+    """
+        Records value changes of signals with bounded memory
+
+        Every change takes CHANGE_SIZE bytes in preallocated arrays. Once
+        `max_bytes` is used up, the oldest changes are overwritten (and counted in
+        `dropped`), so a recorder never grows, however long the simulation runs.
+        Only changes are stored: recording a signal's current value again is free.
+
+        With a `stream`, every change is also written to it in VCD format as it
+        is recorded. Signals have to be registered before the first change, since
+        VCD declares all of them upfront, and times must never decrease.
+    """
+
+    def __init__(self, stream=None, max_bytes=DEFAULT_MAX_BYTES, timescale='1ns', scope='top', time_source=None):
+        capacity = max_bytes // CHANGE_SIZE
+        if capacity < 1:
+            raise ValueError(f"A recorder needs at least {CHANGE_SIZE} bytes")
+
+        self.stream = stream
+        self.timescale = timescale
+        self.scope = scope
+
+        # time of changes on watched pins, the scheduler's delta count by default
+        self.time_source = time_source if time_source is not None else (lambda: scheduler.delta_count)
+
+        self.names = []  # type: list[str]
+        self.widths = []  # type: list[int]
+        # VCD identifier of every signal
+        self._ids = []  # type: list[str]
+        # last recorded value of every signal
+        self.values = []  # type: list[int]
+
+        self.capacity = capacity
+        self._times = array('Q', bytes(8 * capacity))
+        self._signals = array('I', [0]) * capacity
+        self._values = array('Q', bytes(8 * capacity))
+        # slot of the next change, and number of changes held
+        self._head = 0
+        self._count = 0
+
+        # changes that were overwritten to stay within the memory limit
+        self.dropped = 0
+
+        self.time = 0
+        self._started = False
+        self._closed = False
+
+        self._lines = []  # type: list[str]
+        # time of the last `#time` line written to the stream
+        self._stream_time = -1
+
+        # signal indices of every watched net, a net can be watched under several names
+        self._nets = {}  # type: dict[int, list[int]]
+        self._probes = []  # type: list[tuple[SignalEmitter, Probe]]
+
+    @property
+    def SignalCount(self):
+        return len(self.names)
+
+    @property
+    def ChangeCount(self):
+        return self._count
+
+    def add_signal(self, name, width=1, value=0) -> int:
+        """
+            Registers a signal with its current value and returns its index
+        """
+        if self._started:
+            raise ValueError("Signals must be added before the first change is recorded")
+        if not 1 <= width <= MAX_WIDTH:
+            raise ValueError(f"Signals must be between 1 and {MAX_WIDTH} bits wide, got {width}")
+
+        self.names.append(name)
+        self.widths.append(width)
+        self._ids.append(vcd_identifier(len(self._ids)))
+        self.values.append(value)
+        return len(self.names) - 1
+
+    def watch_pin(self, pin: SignalEmitter, name=None) -> int:
+        """
+            Records the signal of a chip output pin or an input signal. Pins that only
+            receive a signal (chip inputs, output signals) carry the value of the pin
+            driving them, which is the one to watch
+        """
+        if not isinstance(pin, SignalEmitter) or (isinstance(pin, ChipPin) and pin.pin_type == ChipPin.PinType.INPUT):
+            raise ValueError("Only pins driving a wire can be watched, watch the pin driving this one instead")
+
+        index = self.add_signal(name if name is not None else f'pin{self.SignalCount}', pin.width, pin.State)
+
+        record = self.record
+        time_source = self.time_source
+
+        def on_change(signal):
+            record(time_source(), index, signal)
+
+        # the probe goes first, so a change is recorded before what it causes downstream
+        probe = Probe(on_change, pin.width)
+        pin.connect_to(probe, first=True)
+        self._probes.append((pin, probe))
+        return index
+
+    def watch_net(self, net, name=None, value=0) -> int:
+        """
+            Records a net of a netlist, see `net_listener` and `sample`
+        """
+        index = self.add_signal(name if name is not None else f'net{net}', 1, value)
+        self._nets.setdefault(net, []).append(index)
+        return index
+
+    def net_listener(self):
+        """
+            Returns a function to use as `TimedSimulator.on_change`, recording the watched nets
+        """
+        nets = self._nets
+        record = self.record
+
+        def on_change(time, net, value):
+            indices = nets.get(net)
+            if indices is not None:
+                for index in indices:
+                    record(time, index, value)
+
+        return on_change
+
+    def sample(self, time, state):
+        """
+            Records the watched nets from the state array of a netlist simulation
+        """
+        values = self.values
+        for net, indices in self._nets.items():
+            value = state[net]
+            for index in indices:
+                if value != values[index]:
+                    self.record(time, index, value)
+
+    def record(self, time, index, value):
+        """
+            Records that signal `index` changed to `value` at `time`
+        """
+        if self._closed or self.values[index] == value:
+            return
+        if time < self.time:
+            raise ValueError(f"Changes must be recorded in order, got time {time} after {self.time}")
+
+        if not self._started:
+            self._start()
+
+        self.time = time
+        self.values[index] = value
+
+        head = self._head
+        self._times[head] = time
+        self._signals[head] = index
+        self._values[head] = value
+        self._head = head + 1 if head + 1 < self.capacity else 0
+        if self._count < self.capacity:
+            self._count += 1
+        else:
+            self.dropped += 1
+
+        if self.stream is not None:
+            lines = self._lines
+            if time != self._stream_time:
+                self._stream_time = time
+                lines.append(f'#{time}\n')
+            lines.append(self._vcd_value(index, value))
+            if len(lines) >= STREAM_BLOCK:
+                self.flush()
+
+    def changes(self, index=None):
+        """
+            Yields the recorded changes as (time, signal index, value), oldest first.
+            With `index` given, only the changes of that signal
+        """
+        start = self._head - self._count
+        for i in range(start, self._head):
+            # negative slots wrap around to the end of the buffer
+            slot = i % self.capacity
+            signal = self._signals[slot]
+            if index is None or signal == index:
+                yield self._times[slot], signal, self._values[slot]
+
+    def history(self, index):
+        """
+            Returns the recorded changes of one signal as a list of (time, value)
+        """
+        return [(time, value) for time, _, value in self.changes(index)]
+
+    def _vcd_value(self, index, value):
+        if self.widths[index] == 1:
+            return f'{value}{self._ids[index]}\n'
+        return f'b{value:b} {self._ids[index]}\n'
+
+    def _start(self):
+        self._started = True
+        if self.stream is None:
+            return
+
+        lines = [f'$timescale {self.timescale} $end\n', f'$scope module {self.scope} $end\n']
+        for index, (name, width) in enumerate(zip(self.names, self.widths)):
+            # VCD names can't contain whitespace
+            name = '_'.join(name.split())
+            lines.append(f'$var wire {width} {self._ids[index]} {name} $end\n')
+        lines.append('$upscope $end\n$enddefinitions $end\n')
+
+        lines.append(f'#{self.time}\n$dumpvars\n')
+        for index, value in enumerate(self.values):
+            lines.append(self._vcd_value(index, value))
+        lines.append('$end\n')
+
+        self._stream_time = self.time
+        self.stream.write(''.join(lines))
+
+    def flush(self):
+        """
+            Writes the buffered VCD lines to the stream
+        """
+        if self._lines:
+            self.stream.write(''.join(self._lines))
+            self._lines = []
+
+    def close(self):
+        """
+            Detaches from the watched pins and writes what is left to the stream. The stream is not closed
+        """
+        if self._closed:
+            return
+        if not self._started:
+            self._start()
+
+        self._closed = True
+        for pin, probe in self._probes:
+            pin.disconnect_from(probe)
+        self._probes = []
+
+        if self.stream is not None:
+            self.flush()
+            self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
+import sys
+
 from app.application import Application
 
-appl = Application()
+# optionally, a circuit file (.dls or .dlsb) to open
+appl = Application(sys.argv[1] if len(sys.argv) > 1 else None)
 appl.start()
\ No newline at end of file
@@ -0,0 +1,4 @@
+import os
+
+# chips compile to generated code, which must not end up in the user's cache
+os.environ.setdefault('DLS_CODEGEN_CACHE', '')
@@ -0,0 +1,80 @@
+"""
+    Edits made in a batch take effect together, once the batch ends
+"""
+
+from __future__ import annotations
+
+import pytest
+
+from app.pins import InputSignalPin, OutputSignalPin, batch_edit, scheduler
+from app.builtinchips import NotGate
+from app.simthread import SimulationThread
+
+
+def inverter_chain(length):
+    """
+        `length` NOT gates meant to be wired in a row (see `wire_chain`), all
+        outputting 1 while their inputs are unconnected
+    """
+    gates = [NotGate() for _ in range(length)]
+    signal, out = InputSignalPin(), OutputSignalPin()
+    return signal, gates, out
+
+
+def wire_chain(signal, gates, out):
+    signal.connect_to(gates[0].input_pins[0])
+    for source, target in zip(gates, gates[1:]):
+        source.output_pins[0].connect_to(target.input_pins[0])
+    gates[-1].output_pins[0].connect_to(out)
+
+
+def test_a_batch_settles_once_in_the_order_signals_flow():
+    signal, gates, out = inverter_chain(50)
+    with batch_edit():
+        wire_chain(signal, gates, out)
+        signal.recv_signal(1)
+        # nothing is evaluated before the batch ends
+        assert all(gate.output_pins[0].State == 1 for gate in gates)
+
+    assert [gate.output_pins[0].State for gate in gates] == [i & 1 for i in range(50)]
+    assert out.State == 1
+    assert scheduler.last_delta_cycles <= 2
+
+
+def test_nested_batches_join_the_outermost():
+    signal, gates, out = inverter_chain(3)
+    with batch_edit():
+        with batch_edit():
+            wire_chain(signal, gates, out)
+        assert gates[1].output_pins[0].State == 1
+    assert [gate.output_pins[0].State for gate in gates] == [1, 0, 1]
+
+
+def test_a_batch_settles_when_its_block_raises():
+    signal, gates, out = inverter_chain(4)
+    with pytest.raises(KeyError):
+        with batch_edit():
+            wire_chain(signal, gates, out)
+            raise KeyError()
+    assert [gate.output_pins[0].State for gate in gates] == [1, 0, 1, 0]
+
+
+def test_a_transaction_runs_as_one_batch_on_the_worker():
+    signal, gates, out = inverter_chain(5)
+    simulation = SimulationThread()
+    simulation.start()
+    try:
+        index = simulation.watch(out)
+        with pytest.raises(KeyError):
+            with simulation.transaction():
+                simulation.submit(wire_chain, signal, gates, out)
+                simulation.set_signal(signal, 1)
+                # nothing reaches the worker before the transaction ends
+                assert simulation.commands.unfinished_tasks == 1
+                raise KeyError()
+        simulation.commands.join()
+        assert simulation.Snapshot[index] == 0
+        assert [gate.output_pins[0].State for gate in gates] == [0, 1, 0, 1, 0]
+    finally:
+        simulation.stop()
+        simulation.join()
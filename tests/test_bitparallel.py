@@ -0,0 +1,62 @@
+"""
+    Evaluating many input vectors at once must give what evaluating them one by one gives
+"""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from app.engine import (
+    NetlistSimulator, pack_vectors, unpack_vectors, simulate_vectors, truth_table, packed_truth_table,
+)
+
+from tests.test_equivalence import random_netlist, random_sequential_netlist
+
+
+def test_vectors_pack_and_unpack():
+    rng = random.Random(8)
+    for count in (0, 1, 7, 64, 65):
+        vectors = [tuple(rng.randrange(2) for _ in range(5)) for _ in range(count)]
+        assert unpack_vectors(pack_vectors(vectors, 5), count) == vectors
+
+
+def test_vectors_match_the_engine():
+    rng = random.Random(9)
+    for _ in range(200):
+        netlist = random_netlist(rng)
+        if netlist is None:
+            continue
+        input_count = len(netlist.input_nets)
+        vectors = [tuple(rng.randrange(2) for _ in range(input_count)) for _ in range(rng.randrange(1, 40))]
+
+        expected = []
+        for vector in vectors:
+            # a fresh simulator per vector, as bit-parallel vectors don't see each other
+            expected.append(tuple(NetlistSimulator(netlist).apply(vector)))
+        assert simulate_vectors(netlist, vectors, chunk_size=16) == expected
+
+
+def test_truth_tables_do_not_depend_on_the_chunk_size():
+    rng = random.Random(10)
+    for _ in range(100):
+        netlist = random_netlist(rng)
+        if netlist is None:
+            continue
+        table = truth_table(netlist)
+        assert truth_table(netlist, chunk_size=2) == table
+        assert packed_truth_table(netlist, chunk_size=5) == packed_truth_table(netlist)
+
+        input_count = len(netlist.input_nets)
+        vectors = [tuple((v >> i) & 1 for i in range(input_count)) for v in range(1 << input_count)]
+        assert simulate_vectors(netlist, vectors) == table
+
+
+def test_sequential_netlists_are_refused():
+    rng = random.Random(11)
+    netlist = random_sequential_netlist(rng)
+    while netlist.IsCombinational:
+        netlist = random_sequential_netlist(rng)
+    with pytest.raises(ValueError):
+        truth_table(netlist)
@@ -0,0 +1,66 @@
+"""
+    Bus pins carry a whole word as one signal, and only connect to pins of their width
+"""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from app.pins import InputSignalPin, InputBusPin, OutputBusPin
+from app.builtinchips import BusAndGate, BusNotGate, NotGate, Splitter, Merger
+from app.netlist import compile_circuit
+from app.engine import NetlistSimulator
+from app.instrument import Instrumentation
+
+
+def test_pins_of_different_widths_do_not_connect():
+    bus, gate = InputBusPin(8), BusAndGate(4)
+    with pytest.raises(ValueError):
+        bus.connect_to(gate.input_pins[0])
+    with pytest.raises(ValueError):
+        InputSignalPin().connect_to(gate.input_pins[0])
+    with pytest.raises(ValueError):
+        NotGate().output_pins[0].connect_to(OutputBusPin(2))
+    assert not bus.children
+
+
+def test_a_word_is_one_event():
+    a, b, out = InputBusPin(16), InputBusPin(16), OutputBusPin(16)
+    gate = BusAndGate(16)
+    a.connect_to(gate.input_pins[0])
+    b.connect_to(gate.input_pins[1])
+    gate.output_pins[0].connect_to(out)
+    b.recv_signal(0xffff)
+
+    with Instrumentation() as stats:
+        a.recv_signal(0x1234)
+    assert out.State == 0x1234
+    # the signal, the gate's input and the gate's output
+    assert stats.events == 3
+
+
+def test_bits_split_and_merge_like_the_netlist():
+    width = 6
+    bus, out = InputBusPin(width), OutputBusPin(width)
+    inverter, splitter, merger = BusNotGate(width), Splitter(width), Merger(width)
+    bus.connect_to(inverter.input_pins[0])
+    inverter.output_pins[0].connect_to(splitter.input_pins[0])
+    # bits are reversed on the way back
+    for i in range(width):
+        splitter.output_pins[i].connect_to(merger.input_pins[width - 1 - i])
+    merger.output_pins[0].connect_to(out)
+
+    netlist = compile_circuit('reverse', [bus], [out])
+    assert list(netlist.input_widths) == [width] and list(netlist.output_widths) == [width]
+    sim = NetlistSimulator(netlist)
+
+    rng = random.Random(12)
+    for _ in range(20):
+        word = rng.getrandbits(width)
+        bus.recv_signal(word)
+        expected = int(format(word ^ 0b111111, f'0{width}b')[::-1], 2)
+        assert out.State == expected
+        bits = sim.apply([(word >> i) & 1 for i in range(width)])
+        assert bits == [(expected >> i) & 1 for i in range(width)]
@@ -0,0 +1,124 @@
+"""
+    Circuits packaged as custom chips
+"""
+
+from __future__ import annotations
+
+from app.pins import InputSignalPin, OutputSignalPin
+from app.builtinchips import AndGate, Clock, DFlipFlop, NotGate
+from app.chip import custom_chip_factory
+
+from tests.test_scheduler import nor_latch
+
+
+def test_clocks_listed_as_sources_are_packaged():
+    clock, flip_flop = Clock(), DFlipFlop()
+    d, q = InputSignalPin(), OutputSignalPin()
+    d.connect_to(flip_flop.input_pins[0])
+    clock.output_pins[0].connect_to(flip_flop.input_pins[1])
+    flip_flop.output_pins[0].connect_to(q)
+
+    factory = custom_chip_factory("CLOCKED", [d], [q], sources=[clock])
+    template = factory.Template
+    assert len(template.netlist.ClockNets) == 1
+    assert Clock.name in template.definition.chip_types
+
+    # editing another circuit must not make the factory forget its clock
+    NotGate().output_pins[0].connect_to(NotGate().input_pins[0])
+    assert factory.Template is template
+    assert factory().template is template
+
+
+def and_chain(count):
+    """
+        The AND of `count` inputs, as a chain of two input gates
+    """
+    inputs = [InputSignalPin() for _ in range(count)]
+    out = OutputSignalPin()
+    previous = inputs[0]
+    for signal in inputs[1:]:
+        gate = AndGate()
+        previous.connect_to(gate.input_pins[0])
+        signal.connect_to(gate.input_pins[1])
+        previous = gate.output_pins[0]
+    previous.connect_to(out)
+    return inputs, [out]
+
+
+def set_inputs(chip, values):
+    for pin, value in zip(chip.input_pins, values):
+        pin.recv_signal(value)
+
+
+def test_small_chips_get_their_whole_truth_table():
+    chip = custom_chip_factory("AND4", *and_chain(4))()
+    cache = chip.template.cache
+    assert cache.complete and len(cache) == 16
+
+    for vector in range(16):
+        values = [(vector >> i) & 1 for i in range(4)]
+        set_inputs(chip, values)
+        assert chip.output_pins[0].State == int(all(values))
+    assert cache.misses == 0
+
+
+def test_large_chips_keep_the_latest_entries():
+    chip = custom_chip_factory("AND10", *and_chain(10), cache_size=3)()
+    cache = chip.template.cache
+    assert not cache.complete
+
+    vectors = [[1] * 10, [1] * 9 + [0], [0] + [1] * 9, [0] * 10]
+    for values in vectors:
+        set_inputs(chip, [0] * 10)
+        set_inputs(chip, values)
+        assert chip.output_pins[0].State == int(all(values))
+    assert len(cache) == 3
+
+    # the oldest entry was evicted, the all zero vector is still there
+    assert cache.lookup(tuple(vectors[0])) is None
+    assert cache.lookup(tuple(vectors[3])) == (0,)
+
+
+def test_only_combinational_chips_are_cached():
+    assert custom_chip_factory("AND3", *and_chain(3), cache_size=0)().template.cache is None
+
+    set_signal, reset_signal, q = nor_latch()
+    q_signal = OutputSignalPin()
+    q.connect_to(q_signal)
+    assert custom_chip_factory("LATCH", [set_signal, reset_signal], [q_signal])().template.cache is None
+
+
+def test_instances_share_the_template_but_not_the_state():
+    set_signal, reset_signal, q = nor_latch()
+    q_signal = OutputSignalPin()
+    q.connect_to(q_signal)
+    factory = custom_chip_factory("LATCH", [set_signal, reset_signal], [q_signal])
+
+    first, second = factory(), factory()
+    assert first.template is second.template
+
+    set_inputs(first, [1, 0])
+    set_inputs(first, [0, 0])
+    assert first.output_pins[0].State == 1
+    assert second.output_pins[0].State == 0
+    assert first.state is not second.state
+
+
+def test_editing_the_circuit_gives_new_instances_a_new_template():
+    inputs, outputs = and_chain(2)
+    factory = custom_chip_factory("GATE", inputs, outputs)
+    old = factory()
+
+    # turn the AND into a NAND
+    gate = next(iter(inputs[0].children)).chip
+    inverter = NotGate()
+    gate.output_pins[0].disconnect_from(outputs[0])
+    gate.output_pins[0].connect_to(inverter.input_pins[0])
+    inverter.output_pins[0].connect_to(outputs[0])
+
+    new = factory()
+    assert new.template is not old.template
+    for chip in (old, new):
+        set_inputs(chip, [1, 1])
+    assert old.output_pins[0].State == 1
+    assert new.output_pins[0].State == 0
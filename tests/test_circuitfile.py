@@ -0,0 +1,209 @@
+"""
+    Circuits saved in either variant of the circuit file format must load back unchanged
+"""
+
+from __future__ import annotations
+
+import os
+import random
+from array import array
+
+import pytest
+
+from app.pins import InputSignalPin, InputBusPin, OutputBusPin, OutputSignalPin
+from app.builtinchips import AndGate, NotGate, BusAndGate, BusOrGate, BusNotGate, Splitter, Merger
+from app.chip import CustomChip, custom_chip_factory
+from app.definition import CircuitDefinition, define_circuit, END_CHIP_IN, END_SIG_IN
+from app.circuitfile import save_library, load_library, template_of, compile_definition, create_chips, connect_wires
+from app.engine import NetlistSimulator
+
+
+WIDTH = 8
+
+
+def bus_chip_factory():
+    """
+        A custom chip with bus signals, using every bus chip: outputs NOT(a AND b) OR a,
+        bit 3 of b, and b with its bits reversed
+    """
+    a, b = InputBusPin(WIDTH), InputBusPin(WIDTH)
+    mixed, bit, reversed_b = OutputBusPin(WIDTH), OutputSignalPin(), OutputBusPin(WIDTH)
+
+    and_gate, not_gate, or_gate = BusAndGate(WIDTH), BusNotGate(WIDTH), BusOrGate(WIDTH)
+    a.connect_to(and_gate.input_pins[0])
+    b.connect_to(and_gate.input_pins[1])
+    and_gate.output_pins[0].connect_to(not_gate.input_pins[0])
+    not_gate.output_pins[0].connect_to(or_gate.input_pins[0])
+    a.connect_to(or_gate.input_pins[1])
+    or_gate.output_pins[0].connect_to(mixed)
+
+    splitter, merger = Splitter(WIDTH), Merger(WIDTH)
+    b.connect_to(splitter.input_pins[0])
+    splitter.output_pins[3].connect_to(bit)
+    for i in range(WIDTH):
+        splitter.output_pins[i].connect_to(merger.input_pins[WIDTH - 1 - i])
+    merger.output_pins[0].connect_to(reversed_b)
+
+    return custom_chip_factory("BUSSY", [a, b], [mixed, bit, reversed_b])
+
+
+def expected_outputs(a, b):
+    mask = (1 << WIDTH) - 1
+    return ((~(a & b)) & mask) | a, (b >> 3) & 1, int(format(b, f'0{WIDTH}b')[::-1], 2)
+
+
+def top_definition() -> CircuitDefinition:
+    """
+        A circuit using the custom bus chip twice, next to unconnected builtin chips
+    """
+    factory = bus_chip_factory()
+    a, b = InputBusPin(WIDTH), InputBusPin(WIDTH)
+    mixed, bit, reversed_b = OutputBusPin(WIDTH), OutputSignalPin(), OutputBusPin(WIDTH)
+
+    first, second = factory(), factory()
+    a.connect_to(first.input_pins[0])
+    b.connect_to(first.input_pins[1])
+    first.output_pins[0].connect_to(mixed)
+    first.output_pins[1].connect_to(bit)
+    # reversing twice gives b back
+    first.output_pins[2].connect_to(second.input_pins[1])
+    a.connect_to(second.input_pins[0])
+    second.output_pins[2].connect_to(reversed_b)
+
+    definition = define_circuit("TOP", [a, b], [mixed, bit, reversed_b])
+    definition.add_chip("REG4", (7, -3))
+    definition.add_chip("NOT", (-20, 11))
+    definition.positions = array('i', range(len(definition.positions)))
+    return definition
+
+
+def describe(definition: CircuitDefinition):
+    """
+        Everything a definition holds, with nested definitions described recursively
+    """
+    return (
+        definition.name, definition.input_count, definition.output_count,
+        list(definition.input_widths), list(definition.output_widths),
+        [chip if isinstance(chip, str) else describe(chip) for chip in definition.chip_types],
+        list(definition.positions), list(definition.wires),
+    )
+
+
+@pytest.mark.parametrize('suffix', ['.dls', '.dlsb'])
+def test_round_trip(tmp_path, suffix):
+    top = top_definition()
+    path = tmp_path / f'circuit{suffix}'
+    save_library(str(path), top)
+
+    with load_library(str(path)) as library:
+        assert library.names() == ["BUSSY", "TOP"]
+        loaded = library.Top
+        assert describe(loaded) == describe(top)
+
+        # saving what was loaded gives the same file again
+        again = tmp_path / f'again{suffix}'
+        save_library(str(again), loaded)
+        assert again.read_bytes() == path.read_bytes()
+
+        chip = CustomChip(template_of(loaded))
+        simulator = NetlistSimulator(compile_definition(loaded))
+
+    assert [pin.width for pin in chip.input_pins] == [WIDTH, WIDTH]
+    assert [pin.width for pin in chip.output_pins] == [WIDTH, 1, WIDTH]
+
+    rng = random.Random(0)
+    for _ in range(100):
+        a, b = rng.getrandbits(WIDTH), rng.getrandbits(WIDTH)
+        mixed, bit, _ = expected_outputs(a, b)
+
+        chip.input_pins[0].recv_signal(a)
+        chip.input_pins[1].recv_signal(b)
+        assert tuple(pin.State for pin in chip.output_pins) == (mixed, bit, b)
+
+        bits = [(a >> i) & 1 for i in range(WIDTH)] + [(b >> i) & 1 for i in range(WIDTH)]
+        outputs = simulator.apply(bits)
+        assert outputs == (
+            [(mixed >> i) & 1 for i in range(WIDTH)] + [bit] + [(b >> i) & 1 for i in range(WIDTH)]
+        )
+
+
+def test_failed_save_keeps_the_previous_file(tmp_path):
+    path = tmp_path / 'circuit.dlsb'
+    save_library(str(path), top_definition())
+    saved = path.read_bytes()
+
+    broken = CircuitDefinition("BROKEN", 0, 0)
+    broken.add_chip(object())
+    with pytest.raises(Exception):
+        save_library(str(path), broken)
+
+    assert path.read_bytes() == saved
+    assert [file.name for file in tmp_path.iterdir()] == ['circuit.dlsb']
+
+
+def test_nested_templates_get_the_settings_of_the_top(tmp_path):
+    path = tmp_path / 'circuit.dls'
+    save_library(str(path), top_definition())
+
+    with load_library(str(path)) as library:
+        compile_definition(library.Top, cache_size=0, optimize=True, codegen=False)
+        nested = library['BUSSY'].template
+
+    assert nested.cache is None
+    assert nested.optimization is not None
+
+
+def test_saved_files_get_the_usual_permissions(tmp_path):
+    path = tmp_path / 'circuit.dlsb'
+    save_library(str(path), top_definition())
+    mask = os.umask(0)
+    os.umask(mask)
+    assert path.stat().st_mode & 0o777 == 0o666 & ~mask
+
+
+def test_wires_between_different_widths_are_skipped():
+    definition = top_definition()
+    chips, input_signals, output_signals = create_chips(definition)
+    # input a (a bus) to the input of the NOT gate, ahead of every good wire
+    definition.wires = array('i', [END_SIG_IN, 0, 0, END_CHIP_IN, 3, 0]) + definition.wires
+
+    assert connect_wires(definition, chips, input_signals, output_signals) == [0]
+    assert chips[3].input_pins[0].State == 0
+    a, b = 0b10110010, 0b01100111
+    input_signals[0].recv_signal(a)
+    input_signals[1].recv_signal(b)
+    expected = expected_outputs(a, b)
+    assert [pin.State for pin in output_signals] == [expected[0], expected[1], b]
+
+
+def test_packaging_tolerates_wires_leaving_the_circuit():
+    # the AND gate also drives an output signal of an enclosing circuit, and its
+    # result reaches the NOT gate through a relaying input signal
+    a, b = InputSignalPin(), InputSignalPin()
+    and_gate, not_gate = AndGate(), NotGate()
+    a.connect_to(and_gate.input_pins[0])
+    b.connect_to(and_gate.input_pins[1])
+    and_gate.output_pins[0].connect_to(OutputSignalPin())
+
+    relay = InputSignalPin()
+    and_gate.output_pins[0].connect_to(relay)
+    relay.connect_to(not_gate.input_pins[0])
+
+    nand, direct = OutputSignalPin(), OutputSignalPin()
+    not_gate.output_pins[0].connect_to(nand)
+    relay.connect_to(direct)
+
+    factory = custom_chip_factory("NAND", [a, b], [nand, direct])
+    chip = factory()
+    definition = chip.template.definition
+    assert definition.ChipCount == 2
+    # AND -> NOT and AND -> output 1 are saved as coming from the AND gate
+    assert definition.WireCount == 5
+
+    loaded = CustomChip(template_of(definition))
+    for x in (0, 1):
+        for y in (0, 1):
+            for instance in (chip, loaded):
+                instance.input_pins[0].recv_signal(x)
+                instance.input_pins[1].recv_signal(y)
+                assert [pin.State for pin in instance.output_pins] == [1 - (x & y), x & y]
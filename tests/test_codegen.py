@@ -0,0 +1,37 @@
+"""
+    Generated code must compute what the netlist it was generated from computes
+"""
+
+from __future__ import annotations
+
+from app.engine import evaluate_packed
+from app.codegen import SourceCache, compile_netlist, generate_source, structural_hash
+
+from tests.test_equivalence import random_cases
+
+
+def test_generated_code_has_the_same_truth_table():
+    for netlist, inputs, width in random_cases(2):
+        expected = evaluate_packed(netlist, inputs, width)
+        evaluate = compile_netlist(netlist, cache=None)
+        assert list(evaluate(inputs, (1 << width) - 1)) == expected
+
+
+def test_only_complete_sources_are_loaded(tmp_path):
+    netlist = next(random_cases(13))[0]
+    key = structural_hash(netlist)
+    source = generate_source(netlist)
+
+    cache = SourceCache(str(tmp_path))
+    assert cache.load(key) is None
+    cache.store(key, source)
+    assert cache.load(key) == source
+
+    path = tmp_path / f'{key}.py'
+    text = path.read_text(encoding='utf-8')
+    path.write_text(text[:len(text) // 2], encoding='utf-8')
+    assert cache.load(key) is None
+
+    # a file saved under another key is not taken either
+    path.write_text(text.replace(key, 'f' * len(key), 1), encoding='utf-8')
+    assert cache.load(key) is None
@@ -0,0 +1,65 @@
+"""
+    Generated code stepping clock cycles must match the event driven engine
+"""
+
+from __future__ import annotations
+
+import random
+
+from app.pins import InputSignalPin, OutputSignalPin
+from app.builtinchips import AndGate, OrGate, NotGate, Clock, DFlipFlop
+from app.netlist import compile_circuit
+from app.engine import NetlistSimulator
+
+
+def _random_register_circuit(rng: random.Random, clock_source):
+    """
+        Flip-flops fed by random logic of the inputs and the flip-flop outputs
+    """
+    inputs = [InputSignalPin() for _ in range(rng.randrange(1, 4))]
+    flip_flops = [DFlipFlop() for _ in range(rng.randrange(1, 6))]
+
+    pool = inputs + [flip_flop.output_pins[0] for flip_flop in flip_flops]
+    for _ in range(rng.randrange(15)):
+        gate = rng.choice((AndGate, OrGate, NotGate))()
+        for pin in gate.input_pins:
+            rng.choice(pool).connect_to(pin)
+        pool.append(gate.output_pins[0])
+
+    for flip_flop in flip_flops:
+        rng.choice(pool).connect_to(flip_flop.input_pins[0])
+        clock_source.connect_to(flip_flop.input_pins[1])
+
+    outputs = []
+    for pin in rng.sample(pool, min(len(pool), 5)):
+        signal = OutputSignalPin()
+        pin.connect_to(signal)
+        outputs.append(signal)
+    return inputs, outputs
+
+
+def test_generated_cycles_match_the_engine():
+    rng = random.Random(3)
+    for _ in range(200):
+        if rng.random() < 0.5:
+            clock = Clock()
+            inputs, outputs = _random_register_circuit(rng, clock.output_pins[0])
+            netlist = compile_circuit('registers', inputs, outputs, sources=[clock])
+            clock_input = None
+        else:
+            clock = InputSignalPin()
+            inputs, outputs = _random_register_circuit(rng, clock)
+            netlist = compile_circuit('registers', inputs + [clock], outputs)
+            clock_input = len(inputs)
+
+        generated, engine = NetlistSimulator(netlist), NetlistSimulator(netlist)
+        for _ in range(3):
+            for i in range(len(inputs)):
+                value = rng.randrange(2)
+                generated.set_input(i, value)
+                engine.set_input(i, value)
+
+            count = rng.randrange(20)
+            samples = generated.run_cycles(count, clock=clock_input)
+            assert samples == engine.run_cycles(count, clock=clock_input, codegen=False)
+            assert generated.state == engine.state
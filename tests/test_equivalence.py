@@ -0,0 +1,124 @@
+"""
+    The optimizer must not change what a circuit computes. Random netlists are
+    checked against the reference evaluators of app.engine
+"""
+
+from __future__ import annotations
+
+import random
+from array import array
+
+from app.pins import OscillationError
+from app.netlist import Netlist, GATE_AND, GATE_OR, GATE_NOT, GATE_LATCH, GATE_LATCH_N
+from app.engine import NetlistSimulator, evaluate_packed, exhaustive_inputs
+from app.optimize import optimize_netlist
+
+
+CASES = 1000
+
+
+def random_netlist(rng: random.Random):
+    """
+        Returns a combinational netlist with a few inputs, constant nets and gates
+        reading any earlier net, so outputs can be constant, inputs or any gate
+    """
+    input_count = rng.randint(0, 5)
+    net_count = input_count + rng.randint(0, 2)
+    if net_count == 0:
+        return None
+    state = bytearray(rng.randint(0, 1) for _ in range(net_count))
+
+    gate_types, gate_in_a, gate_in_b, gate_out = array('b'), array('l'), array('l'), array('l')
+    for _ in range(rng.randint(0, 25)):
+        kind = rng.choice((GATE_AND, GATE_OR, GATE_NOT))
+        gate_types.append(kind)
+        gate_in_a.append(rng.randrange(net_count))
+        gate_in_b.append(rng.randrange(net_count) if kind != GATE_NOT else -1)
+        gate_out.append(net_count)
+        state.append(0)
+        net_count += 1
+
+    output_nets = array('l', [rng.randrange(net_count) for _ in range(rng.randint(1, 4))])
+    return Netlist('random', gate_types, gate_in_a, gate_in_b, gate_out, state, array('l', range(input_count)), output_nets)
+
+
+def random_sequential_netlist(rng: random.Random):
+    """
+        Like `random_netlist`, but gates may read any net, including their own and
+        later ones, and some of them are latches
+    """
+    input_count = rng.randint(1, 4)
+    gate_count = rng.randint(1, 20)
+    net_count = input_count + rng.randint(0, 2) + gate_count
+    state = bytearray(rng.randint(0, 1) for _ in range(net_count))
+
+    gate_types, gate_in_a, gate_in_b, gate_out = array('b'), array('l'), array('l'), array('l')
+    for gate in range(gate_count):
+        kind = rng.choice((GATE_AND, GATE_OR, GATE_NOT, GATE_AND, GATE_OR, GATE_NOT, GATE_LATCH, GATE_LATCH_N))
+        gate_types.append(kind)
+        gate_in_a.append(rng.randrange(net_count))
+        gate_in_b.append(rng.randrange(net_count) if kind != GATE_NOT else -1)
+        gate_out.append(net_count - gate_count + gate)
+
+    output_nets = array('l', [rng.randrange(net_count) for _ in range(rng.randint(1, 4))])
+    return Netlist('random', gate_types, gate_in_a, gate_in_b, gate_out, state, array('l', range(input_count)), output_nets)
+
+
+def random_cases(seed):
+    rng = random.Random(seed)
+    for _ in range(CASES):
+        netlist = random_netlist(rng)
+        if netlist is not None:
+            input_count = len(netlist.input_nets)
+            width = 1 << input_count
+            inputs = exhaustive_inputs(input_count, 0, width)
+            yield netlist, inputs, width
+
+
+def test_optimized_netlists_have_the_same_truth_table():
+    for netlist, inputs, width in random_cases(1):
+        expected = evaluate_packed(netlist, inputs, width)
+        optimized, _ = optimize_netlist(netlist)
+        assert evaluate_packed(optimized, inputs, width) == expected
+
+
+def test_optimized_sequential_netlists_behave_the_same():
+    rng = random.Random(4)
+    for _ in range(CASES):
+        netlist = random_sequential_netlist(rng)
+        optimized, _ = optimize_netlist(netlist)
+        try:
+            expected = NetlistSimulator(netlist)
+        except OscillationError:
+            continue
+        actual = NetlistSimulator(optimized)
+        assert actual.Outputs == expected.Outputs
+
+        for _ in range(10):
+            for i in range(len(netlist.input_nets)):
+                value = rng.randrange(2)
+                expected.set_input(i, value)
+                actual.set_input(i, value)
+            try:
+                expected.settle()
+            except OscillationError:
+                break
+            actual.settle()
+            assert actual.Outputs == expected.Outputs
+
+
+def test_glitches_caught_by_a_loop_are_kept():
+    # q = OR(AND(x, NOT x), q) latches the pulse AND(x, NOT x) gives while x rises
+    gate_types = array('b', [GATE_AND, GATE_NOT, GATE_OR])
+    gate_in_a = array('l', [0, 0, 1])
+    gate_in_b = array('l', [2, -1, 3])
+    gate_out = array('l', [1, 2, 3])
+    netlist = Netlist('glitch', gate_types, gate_in_a, gate_in_b, gate_out, bytearray(4), array('l', [0]), array('l', [3, 0]))
+
+    optimized, report = optimize_netlist(netlist)
+    assert report.Removed == 0
+    for candidate in (netlist, optimized):
+        sim = NetlistSimulator(candidate)
+        sim.set_input(0, 1)
+        sim.settle()
+        assert sim.Outputs == [1, 1]
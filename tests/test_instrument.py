@@ -0,0 +1,50 @@
+"""
+    Instrumentation must count what the user did, not what the scheduler did with it
+"""
+
+from __future__ import annotations
+
+from app.pins import InputSignalPin, batch_edit
+from app.builtinchips import Clock, NotGate, DFlipFlop
+from app.instrument import Instrumentation
+
+
+def toggle_flip_flop():
+    """
+        A flip-flop reading its own inverted output, so it toggles on every rising edge
+    """
+    clock, flip_flop, inverter = Clock(), DFlipFlop(), NotGate()
+    clock.output_pins[0].connect_to(flip_flop.input_pins[1])
+    flip_flop.output_pins[0].connect_to(inverter.input_pins[0])
+    inverter.output_pins[0].connect_to(flip_flop.input_pins[0])
+    return clock, flip_flop
+
+
+def test_every_clock_tick_is_one_change():
+    clock, flip_flop = toggle_flip_flop()
+    with Instrumentation() as stats:
+        for _ in range(4):
+            clock.tick()
+
+    assert flip_flop.output_pins[0].State == 0
+    assert stats.external_changes == 4
+    assert stats.max_delta_cycles > 0
+    assert not stats.Enabled
+
+
+def test_a_batch_is_one_change_and_a_signal_another():
+    signals = [InputSignalPin() for _ in range(3)]
+    gates = [NotGate() for _ in signals]
+    for signal, gate in zip(signals, gates):
+        signal.connect_to(gate.input_pins[0])
+
+    with Instrumentation() as stats:
+        with batch_edit():
+            for signal in signals:
+                signal.recv_signal(1)
+        signals[0].recv_signal(0)
+
+    assert stats.external_changes == 2
+    # each signal reaches its gate's input, whose output changes
+    assert stats.max_events_per_change == 3 * 3
+    assert [gate.output_pins[0].State for gate in gates] == [1, 0, 0]
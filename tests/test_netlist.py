@@ -0,0 +1,85 @@
+"""
+    A compiled netlist must compute what the chip objects it was compiled from compute
+"""
+
+from __future__ import annotations
+
+import random
+
+from app.pins import InputSignalPin, OutputSignalPin
+from app.builtinchips import AndGate, OrGate, NotGate
+from app.chip import custom_chip_factory
+from app.netlist import compile_circuit, compile_chip
+from app.engine import NetlistSimulator
+
+from tests.test_scheduler import nor_latch
+
+
+def random_circuit(rng: random.Random):
+    """
+        Gates reading the inputs or earlier gates, with a few of them as outputs
+    """
+    inputs = [InputSignalPin() for _ in range(rng.randint(1, 5))]
+    pool = list(inputs)
+    for _ in range(rng.randint(1, 20)):
+        gate = rng.choice((AndGate, OrGate, NotGate))()
+        for pin in gate.input_pins:
+            rng.choice(pool).connect_to(pin)
+        pool.append(gate.output_pins[0])
+
+    outputs = []
+    for pin in rng.sample(pool, min(len(pool), 4)):
+        signal = OutputSignalPin()
+        pin.connect_to(signal)
+        outputs.append(signal)
+    return inputs, outputs
+
+
+def test_netlists_match_the_object_model():
+    rng = random.Random(5)
+    for _ in range(200):
+        inputs, outputs = random_circuit(rng)
+        sim = NetlistSimulator(compile_circuit('random', inputs, outputs))
+        assert sim.Outputs == [signal.State for signal in outputs]
+
+        for _ in range(8):
+            vector = [rng.randrange(2) for _ in inputs]
+            for signal, value in zip(inputs, vector):
+                signal.recv_signal(value)
+            assert sim.apply(vector) == [signal.State for signal in outputs]
+
+
+def test_latches_hold_in_both_models():
+    set_signal, reset_signal, q = nor_latch()
+    q_signal = OutputSignalPin()
+    q.connect_to(q_signal)
+    sim = NetlistSimulator(compile_circuit('latch', [set_signal, reset_signal], [q_signal]))
+
+    for vector in [(1, 0), (0, 0), (0, 1), (0, 0), (1, 0), (0, 0)]:
+        set_signal.recv_signal(vector[0])
+        reset_signal.recv_signal(vector[1])
+        assert sim.apply(vector) == [q_signal.State]
+
+
+def test_nested_chips_are_flattened():
+    inputs, outputs = random_circuit(random.Random(6))
+    inner = custom_chip_factory('INNER', inputs, outputs)
+
+    # two instances in a row, the second reading the outputs of the first
+    a = [InputSignalPin() for _ in inputs]
+    first, second = inner(), inner()
+    for signal, pin in zip(a, first.input_pins):
+        signal.connect_to(pin)
+    for i, pin in enumerate(second.input_pins):
+        first.output_pins[i % len(first.output_pins)].connect_to(pin)
+    out = [OutputSignalPin() for _ in second.output_pins]
+    for pin, signal in zip(second.output_pins, out):
+        pin.connect_to(signal)
+
+    sim = NetlistSimulator(compile_chip(custom_chip_factory('OUTER', a, out)()))
+    rng = random.Random(7)
+    for _ in range(16):
+        vector = [rng.randrange(2) for _ in a]
+        for signal, value in zip(a, vector):
+            signal.recv_signal(value)
+        assert sim.apply(vector) == [signal.State for signal in out]
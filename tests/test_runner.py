@@ -0,0 +1,50 @@
+"""
+    Sharded evaluation must give the same results as evaluating in one go, whatever the number of jobs
+"""
+
+from __future__ import annotations
+
+import random
+
+import pytest
+
+from app.pins import OutputSignalPin
+from app.builtinchips import AndGate, OrGate
+from app.netlist import compile_chip, compile_circuit
+from app.engine import truth_table
+from app.runner import ShardedRunner
+
+from tests.test_equivalence import random_netlist
+from tests.test_scheduler import nor_latch
+
+
+def test_runners_in_one_process_keep_their_own_circuit():
+    with ShardedRunner(compile_chip(AndGate()), jobs=1) as and_runner:
+        with ShardedRunner(compile_chip(OrGate()), jobs=1) as or_runner:
+            assert list(and_runner.exhaustive()) == [(0,), (0,), (0,), (1,)]
+            assert list(or_runner.exhaustive()) == [(0,), (1,), (1,), (1,)]
+            assert list(and_runner.run([(1, 1), (1, 0)])) == [(1,), (0,)]
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_sharded_results_match_the_truth_table(jobs):
+    rng = random.Random(4)
+    netlists = [netlist for netlist in (random_netlist(rng) for _ in range(20)) if netlist is not None]
+
+    for netlist in netlists[:5]:
+        expected = truth_table(netlist)
+        # tiny chunks, so every table is split across several tasks
+        with ShardedRunner(netlist, jobs=jobs, chunk_size=4) as runner:
+            assert list(runner.exhaustive()) == expected
+            vectors = [tuple((v >> i) & 1 for i in range(len(netlist.input_nets))) for v in range(len(expected))]
+            assert list(runner.run(vectors)) == expected
+            text = ''.join(runner.exhaustive_text())
+            assert text.splitlines() == [''.join(map(str, row)) for row in expected]
+
+
+def test_sequential_circuits_are_rejected():
+    set_signal, reset_signal, q = nor_latch()
+    output = OutputSignalPin()
+    q.connect_to(output)
+    with pytest.raises(ValueError):
+        ShardedRunner(compile_circuit('latch', [set_signal, reset_signal], [output]), jobs=1)
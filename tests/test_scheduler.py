@@ -0,0 +1,67 @@
+"""
+    Signals propagate in delta cycles: circuits with feedback either settle or
+    are reported as oscillating, in the object model and in netlists alike
+"""
+
+from __future__ import annotations
+
+from array import array
+
+import pytest
+
+from app.pins import InputSignalPin, OscillationError, scheduler
+from app.builtinchips import OrGate, NotGate
+from app.netlist import Netlist, GATE_NOT
+from app.engine import propagate
+
+
+def nor_latch():
+    """
+        SR latch of two cross coupled NOR gates, returns the set and reset signals and Q
+    """
+    set_signal, reset_signal = InputSignalPin(), InputSignalPin()
+    or_q, or_q_inv = OrGate(), OrGate()
+    not_q, not_q_inv = NotGate(), NotGate()
+
+    or_q.output_pins[0].connect_to(not_q.input_pins[0])
+    or_q_inv.output_pins[0].connect_to(not_q_inv.input_pins[0])
+    reset_signal.connect_to(or_q.input_pins[0])
+    not_q_inv.output_pins[0].connect_to(or_q.input_pins[1])
+    set_signal.connect_to(or_q_inv.input_pins[0])
+    not_q.output_pins[0].connect_to(or_q_inv.input_pins[1])
+
+    return set_signal, reset_signal, not_q.output_pins[0]
+
+
+def test_latch_settles_and_holds():
+    set_signal, reset_signal, q = nor_latch()
+
+    set_signal.recv_signal(1)
+    set_signal.recv_signal(0)
+    assert q.State == 1
+
+    reset_signal.recv_signal(1)
+    reset_signal.recv_signal(0)
+    assert q.State == 0
+
+
+def test_ring_oscillator_is_reported():
+    inverter = NotGate()
+    with pytest.raises(OscillationError):
+        inverter.output_pins[0].connect_to(inverter.input_pins[0])
+
+    # the scheduler is left clean, other circuits keep working
+    set_signal, _, q = nor_latch()
+    set_signal.recv_signal(1)
+    assert q.State == 1
+    assert not scheduler._frames
+
+
+def test_oscillating_netlist_is_reported():
+    # three inverters in a ring
+    netlist = Netlist(
+        'ring', array('b', [GATE_NOT] * 3), array('l', [0, 1, 2]), array('l', [-1] * 3), array('l', [1, 2, 0]),
+        bytearray(3), array('l'), array('l', [0]),
+    )
+    with pytest.raises(OscillationError):
+        propagate(netlist, netlist.new_state(), range(netlist.GateCount))
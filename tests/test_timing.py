@@ -0,0 +1,70 @@
+"""
+    Timed simulation follows the propagation delays of the gates, including in circuits that never settle
+"""
+
+from __future__ import annotations
+
+from array import array
+
+import pytest
+
+from app.pins import InputSignalPin, OutputSignalPin
+from app.builtinchips import AndGate, NotGate
+from app.netlist import Netlist, compile_circuit, GATE_NOT
+from app.timing import TimedSimulator, TimingWheel
+
+
+def ring_oscillator(length):
+    """
+        `length` inverters in a ring, net i is the input of inverter i
+    """
+    return Netlist(
+        'ring', array('b', [GATE_NOT] * length), array('l', range(length)), array('l', [-1] * length),
+        array('l', [(i + 1) % length for i in range(length)]), bytearray(length), array('l'), array('l', [0]),
+    )
+
+
+@pytest.mark.parametrize('length, delay', [(3, 1), (3, 2), (5, 3)])
+def test_ring_oscillator_period(length, delay):
+    sim = TimedSimulator(ring_oscillator(length), delays={GATE_NOT: delay})
+
+    changes = []
+    sim.on_change = lambda time, net, value: changes.append(time) if net == 0 else None
+    sim.run(max_time=40 * length * delay)
+
+    # net 0 toggles once per trip of the wave around the ring (half a period)
+    intervals = set(b - a for a, b in zip(changes[1:], changes[2:]))
+    assert intervals == {length * delay}
+
+
+def test_glitch_of_a_hazard_is_simulated():
+    # a AND NOT a pulses high for the inverter's delay after a rises
+    a = InputSignalPin()
+    inverter, and_gate = NotGate(), AndGate()
+    a.connect_to(inverter.input_pins[0])
+    a.connect_to(and_gate.input_pins[0])
+    inverter.output_pins[0].connect_to(and_gate.input_pins[1])
+    output = OutputSignalPin()
+    and_gate.output_pins[0].connect_to(output)
+
+    sim = TimedSimulator(compile_circuit('hazard', [a], [output]), delays={NotGate: 3, AndGate: 1})
+    out = sim.netlist.output_nets[0]
+    changes = []
+    sim.on_change = lambda time, net, value: changes.append((time, value)) if net == out else None
+
+    sim.set_input(0, 1, time=10)
+    sim.run()
+    assert changes == [(11, 1), (14, 0)]
+    assert sim.Outputs == [0]
+
+
+def test_timing_wheel_orders_far_events():
+    wheel = TimingWheel(size=4)
+    for time in (9, 2, 30, 2, 5):
+        wheel.schedule(time, time)
+
+    popped = []
+    while len(wheel):
+        time, events = wheel.pop()
+        popped.append((time, events))
+    assert popped == [(2, [2, 2]), (5, [5]), (9, [9]), (30, [30])]
@@ -0,0 +1,75 @@
+"""
+    Probes and waveform recording must observe a circuit without changing it
+"""
+
+from __future__ import annotations
+
+import io
+
+from app.pins import InputSignalPin, OutputSignalPin
+from app.builtinchips import AndGate, NotGate
+from app.netlist import compile_circuit
+from app.waveform import WaveformRecorder, CHANGE_SIZE
+
+
+def nand_circuit():
+    a, b, out = InputSignalPin(), InputSignalPin(), OutputSignalPin()
+    and_gate, not_gate = AndGate(), NotGate()
+    a.connect_to(and_gate.input_pins[0])
+    b.connect_to(and_gate.input_pins[1])
+    and_gate.output_pins[0].connect_to(not_gate.input_pins[0])
+    not_gate.output_pins[0].connect_to(out)
+    return a, b, out, and_gate
+
+
+def test_probes_do_not_change_the_compiled_circuit():
+    a, b, out, and_gate = nand_circuit()
+    before = compile_circuit('NAND', [a, b], [out]).signature()
+
+    recorder = WaveformRecorder()
+    recorder.watch_pin(a)
+    recorder.watch_pin(and_gate.output_pins[0])
+    assert compile_circuit('NAND', [a, b], [out]).signature() == before
+
+    recorder.close()
+    assert list(a.children) == [and_gate.input_pins[0]]
+
+
+def test_pin_changes_are_recorded_in_order():
+    a, b, out, and_gate = nand_circuit()
+    time = [0]
+    recorder = WaveformRecorder(time_source=lambda: time[0])
+    index = recorder.watch_pin(and_gate.output_pins[0], 'and')
+
+    for time[0], (x, y) in enumerate([(1, 0), (1, 1), (0, 1), (0, 0), (1, 1)], 1):
+        a.recv_signal(x)
+        b.recv_signal(y)
+
+    assert recorder.history(index) == [(2, 1), (3, 0), (5, 1)]
+    assert out.State == 0
+
+
+def test_the_oldest_changes_are_dropped():
+    recorder = WaveformRecorder(max_bytes=3 * CHANGE_SIZE)
+    index = recorder.add_signal('x')
+    for time in range(1, 6):
+        recorder.record(time, index, time & 1)
+
+    assert recorder.ChangeCount == 3
+    assert recorder.dropped == 2
+    assert recorder.history(index) == [(3, 1), (4, 0), (5, 1)]
+
+
+def test_changes_are_streamed_as_vcd():
+    stream = io.StringIO()
+    with WaveformRecorder(stream) as recorder:
+        bit = recorder.add_signal('bit')
+        bus = recorder.add_signal('a bus', 4, 3)
+        recorder.record(2, bit, 1)
+        recorder.record(2, bus, 9)
+        recorder.record(7, bit, 0)
+
+    text = stream.getvalue()
+    assert '$var wire 1 ! bit $end' in text
+    assert '$var wire 4 " a_bus $end' in text
+    assert text.endswith('#2\n1!\nb1001 "\n#7\n0!\n')